@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+Compare the Roaring containers of dense posting lists with the plain doc id arrays, e.g.
+    python3 benchmarks/bench_bitmaps.py -d dictionary.txt -p postings.txt
+
+Every posting list the index stored as Roaring containers is also turned into a plain PostingList, and the
+merges that NOT and OR queries over common terms run into are timed on both forms.
+"""
+import getopt
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexicon import Lexicon  # noqa: E402
+from postings import HEADER, PostingList, PostingsReader, RoaringPostingList, skip_positions  # noqa: E402
+
+REPEATS = 20
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file")
+
+
+def time_merge(merge):
+    return min(timeit.repeat(merge, number=1, repeat=REPEATS))
+
+
+def run_benchmark(dict_file, postings_file):
+    dictionary = Lexicon(dict_file)
+    reader = PostingsReader(postings_file)
+    terms = dict((term_id, term) for term, term_id in dictionary.terms())
+
+    dense = []
+    for term_id in dictionary:
+        _, offset, length = dictionary[term_id]
+        posting_list = reader.read(offset, length)
+        if isinstance(posting_list, RoaringPostingList):
+            dense.append((len(posting_list), terms[term_id], posting_list, length))
+    if len(dense) < 3:
+        print('The index has fewer than 3 dense posting lists, nothing to compare')
+        return
+    dense.sort(reverse=True)
+
+    roaring_bytes = sum(length for _, _, _, length in dense)
+    plain_bytes = sum(HEADER.size + (number_of_postings + len(skip_positions(number_of_postings))) * 4
+                      for number_of_postings, _, _, _ in dense)
+    print(f'{len(dense)} dense posting lists: ' + ', '.join(f'{term} ({length})' for length, term, _, _ in dense))
+    print(f'stored in {roaring_bytes} bytes, {plain_bytes} bytes as doc id arrays with skips\n')
+
+    (_, all_term, all_documents, _), (_, term_a, list_a, _), (_, term_b, list_b, _) = dense[:3]
+    plain = {id(posting_list): PostingList(posting_list.doc_ids) for posting_list in (all_documents, list_a, list_b)}
+
+    merges = [
+        (f'NOT {term_a}', PostingList.and_not_merge, RoaringPostingList.and_not_merge, all_documents, list_a),
+        (f'{term_a} OR {term_b}', PostingList.or_merge, RoaringPostingList.or_merge, list_a, list_b),
+        (f'{term_a} AND {term_b}', PostingList.and_merge, RoaringPostingList.and_merge, list_a, list_b),
+        (f'{term_a} AND NOT {term_b}', PostingList.and_not_merge, RoaringPostingList.and_not_merge, list_a, list_b),
+    ]
+    print(f'{"merge":40}{"arrays":>12}{"roaring":>12}')
+    for name, array_merge, roaring_merge, x, y in merges:
+        array_time = time_merge(lambda: array_merge(plain[id(x)], plain[id(y)]))
+        roaring_time = time_merge(lambda: roaring_merge(x, y))
+        print(f'{name:40}{array_time * 1e6:9.1f} us{roaring_time * 1e6:9.1f} us')
+    print(f'\n(NOT is evaluated as {all_term} AND NOT; sparse results are turned back into doc id arrays)')
+
+
+dictionary_file = postings_file = None
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None:
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file)
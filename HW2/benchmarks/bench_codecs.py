@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""
+Compare the postings codecs on an index that was already built with index.py, e.g.
+    python3 benchmarks/bench_codecs.py -d dictionary.txt -p postings.txt -q queries.txt
+
+The posting lists of the index are re-encoded with every codec into a temporary directory. For each codec we
+report the size of the postings file, the bytes per posting, how fast every list of the file is read back
+(and decoded), and the latency of the queries of the queries file run end to end through a SearchEngine.
+"""
+import contextlib
+import getopt
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexicon import Lexicon, write_lexicon  # noqa: E402
+from postings import CODEC_ENCODINGS, PostingsReader, encode_postings  # noqa: E402
+from search import SearchEngine  # noqa: E402
+
+REPEATS = 3
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries")
+
+
+def reencode(dictionary, reader, codec, directory):
+    """
+    Write the postings of the index with the given codec, returns the new dictionary and postings files.
+    """
+    dict_file, postings_file = os.path.join(directory, f'{codec}.dict'), os.path.join(directory, f'{codec}.postings')
+    entries = {}
+    with open(postings_file, 'wb') as write_postings:
+        for term_id in dictionary:
+            doc_frequency, offset, length = dictionary[term_id]
+            if length == 0:
+                continue
+            encoded_postings = encode_postings(reader.read(offset, length).doc_ids, codec)
+            entries[term_id] = (doc_frequency, write_postings.tell(), len(encoded_postings))
+            write_postings.write(encoded_postings)
+    write_lexicon(dict_file, dict(dictionary.terms()), entries)
+    return dict_file, postings_file
+
+
+def time_decode(dict_file, postings_file):
+    dictionary = Lexicon(dict_file)
+    with PostingsReader(postings_file) as reader:
+        locations = [dictionary[term_id][1:] for term_id in dictionary if dictionary[term_id][2] > 0]
+        timings = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            number_of_postings = sum(len(reader.read(offset, length)) for offset, length in locations)
+            timings.append(time.perf_counter() - start)
+    dictionary.close()
+    return number_of_postings, min(timings)
+
+
+def time_queries(dict_file, postings_file, queries):
+    engine = SearchEngine(dict_file, postings_file)
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):  # search() prints every query it runs
+        for query in queries:
+            start = time.perf_counter()
+            try:
+                str(engine.search(query))  # includes turning the result into the line of the results file
+            except ValueError:
+                continue  # a query that does not parse, search.py gives it an empty line
+            latencies.append(time.perf_counter() - start)
+    engine.close()
+    return latencies
+
+
+def run_benchmark(dict_file, postings_file, queries_file):
+    with open(queries_file, 'r') as queries:
+        query_lines = [query.strip() for query in queries if query.strip()]
+    dictionary = Lexicon(dict_file)
+    reader = PostingsReader(postings_file)
+    directory = tempfile.mkdtemp(prefix='codecs-')
+    try:
+        print(f'{"codec":8}{"postings file":>16}{"bytes/posting":>15}{"read + decode":>20}{"query p50":>12}{"query mean":>12}')
+        for codec in CODEC_ENCODINGS:
+            codec_dict_file, codec_postings_file = reencode(dictionary, reader, codec, directory)
+            size = os.path.getsize(codec_postings_file)
+            number_of_postings, decode_seconds = time_decode(codec_dict_file, codec_postings_file)
+            # warm up the page cache and the stem cache, then keep the best of a few rounds for every query
+            rounds = [time_queries(codec_dict_file, codec_postings_file, query_lines) for _ in range(REPEATS + 1)][1:]
+            latencies = [min(query_timings) for query_timings in zip(*rounds)]
+            print(f'{codec:8}{size:>10} bytes{size / number_of_postings:>15.2f}'
+                  f'{number_of_postings / decode_seconds / 1e6:>11.2f} M post/s'
+                  f'{statistics.median(latencies) * 1000:>9.2f} ms{statistics.mean(latencies) * 1000:>9.2f} ms')
+    finally:
+        reader.close()
+        dictionary.close()
+        shutil.rmtree(directory)
+    print('\n(array lists are read as zero-copy views of the postings file, so they are not decoded at all)')
+
+
+dictionary_file = postings_file = file_of_queries = None
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    elif o == '-q':
+        file_of_queries = a
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None or file_of_queries == None:
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file, file_of_queries)
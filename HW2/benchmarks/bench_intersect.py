@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""
+Micro-benchmark of the intersection strategies of PostingList.and_merge on the posting lists of a real index, e.g.
+    python3 benchmarks/bench_intersect.py -d dictionary.txt -p postings.txt
+
+Pairs of terms are drawn at random from the dictionary, so their lengths follow the document frequency
+distribution of the indexed collection. The pairs are grouped by the ratio of their lengths, and every
+strategy (plus the automatic choice) is timed on every group.
+"""
+import getopt
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexicon import Lexicon  # noqa: E402
+from postings import INTERSECTION_STRATEGIES, PostingsReader  # noqa: E402
+
+PAIRS_PER_BUCKET = 200
+RATIO_BUCKETS = [1, 4, 16, 64, 256, 1024]  # lower bounds of the length ratio buckets
+REPEATS = 3
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-s seed]")
+
+
+def ratio_bucket(length_a, length_b):
+    ratio = max(length_a, length_b) / max(1, min(length_a, length_b))
+    return max(bucket for bucket in RATIO_BUCKETS if ratio >= bucket)
+
+
+def run_benchmark(dict_file, postings_file, seed):
+    dictionary = Lexicon(dict_file)
+    reader = PostingsReader(postings_file)
+    posting_lists = [reader.read(*dictionary[term_id][1:]) for term_id in dictionary]
+
+    lengths = sorted(len(posting_list) for posting_list in posting_lists)
+    print(f'{len(lengths)} posting lists, length percentiles: '
+          + ', '.join(f'p{p}={lengths[min(len(lengths) - 1, len(lengths) * p // 100)]}' for p in (50, 90, 99, 100)))
+
+    # draw random pairs until every ratio bucket is full (or we give up on the rare ones)
+    rng = random.Random(seed)
+    buckets = {bucket: [] for bucket in RATIO_BUCKETS}
+    for _ in range(PAIRS_PER_BUCKET * len(RATIO_BUCKETS) * 50):
+        a, b = rng.choice(posting_lists), rng.choice(posting_lists)
+        pairs = buckets[ratio_bucket(len(a), len(b))]
+        if len(pairs) < PAIRS_PER_BUCKET:
+            pairs.append((a, b))
+        if all(len(pairs) == PAIRS_PER_BUCKET for pairs in buckets.values()):
+            break
+
+    strategies = INTERSECTION_STRATEGIES + [None]  # None lets and_merge choose
+    header = ''.join(f'{strategy or "auto":>10}' for strategy in strategies)
+    print(f'\nmicroseconds per intersection\n{"length ratio":>14}{"pairs":>7}{header}')
+    for bucket, pairs in buckets.items():
+        if not pairs:
+            continue
+        timings = []
+        for strategy in strategies:
+            seconds = min(timeit.repeat(lambda: [a.and_merge(b, strategy) for a, b in pairs], number=1, repeat=REPEATS))
+            timings.append(seconds / len(pairs) * 1e6)
+        print(f'{">= " + str(bucket):>14}{len(pairs):>7}' + ''.join(f'{timing:10.1f}' for timing in timings))
+
+
+dictionary_file = postings_file = None
+seed = 3245
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:s:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    elif o == '-s':
+        seed = int(a)
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None:
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file, seed)
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Throughput of `search.py --jobs N` for a growing number of processes, e.g.
+    python3 benchmarks/bench_jobs.py -d dictionary.txt -p postings.txt -n 5000
+
+A queries file of random Boolean queries over the terms of the dictionary is generated, and run_search is
+timed on it with 1, 2, 4, ... processes (up to -j, by default the number of cores). Every run has to write
+exactly the same results file as the single process run.
+"""
+import contextlib
+import filecmp
+import getopt
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexicon import Lexicon  # noqa: E402
+from search import OPERATORS, run_search  # noqa: E402
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-n number-of-queries] [-j max-jobs] [-s seed]")
+
+
+def random_queries(dict_file, number_of_queries, seed):
+    dictionary = Lexicon(dict_file)
+    terms = [term for term, _ in dictionary.terms()
+             if term.isalnum() and term.upper() not in OPERATORS and term != 'all_documents_combined']
+    dictionary.close()
+
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(number_of_queries):
+        operands = [('NOT ' if rng.random() < 0.2 else '') + rng.choice(terms) for _ in range(rng.randint(1, 4))]
+        query = operands[0]
+        for operand in operands[1:]:
+            query += f' {rng.choice(["AND", "OR"])} {operand}'
+        queries.append(query)
+    return queries
+
+
+def run_benchmark(dict_file, postings_file, number_of_queries, max_jobs, seed):
+    directory = tempfile.mkdtemp(prefix='jobs-')
+    try:
+        queries_file = os.path.join(directory, 'queries.txt')
+        with open(queries_file, 'w') as write_queries:
+            write_queries.write('\n'.join(random_queries(dict_file, number_of_queries, seed)) + '\n')
+
+        jobs_to_run = [1]
+        while jobs_to_run[-1] * 2 <= max_jobs:
+            jobs_to_run.append(jobs_to_run[-1] * 2)
+        if jobs_to_run[-1] != max_jobs:
+            jobs_to_run.append(max_jobs)
+
+        # warm up: the first run pays for importing NLTK and for reading the index files from disk
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_search(dict_file, postings_file, queries_file, os.path.join(directory, 'warm-up.txt'))
+
+        print(f'{number_of_queries} random queries, {os.cpu_count()} cores')
+        print(f'{"jobs":>6}{"seconds":>10}{"queries/s":>12}{"speedup":>10}')
+        single_process_seconds = None
+        for jobs in jobs_to_run:
+            results_file = os.path.join(directory, f'results-{jobs}.txt')
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_search(dict_file, postings_file, queries_file, results_file, jobs=jobs)
+            seconds = time.perf_counter() - start
+            single_process_seconds = single_process_seconds or seconds
+            if not filecmp.cmp(results_file, os.path.join(directory, 'results-1.txt'), shallow=False):
+                print(f'results with {jobs} jobs differ from the single process run!')
+            print(f'{jobs:>6}{seconds:>10.2f}{number_of_queries / seconds:>12.1f}{single_process_seconds / seconds:>9.2f}x')
+    finally:
+        shutil.rmtree(directory)
+
+
+# the worker processes of run_search may import this module, so only parse arguments when run as a script
+if __name__ == '__main__':
+    dictionary_file = postings_file = None
+    number_of_queries = 2000
+    max_jobs = os.cpu_count() or 1
+    seed = 3245
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:n:j:s:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            number_of_queries = int(a)
+        elif o == '-j':
+            max_jobs = int(a)
+        elif o == '-s':
+            seed = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    run_benchmark(dictionary_file, postings_file, number_of_queries, max_jobs, seed)
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+"""
+Benchmark the iterative array merges in postings.py against the old recursive linked-list merges
+(PostingList.sortedMerge from index.py and PostingList.and_merge from search.py, copied below).
+
+Both are run on the longest posting list of an index built by index.py (the one build_index reports)
+and the second longest one, e.g.
+    python3 benchmarks/bench_merges.py -d dictionary.txt -p postings.txt
+"""
+import getopt
+import os
+import sys
+import threading
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexicon import Lexicon  # noqa: E402
+from postings import PostingsReader, skip_positions  # noqa: E402
+
+REPEATS = 5
+
+
+### LEGACY CODE (linked lists + recursion) ###
+class Posting:
+    def __init__(self, data):
+        self.doc_id = data
+        self.next = None
+        self.skip = None
+
+
+def to_linked_list(doc_ids):
+    head = None
+    nodes = [Posting(doc_id) for doc_id in doc_ids]
+    for node, next_node in zip(nodes, nodes[1:]):
+        node.next = next_node
+    if nodes:
+        head = nodes[0]
+        skips = list(skip_positions(len(nodes)))
+        for skip_from, skip_to in zip(skips, skips[1:]):
+            nodes[skip_from].skip = nodes[skip_to]
+    return head
+
+
+def legacy_sorted_merge(a, b):
+    if a is None:
+        return b
+    elif b is None:
+        return a
+    if a.doc_id <= b.doc_id:
+        result = a
+        result.next = legacy_sorted_merge(a.next, b)
+    else:
+        result = b
+        result.next = legacy_sorted_merge(a, b.next)
+    return result
+
+
+def legacy_and_merge(a, b):
+    if a is None or b is None:
+        return None
+    if a.doc_id == b.doc_id:
+        result = a
+        result.next = legacy_and_merge(a.next, b)
+    elif a.doc_id < b.doc_id:
+        if a.next is None:
+            return None
+        if a.skip is not None and b.doc_id - a.skip.doc_id >= 0:
+            result = legacy_and_merge(a.skip, b)
+        else:
+            result = legacy_and_merge(a.next, b)
+    else:
+        if b.next is None:
+            return None
+        if b.skip is not None and a.doc_id - b.skip.doc_id >= 0:
+            result = legacy_and_merge(a, b.skip)
+        else:
+            result = legacy_and_merge(a, b.next)
+    return result
+### END OF LEGACY CODE ###
+
+
+def time_legacy(merge, doc_ids_a, doc_ids_b):
+    """
+    The legacy merges relink the nodes they are given, so fresh lists are built (untimed) for every run.
+    They also need one stack frame per posting, hence the raised recursion limit and the big thread stack.
+    """
+    timings = []
+
+    def run():
+        for _ in range(REPEATS):
+            a, b = to_linked_list(doc_ids_a), to_linked_list(doc_ids_b)
+            start = timeit.default_timer()
+            merge(a, b)
+            timings.append(timeit.default_timer() - start)
+
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 * 1024 * 1024)
+    worker = threading.Thread(target=run)
+    worker.start()
+    worker.join()
+    return min(timings) if len(timings) == REPEATS else None
+
+
+def time_iterative(merge):
+    return min(timeit.repeat(merge, number=1, repeat=REPEATS))
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file")
+
+
+def run_benchmark(dict_file, postings_file):
+    dictionary = Lexicon(dict_file)
+    reader = PostingsReader(postings_file)
+    # rank by the size of the stored postings, since all_documents_combined has a document frequency of 0
+    longest = sorted(dictionary, key=lambda term_id: dictionary[term_id][2], reverse=True)[:2]
+    list_a, list_b = (reader.read(*dictionary[term_id][1:]) for term_id in longest)
+    doc_ids_a, doc_ids_b = list(list_a.doc_ids), list(list_b.doc_ids)
+    print(f'Merging posting lists of length {len(doc_ids_a)} and {len(doc_ids_b)}')
+
+    results = [
+        ('OR', time_legacy(legacy_sorted_merge, doc_ids_a, doc_ids_b), time_iterative(lambda: list_a.or_merge(list_b))),
+        ('AND', time_legacy(legacy_and_merge, doc_ids_a, doc_ids_b), time_iterative(lambda: list_a.and_merge(list_b))),
+        ('AND NOT', None, time_iterative(lambda: list_a.and_not_merge(list_b))),
+    ]
+    for operation, legacy_time, iterative_time in results:
+        legacy = f'{legacy_time * 1000:8.2f} ms' if legacy_time is not None else '     n/a   '
+        print(f'{operation:8} legacy (recursive): {legacy}    iterative: {iterative_time * 1000:8.2f} ms')
+
+
+dictionary_file = postings_file = None
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None:
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file)
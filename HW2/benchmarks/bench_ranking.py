@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""
+Postings scored and latency of the ranking strategies of ranking.py, e.g.
+    python3 benchmarks/bench_ranking.py -d dictionary.txt -p postings.txt -n 500 -k 10
+
+Runs the free-text queries of a file (-q, one per line) or random queries of 2 to 5 terms drawn from the
+dictionary, weighted by document frequency so common terms show up as often as they do in real queries. Every
+query is ranked exhaustively, with WAND and with Block-Max WAND; the pruned strategies have to return exactly the
+same top k (doc ids and scores) as the exhaustive one.
+"""
+import getopt
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ranking  # noqa: E402
+from search import OPERATORS, SearchEngine  # noqa: E402
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-q file-of-queries | -n number-of-queries] "
+          "[-k top-k] [-s seed]")
+
+
+def random_queries(engine, number_of_queries, seed):
+    dictionary = engine.dictionary
+    terms = [(term, dictionary[term_id][0]) for term, term_id in dictionary.terms()
+             if term.isalpha() and term.upper() not in OPERATORS and term_id in dictionary]
+    rng = random.Random(seed)
+    population = [term for term, _ in terms]
+    frequencies = [document_frequency for _, document_frequency in terms]
+    return [' '.join(rng.choices(population, frequencies, k=rng.randint(2, 5))) for _ in range(number_of_queries)]
+
+
+def run_benchmark(dict_file, postings_file, queries, k):
+    engine = SearchEngine(dict_file, postings_file)
+    # every strategy gets the same (already read) posting lists, only the scoring is timed
+    term_postings = [engine.ranked_postings(query) for query in queries]
+    norms, average = engine.document_norms, engine.average_document_length
+
+    print(f'{len(queries)} queries, top {k}, {engine.number_of_documents} documents')
+    print(f'{"strategy":>16}{"postings scored":>17}{"per query":>11}{"ms/query":>10}{"speedup":>10}')
+    expected = exhaustive_seconds = None
+    for strategy in ranking.RANKING_STRATEGIES:
+        results = []
+        scored = 0
+        start = time.perf_counter()
+        for postings in term_postings:
+            top, postings_scored = ranking.rank(postings, norms, average, k, strategy)
+            results.append(top)
+            scored += postings_scored
+        seconds = time.perf_counter() - start
+        expected = expected or results
+        exhaustive_seconds = exhaustive_seconds or seconds
+        if results != expected:
+            print(f'{strategy} returns other documents than the exhaustive ranking!')
+        print(f'{strategy:>16}{scored:>17}{scored / len(queries):>11.0f}{seconds * 1000 / len(queries):>10.2f}'
+              f'{exhaustive_seconds / seconds:>9.2f}x')
+    engine.close()
+
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = None
+    number_of_queries = 500
+    k = ranking.TOP_K
+    seed = 3245
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:n:k:s:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-n':
+            number_of_queries = int(a)
+        elif o == '-k':
+            k = int(a)
+        elif o == '-s':
+            seed = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    if file_of_queries is not None:
+        with open(file_of_queries, 'r') as queries_file:
+            queries = [line.strip() for line in queries_file if line.strip()]
+    else:
+        engine = SearchEngine(dictionary_file, postings_file)
+        queries = random_queries(engine, number_of_queries, seed)
+        engine.close()
+    run_benchmark(dictionary_file, postings_file, queries, k)
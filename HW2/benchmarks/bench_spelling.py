@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""
+Latency of spelling suggestions, e.g.
+    python3 benchmarks/bench_spelling.py -d dictionary.txt -p postings.txt -n 2000
+
+Misspellings are made from random terms of the spelling index with one or two random edits (insert, delete,
+substitute or swap two neighbours) that leave the dictionary. Every misspelling is looked up with the symmetric
+delete index, and the first few also by computing the edit distance to every term of the vocabulary. Both
+have to find the same closest terms.
+"""
+import getopt
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spelling  # noqa: E402
+from search import SearchEngine  # noqa: E402
+
+SCANNED = 20  # the scan of the vocabulary takes a good part of a second per misspelling, so only this many
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-n number-of-misspellings] [-s seed]")
+
+
+def misspell(term, edits, rng):
+    for _ in range(edits):
+        i = rng.randrange(len(term))
+        edit = rng.choice(['insert', 'delete', 'substitute', 'swap'] if len(term) > 1 else ['insert', 'substitute'])
+        if edit == 'insert':
+            term = term[:i] + rng.choice(string.ascii_lowercase) + term[i:]
+        elif edit == 'delete':
+            term = term[:i] + term[i + 1:]
+        elif edit == 'substitute':
+            term = term[:i] + rng.choice(string.ascii_lowercase) + term[i + 1:]
+        else:
+            i = min(i, len(term) - 2)
+            term = term[:i] + term[i + 1] + term[i] + term[i + 2:]
+    return term
+
+
+def random_misspellings(terms, number_of_misspellings, edits, seed):
+    rng = random.Random(seed)
+    known = set(terms)
+    words = [term for term in terms if len(term) >= 4]
+    misspellings = []
+    while len(misspellings) < number_of_misspellings:
+        misspelling = misspell(rng.choice(words), edits, rng)
+        if misspelling not in known and spelling.is_word(misspelling):
+            misspellings.append(misspelling)
+    return misspellings
+
+
+def scan(terms, misspelling, max_distance):
+    found = [(term, distance) for term in terms
+             for distance in [spelling.edit_distance(misspelling, term, max_distance)] if distance <= max_distance]
+    closest = min((distance for _, distance in found), default=None)
+    return [(term, distance) for term, distance in found if distance == closest]
+
+
+def timed(function, arguments):
+    start = time.perf_counter()
+    results = [function(argument) for argument in arguments]
+    return results, time.perf_counter() - start
+
+
+def run_benchmark(dict_file, postings_file, number_of_misspellings, seed):
+    engine = SearchEngine(dict_file, postings_file)
+    start = time.perf_counter()
+    spelling_index = engine.spelling_index
+    open_seconds = time.perf_counter() - start
+    if spelling_index is None:
+        print(f'{spelling.spelling_path(dict_file)} does not exist, rebuild the index with index.py')
+        sys.exit(1)
+    terms = spelling_index.terms
+
+    print(f'{len(terms)} terms, {len(spelling_index.delete_numbers)} deletes, opened in {open_seconds * 1000:.0f} ms')
+    print(f'{"":>28}{"us/lookup":>12}{"suggestions":>13}')
+    for edits in range(1, spelling_index.max_edit_distance + 1):
+        misspellings = random_misspellings(terms, number_of_misspellings, edits, seed)
+        suggestions, seconds = timed(spelling_index.lookup, misspellings)
+        print(f'{f"{edits} edit(s), delete index":>28}{seconds * 1e6 / len(misspellings):>12.1f}'
+              f'{sum(map(len, suggestions)) / len(misspellings):>13.2f}')
+
+        scanned = misspellings[:SCANNED]
+        scans, scan_seconds = timed(lambda misspelling: scan(terms, misspelling, spelling_index.max_edit_distance),
+                                    scanned)
+        if [sorted(found) for found in suggestions[:SCANNED]] != [sorted(found) for found in scans]:
+            print('the delete index and the scan suggest different terms!')
+        print(f'{f"{edits} edit(s), vocabulary scan":>28}{scan_seconds * 1e6 / len(scanned):>12.1f}')
+    engine.close()
+
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = None
+    number_of_misspellings = 2000
+    seed = 3245
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:n:s:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            number_of_misspellings = int(a)
+        elif o == '-s':
+            seed = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    run_benchmark(dictionary_file, postings_file, number_of_misspellings, seed)
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""
+Measure the time from process start to the first query answered, e.g.
+    python3 benchmarks/bench_startup.py -d dictionary.txt -p postings.txt -q "bank AND rate"
+
+Every run starts a fresh interpreter that imports search.py, creates a SearchEngine and answers the query.
+The child reports when the import finished and when the query was answered; both are relative to the
+moment the parent started the process.
+"""
+import getopt
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HW2_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 10
+
+CHILD = '''
+import sys, time
+sys.path.insert(0, {directory!r})
+import search
+imported = time.time()
+engine = search.SearchEngine({dict_file!r}, {postings_file!r})
+result = engine.search({query!r})
+answered = time.time()
+print(imported, answered, len(result) if result is not None else 0, file=sys.stderr)
+'''
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q query")
+
+
+def run_benchmark(dict_file, postings_file, query):
+    child = CHILD.format(directory=HW2_DIRECTORY, dict_file=os.path.abspath(dict_file),
+                         postings_file=os.path.abspath(postings_file), query=query)
+    import_times, first_query_times = [], []
+    for _ in range(RUNS):
+        started = time.time()
+        completed = subprocess.run([sys.executable, '-c', child], stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True, check=True)
+        imported, answered, number_of_results = completed.stderr.split()[-3:]
+        import_times.append(float(imported) - started)
+        first_query_times.append(float(answered) - started)
+
+    print(f'Query {query!r} ({number_of_results} results), median of {RUNS} runs:')
+    print(f'    process start -> search.py imported:     {statistics.median(import_times) * 1000:8.1f} ms')
+    print(f'    process start -> first query answered:   {statistics.median(first_query_times) * 1000:8.1f} ms')
+
+
+dictionary_file = postings_file = query = None
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    elif o == '-q':
+        query = a
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None or query == None:
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file, query)
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""
+Cost of wildcard queries, e.g.
+    python3 benchmarks/bench_wildcards.py -d dictionary.txt -p postings.txt -n 500
+
+Random patterns (a prefix, a suffix, or both around a *) are cut from the words of the k-gram index, and every
+pattern is expanded twice: with the k-gram index, and with a regular expression over the whole vocabulary. The
+posting lists of the expanded terms are then ORed with a chain of pairwise or_merges and with the single k-way
+or_merge_all. Both pairs have to agree.
+"""
+import functools
+import getopt
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wildcards  # noqa: E402
+from postings import PostingList, or_merge_all  # noqa: E402
+from search import SearchEngine  # noqa: E402
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-n number-of-patterns] [-s seed]")
+
+
+def random_patterns(words, number_of_patterns, seed):
+    rng = random.Random(seed)
+    words = [word for word in words if len(word) >= 4 and word.isalpha()]
+    patterns = []
+    while len(patterns) < number_of_patterns:
+        word = rng.choice(words)
+        cut = rng.randint(2, len(word) - 1)
+        kind = rng.choice(['prefix', 'suffix', 'infix'])
+        if kind == 'prefix':
+            patterns.append(word[:cut] + wildcards.WILDCARD)
+        elif kind == 'suffix':
+            patterns.append(wildcards.WILDCARD + word[cut - 1:])
+        else:
+            patterns.append(word[:1] + wildcards.WILDCARD + word[cut:])
+    return patterns
+
+
+def timed(function, arguments):
+    start = time.perf_counter()
+    results = [function(argument) for argument in arguments]
+    return results, time.perf_counter() - start
+
+
+def run_benchmark(dict_file, postings_file, number_of_patterns, seed):
+    engine = SearchEngine(dict_file, postings_file)
+    kgram_index = engine.kgram_index
+    patterns = random_patterns(kgram_index.words, number_of_patterns, seed)
+
+    def scan(pattern):
+        regex = wildcards.pattern_regex(pattern)
+        return [word_id for word_id, word in enumerate(kgram_index.words) if regex.fullmatch(word)]
+
+    print(f'{len(patterns)} patterns over {len(kgram_index.words)} words, {len(kgram_index.gram_numbers)} k-grams')
+    print(f'{"":>28}{"ms/pattern":>12}')
+    kgram_matches, kgram_seconds = timed(kgram_index.matching_words, patterns)
+    scan_matches, scan_seconds = timed(scan, patterns)
+    if kgram_matches != scan_matches:
+        print('the k-gram index and the scan match different words!')
+    print(f'{"expand, k-gram index":>28}{kgram_seconds * 1000 / len(patterns):>12.3f}')
+    print(f'{"expand, vocabulary scan":>28}{scan_seconds * 1000 / len(patterns):>12.3f}')
+
+    # the same (already read) lists for both merges
+    term_lists = [[engine.search_term(term) for term in kgram_index.expand(pattern)] for pattern in patterns]
+    term_lists = [[posting_list for posting_list in lists if posting_list is not None] for lists in term_lists]
+    expansions = sum(map(len, term_lists))
+
+    def pairwise(lists):
+        return functools.reduce(lambda a, b: a.or_merge(b), lists) if lists else PostingList()
+
+    pairwise_results, pairwise_seconds = timed(pairwise, term_lists)
+    kway_results, kway_seconds = timed(or_merge_all, term_lists)
+    if [list(result) for result in pairwise_results] != [list(result) for result in kway_results]:
+        print('the pairwise and the k-way unions differ!')
+    print(f'{"OR, pairwise or_merge":>28}{pairwise_seconds * 1000 / len(patterns):>12.3f}'
+          f'    ({expansions / len(patterns):.1f} terms per pattern)')
+    print(f'{"OR, k-way or_merge_all":>28}{kway_seconds * 1000 / len(patterns):>12.3f}')
+    engine.close()
+
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = None
+    number_of_patterns = 500
+    seed = 3245
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:n:s:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            number_of_patterns = int(a)
+        elif o == '-s':
+            seed = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    run_benchmark(dictionary_file, postings_file, number_of_patterns, seed)
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""
+Load generator for `search.py --serve`. Opens a number of concurrent connections that replay the queries of a
+queries file (round robin) and reports latency percentiles and throughput, e.g.
+    python3 search.py -d dictionary.txt -p postings.txt --serve --port 3245 &
+    python3 benchmarks/loadgen.py -q queries.txt --port 3245 -c 8 -n 2000
+"""
+import asyncio
+import getopt
+import itertools
+import sys
+import time
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 3245
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def client(connect, queries, requests, latencies, errors):
+    reader, writer = await connect()
+    try:
+        for query in itertools.islice(queries, requests):
+            start = time.perf_counter()
+            writer.write(query.encode('utf-8') + b'\n')
+            await writer.drain()
+            answer = await reader.readline()
+            latencies.append(time.perf_counter() - start)
+            if not answer or answer.startswith(b'ERROR'):
+                errors.append(answer)
+    finally:
+        writer.close()
+
+
+async def run_load(connect, queries, connections, total_requests):
+    latencies, errors = [], []
+    requests_per_connection = [total_requests // connections + (i < total_requests % connections)
+                               for i in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(connect, itertools.cycle(queries[i % len(queries):] + queries[:i % len(queries)]),
+                                  requests, latencies, errors)
+                           for i, requests in enumerate(requests_per_connection)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f'{len(latencies)} queries over {connections} connections in {elapsed:.2f}s ({len(errors)} errors)')
+    print(f'    throughput: {len(latencies) / elapsed:10.1f} queries/s')
+    for name, fraction in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+        print(f'    {name}:        {percentile(latencies, fraction) * 1000:10.2f} ms')
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -q file-of-queries [--port N | --socket path] [-c connections] [-n requests]")
+
+
+queries_file = unix_socket = None
+port = DEFAULT_PORT
+connections = 4
+total_requests = 1000
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'q:c:n:', ['port=', 'socket='])
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-q':
+        queries_file = a
+    elif o == '-c':  # number of concurrent connections
+        connections = int(a)
+    elif o == '-n':  # total number of queries sent
+        total_requests = int(a)
+    elif o == '--port':
+        port = int(a)
+    elif o == '--socket':
+        unix_socket = a
+    else:
+        assert False, "unhandled option"
+
+if queries_file == None:
+    usage()
+    sys.exit(2)
+
+with open(queries_file, 'r') as queries:
+    query_lines = [query.strip() for query in queries if query.strip()]
+
+if unix_socket is not None:
+    def connect():
+        return asyncio.open_unix_connection(unix_socket)
+else:
+    def connect():
+        return asyncio.open_connection(DEFAULT_HOST, port)
+
+asyncio.run(run_load(connect, query_lines, connections, total_requests))
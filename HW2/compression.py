@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""
+Codecs for sorted doc id lists. Both store the gaps between consecutive doc ids (the first doc id is its gap
+from 0), which are small numbers for every term that occurs in more than a handful of documents:
+
+vbyte    variable-byte encoding (as in Introduction to Information Retrieval, 5.3.1): 7 bits of the gap per
+         byte, most significant group first, and the high bit set on the last byte of every gap.
+pfor     block-packed PForDelta: gaps are packed in blocks of PFOR_BLOCK_SIZE with the smallest bit width that
+         fits PFOR_FIT of them. The remaining gaps (the exceptions) keep their low bits in the packed block and
+         have their high bits patched in from a side table.
+"""
+import array
+import itertools
+import math
+import struct
+
+PFOR_BLOCK_SIZE = 128
+PFOR_FIT = 0.9  # fraction of the gaps of a block that must fit into its bit width
+# bit width, number of exceptions, number of gaps in the block
+PFOR_BLOCK = struct.Struct('=BBH')
+PFOR_EXCEPTION_TYPECODE = 'I'  # high bits of an exception
+assert array.array(PFOR_EXCEPTION_TYPECODE).itemsize == 4
+ONE_BYTE_GAPS = bytes(byte & 127 for byte in range(256))  # bytes.translate table that drops the stop bit
+
+
+def gaps_of(doc_ids):
+    return [doc_id - previous for previous, doc_id in zip(itertools.chain([0], doc_ids), doc_ids)]
+
+
+def doc_ids_of(gaps):
+    return list(itertools.accumulate(gaps))
+
+
+def vbyte_encode(doc_ids):
+    encoded = bytearray()
+    for gap in gaps_of(doc_ids):
+        if gap < 128:
+            encoded.append(gap | 128)  # by far the most common case: a one byte gap
+            continue
+        groups = []
+        while gap >= 128:
+            groups.append(gap & 127)
+            gap >>= 7
+        groups.append(gap)
+        groups.reverse()
+        groups[-1] |= 128
+        encoded += bytes(groups)
+    return bytes(encoded)
+
+
+def vbyte_decode(data, number_of_postings):
+    """
+    Decode number_of_postings doc ids from the start of data. Returns the doc ids and the number of bytes read.
+    """
+    if number_of_postings == 0:
+        return [], 0
+    head = bytes(data[:number_of_postings])
+    if len(head) == number_of_postings and min(head) >= 128:
+        # every gap fits into a single byte (typical for the longer lists), so the stop bits can be dropped in C
+        return doc_ids_of(head.translate(ONE_BYTE_GAPS)), number_of_postings
+    gaps = []
+    append = gaps.append
+    gap = 0
+    position = 0
+    for position, byte in enumerate(data):
+        if byte < 128:
+            gap = (gap << 7) | byte
+        else:
+            append((gap << 7) | (byte & 127))
+            gap = 0
+            if len(gaps) == number_of_postings:
+                break
+    if len(gaps) != number_of_postings:
+        raise ValueError(f'vbyte data ends after {len(gaps)} of {number_of_postings} postings')
+    return doc_ids_of(gaps), position + 1
+
+
+def pfor_bit_width(gaps):
+    """
+    The smallest bit width that holds at least PFOR_FIT of the gaps.
+    """
+    ordered = sorted(gaps)
+    return ordered[max(0, math.ceil(len(ordered) * PFOR_FIT) - 1)].bit_length()
+
+
+def pfor_encode(doc_ids):
+    encoded = bytearray()
+    gaps = gaps_of(doc_ids)
+    for start in range(0, len(gaps), PFOR_BLOCK_SIZE):
+        block = gaps[start:start + PFOR_BLOCK_SIZE]
+        bit_width = pfor_bit_width(block)
+        mask = (1 << bit_width) - 1
+        exceptions = [(i, gap >> bit_width) for i, gap in enumerate(block) if gap > mask]
+
+        packed = 0
+        for i, gap in enumerate(block):
+            packed |= (gap & mask) << (i * bit_width)
+        encoded += PFOR_BLOCK.pack(bit_width, len(exceptions), len(block))
+        encoded += packed.to_bytes((len(block) * bit_width + 7) // 8, 'little')
+        encoded += bytes(i for i, _ in exceptions)
+        encoded += array.array(PFOR_EXCEPTION_TYPECODE, [high for _, high in exceptions]).tobytes()
+    return bytes(encoded)
+
+
+def pfor_decode(data, number_of_postings):
+    """
+    Decode number_of_postings doc ids from the start of data. Returns the doc ids and the number of bytes read.
+    """
+    gaps = []
+    position = 0
+    while len(gaps) < number_of_postings:
+        if position + PFOR_BLOCK.size > len(data):
+            raise ValueError(f'pfor data ends after {len(gaps)} of {number_of_postings} postings')
+        bit_width, number_of_exceptions, number_of_gaps = PFOR_BLOCK.unpack_from(data, position)
+        position += PFOR_BLOCK.size
+        packed_end = position + (number_of_gaps * bit_width + 7) // 8
+        packed = int.from_bytes(data[position:packed_end], 'little')
+        mask = (1 << bit_width) - 1
+        block = [(packed >> shift) & mask for shift in range(0, number_of_gaps * bit_width, bit_width)] if bit_width else [0] * number_of_gaps
+
+        exception_positions = data[packed_end:packed_end + number_of_exceptions]
+        highs_end = packed_end + number_of_exceptions * 5
+        if highs_end > len(data):
+            raise ValueError(f'pfor data ends in the block after {len(gaps)} of {number_of_postings} postings')
+        highs = array.array(PFOR_EXCEPTION_TYPECODE)
+        highs.frombytes(data[packed_end + number_of_exceptions:highs_end])
+        for i, high in zip(exception_positions, highs):
+            block[i] |= high << bit_width  # patch the exception
+        gaps.extend(block)
+        position = highs_end
+    if len(gaps) != number_of_postings:
+        raise ValueError(f'pfor blocks hold {len(gaps)} postings instead of {number_of_postings}')
+    return doc_ids_of(gaps), position
+
+
+# codec name -> (encode, decode)
+CODECS = {
+    'vbyte': (vbyte_encode, vbyte_decode),
+    'pfor': (pfor_encode, pfor_decode),
+}
@@ -1,308 +1,490 @@
 #!/usr/bin/python3
-import bisect
-import math
+import array
+import collections
+import functools
+import heapq
+import itertools
+import multiprocessing
 import os
-import pickle
 import re
+import shutil
+import struct
+import tempfile
+import time
 import nltk
 import sys
 import getopt
 
-sys.setrecursionlimit(
-    100000)  # had to set recursion limit since some linked lists are long and leads to a lot of recursion
+import lexicon
+import positions
+import postings
+import segments
+import spelling
+import stemming
+import weights
+import wildcards
 
 """nltk.download('reuters')
 nltk.download('punkt')
 nltk.download('stopwords')"""
 
-PORTER_STEMMER = nltk.stem.porter.PorterStemmer()
+STEM_CACHE = stemming.StemCache()
 STOP_WORDS = set(nltk.corpus.stopwords.words('english') + [".", ",", ";", ":"])
-NUMBER_OF_BLOCKS = 10
-
-
-class Posting:
-    def __init__(self, data):
-        self.doc_id = data
-        self.next = None
-        self.skip = None
-
-    def __repr__(self):
-        return str(self.doc_id) + str(f' ({self.skip.doc_id})') if self.skip is not None else str(self.doc_id)
-
-
-class PostingList:
-    def __init__(self):
-        self.head = None
-        self.length = 1
-
-    def add_first(self, node):
-        node.next = self.head
-        self.head = node
-
-    def convert_to_linked_list(self, list_of_postings, number_of_postings):
-        self.length = number_of_postings
-        current_node = self.head
-        for posting_doc_id in list_of_postings:
-            current_node.next = Posting(posting_doc_id)
-            current_node = current_node.next
-
-    def sortedMerge(self, a, b):
-        result = None
-
-        # Base cases
-        if a is None:
-            return b
-        elif b is None:
-            return a
-
-        # Pick either a or b, and recur
-        if a.doc_id <= b.doc_id:
-            result = a
-            result.next = self.sortedMerge(a.next, b)
-        else:
-            result = b
-            result.next = self.sortedMerge(a, b.next)
-
-        return result
-
-    def add_skip_ptr(self, curr_node, skip_distance, curr_idx=0, looking_for_next=False):
-
-        result = curr_node
-
-        if looking_for_next:
-            # if curr_idx is evenly divided by skip_distance, we want to add a skip pointer to this node
-            if curr_idx % skip_distance == 0:
-                return result
-            else:
-                if result is None or result.next is None:
-                    return None
-                else:
-                    # iterate deeper (if not and end of list) to find where to put the pointer
-                    return self.add_skip_ptr(result.next, skip_distance, curr_idx + 1, looking_for_next)
-        else:
-            if curr_idx % skip_distance == 0:
-                looking_for_next = True
-                result.skip = self.add_skip_ptr(result.next, skip_distance, curr_idx + 1, looking_for_next)
-
-        # main loop
-        if result.next is not None:
-            self.add_skip_ptr(result.next, skip_distance, curr_idx + 1, False)
-
-    def __iter__(self):
-        node = self.head
-        while node is not None:
-            yield node
-            node = node.next
-
-    def __repr__(self):
-        node = self.head
-        nodes = ['len' + str(self.length)]
-        while node is not None:
-            nodes.append(str(node))
-            node = node.next
-        nodes.append("None")
-        return " -> ".join(nodes)
+MEMORY_BUDGET = 4 * 1024 * 1024  # bytes of postings we keep in memory before a block is flushed to a run file
+# rough in-memory cost of the postings of a block, used to decide when a block is full
+TERM_ENTRY_BYTES = 200  # dict entry + list object for a term that is new to the block
+POSTING_BYTES = 8  # one more pointer in the list of a term
+POSITIONS_ENTRY_BYTES = 40  # bytes object holding the encoded positions of a term in a document, plus its data
+RUN_RECORD = struct.Struct('=II')  # term_id, number of postings
+MAX_MERGE_FAN_IN = 64  # run files merged (and so open) at once, well below the usual limit of open files
+TOKENIZE_CHUNK_SIZE = 16  # documents sent to a tokenizer worker at a time
+PHASES = ['read', 'tokenize', 'stem', 'invert', 'merge', 'write']
+PHASE_SECONDS = collections.Counter()  # phase -> seconds spent in it, reported with --profile
 
 
 def usage():
-    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-m memory-budget-in-mb] [--workers N] [--codec array|vbyte|pfor] [--positions] [--profile] [--incremental]")
+    print("       " + sys.argv[0] + " -d dictionary-file -p postings-file --compact")
 
 
 def normalize_token(token):
-    token = token.lower()  # case folding
-    token = PORTER_STEMMER.stem(token)  # porter-stemming
-    return token
+    return STEM_CACHE.normalize(token)  # case folding + porter-stemming, memoized
 
 
-def merge_postings(listA, listB, length):
-    merged_postings = PostingList()
-    merged_postings.length = length
-    merged_postings.head = merged_postings.sortedMerge(listA.head, listB.head)
+def tokenize_document(doc_path, positional=False):
+    """
+    Read, tokenize and normalize one document. Returns the distinct terms of the document in the order
+    in which they first occur, so term ids are handed out in the same order no matter who tokenized it,
+    and the frequency of every term in the document (in the same order).
+    With positional, also returns the positions of every term (in the same order), otherwise None.
+    Last come the (case folded) words of the document, for the k-gram index of wildcard queries.
+    """
+    start = time.perf_counter()
+    with open(doc_path, 'r') as doc_open:
+        doc_text = doc_open.read()
+    PHASE_SECONDS['read'] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    sentences = nltk.sent_tokenize(doc_text)
+    PHASE_SECONDS['tokenize'] += time.perf_counter() - start
+
+    processed_document = []
+    document_words = set()
+    for s in sentences:
+        start = time.perf_counter()
+        words = nltk.word_tokenize(s)
+        document_words.update(words)
+        PHASE_SECONDS['tokenize'] += time.perf_counter() - start
+
+        # case-fold all word tokens, then porter-stem the word
+        start = time.perf_counter()
+        processed_document.append([normalize_token(token) for token in words])
+        PHASE_SECONDS['stem'] += time.perf_counter() - start
+
+        # This line was previously used when we also deleted stop words
+        # [...].append([normalize_token(token) for token in words if token.lower() not in STOP_WORDS])
+
+    tokens = [token for sentence in processed_document for token in sentence]
+    document_words = {word.lower() for word in document_words}
+    if not positional:
+        # a Counter is a dict, so its keys keep their insertion order, which makes this an ordered set
+        term_frequencies = collections.Counter(tokens)
+        return list(term_frequencies), list(term_frequencies.values()), None, document_words
+    term_positions = {}
+    for position, token in enumerate(tokens):
+        term_positions.setdefault(token, []).append(position)
+    return list(term_positions), list(map(len, term_positions.values())), list(term_positions.values()), document_words
+
+
+def start_tokenizer_worker():
+    STEM_CACHE.take_delta()  # start counting from zero, whatever was inherited from the parent process
+    STEM_CACHE.track_new_entries = True
+
+
+def tokenize_document_in_worker(doc_path, positional):
+    document_terms, term_frequencies, term_positions, document_words = tokenize_document(doc_path, positional)
+    phase_seconds = dict(PHASE_SECONDS)
+    PHASE_SECONDS.clear()
+    return document_terms, term_frequencies, term_positions, document_words, STEM_CACHE.take_delta(), phase_seconds
+
+
+def tokenize_documents(in_dir, doc_ids, workers=1, positional=False):
+    """
+    Yields (doc_id, terms of the document, their frequencies, their positions or None, its words) in the order of doc_ids. With more than one worker the documents
+    are tokenized in a process pool; imap hands the results back in input order, so the block builder sees
+    exactly the same stream as with a single worker.
+    """
+    doc_paths = [os.path.join(in_dir, str(doc_id)) for doc_id in doc_ids]
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=start_tokenizer_worker) as pool:
+            tokenize = functools.partial(tokenize_document_in_worker, positional=positional)
+            results = pool.imap(tokenize, doc_paths, chunksize=TOKENIZE_CHUNK_SIZE)
+            for doc_id, (document_terms, term_frequencies, term_positions, document_words, stem_cache_delta,
+                         phase_seconds) in zip(doc_ids, results):
+                STEM_CACHE.absorb(stem_cache_delta)  # keep the counters (and the entries to persist) in one place
+                PHASE_SECONDS.update(phase_seconds)  # summed over all workers, so this is CPU time rather than wall time
+                yield doc_id, document_terms, term_frequencies, term_positions, document_words
+    else:
+        for doc_id, doc_path in zip(doc_ids, doc_paths):
+            yield (doc_id, *tokenize_document(doc_path, positional))
 
-    return merged_postings
 
+def write_run(run_file, block_postings, block_frequencies, block_positions=None):
+    """
+    SPIMI-Invert output: write the postings of one block to a run file, sorted by term id.
+    Every record is (term_id, number of postings) followed by the doc ids of that term and its frequency in each
+    of them, and with block_positions by the lengths of the encoded positions of the term in each of those
+    documents and the positions themselves.
+    """
+    with open(run_file, 'wb') as write_postings:
+        for term_id in sorted(block_postings):
+            entries = block_positions[term_id] if block_positions is not None else None
+            write_run_record(write_postings, term_id, block_postings[term_id], block_frequencies[term_id], entries)
 
-def merge_dict(prev_dictionary, to_merge_dictionary):
-    merged_dict = {**prev_dictionary, **to_merge_dictionary}
-    for key, value in merged_dict.items():
-        if key in prev_dictionary and key in to_merge_dictionary:
-            merged_dict[key] = prev_dictionary[key] + to_merge_dictionary[key]
-    return merged_dict
 
+def write_run_record(write_postings, term_id, doc_ids, frequencies, entries=None):
+    write_postings.write(RUN_RECORD.pack(term_id, len(doc_ids)))
+    write_postings.write(array.array(postings.DOC_ID_TYPECODE, doc_ids).tobytes())
+    write_postings.write(array.array(postings.DOC_ID_TYPECODE, frequencies).tobytes())
+    if entries is not None:
+        write_postings.write(array.array(postings.DOC_ID_TYPECODE, map(len, entries)).tobytes())
+        write_postings.write(b''.join(entries))
 
-def merge_posting_dict(prev_posting_dict, to_merge_posting_dict):
-    merged_posting_dict = {**prev_posting_dict, **to_merge_posting_dict}
-    for term_id, posting_list in merged_posting_dict.items():
-        if term_id in prev_posting_dict and term_id in to_merge_posting_dict:
-            # There can never be duplicates in these posting dictionaries since they have all processed different docs.
-            # Hence, the merged list will be of length x+y.
-            length = prev_posting_dict[term_id].length + to_merge_posting_dict[term_id].length
-            merged_posting_dict[term_id] = merge_postings(prev_posting_dict[term_id], to_merge_posting_dict[term_id], length)
-    return merged_posting_dict
 
+def read_run(run_file, positional=False):
+    """
+    Stream the records of a run file back, one term (its doc ids, term frequencies, and the encoded positions
+    of every doc id or None) at a time.
+    """
+    with open(run_file, 'rb') as read_postings:
+        while True:
+            record = read_postings.read(RUN_RECORD.size)
+            if not record:
+                break
+            term_id, number_of_postings = RUN_RECORD.unpack(record)
+            doc_ids = array.array(postings.DOC_ID_TYPECODE)
+            doc_ids.frombytes(read_postings.read(number_of_postings * doc_ids.itemsize))
+            frequencies = array.array(postings.DOC_ID_TYPECODE)
+            frequencies.frombytes(read_postings.read(number_of_postings * frequencies.itemsize))
+            entries = None
+            if positional:
+                lengths = array.array(postings.DOC_ID_TYPECODE)
+                lengths.frombytes(read_postings.read(number_of_postings * lengths.itemsize))
+                entries = [read_postings.read(length) for length in lengths]
+            yield term_id, doc_ids, frequencies, entries
+
+
+def merge_runs(run_files, positional=False):
+    """
+    k-way heap merge of the run files. Yields (term_id, doc ids, term frequencies, encoded positions or None) in
+    ascending term id order while only holding the current record of every run in memory (plus the term that is being merged).
+    Blocks cover ascending, disjoint ranges of doc ids and heapq.merge breaks ties in the order of the
+    runs, so concatenating a term's doc ids from consecutive runs keeps them sorted.
+    """
+    runs = [read_run(run_file, positional) for run_file in run_files]
+    merged_term_id, merged_doc_ids, merged_frequencies, merged_entries = None, None, None, None
+    try:
+        for term_id, doc_ids, frequencies, entries in heapq.merge(*runs, key=lambda record: record[0]):
+            if term_id == merged_term_id:
+                merged_doc_ids.extend(doc_ids)
+                merged_frequencies.extend(frequencies)
+                if positional:
+                    merged_entries.extend(entries)
+            else:
+                if merged_term_id is not None:
+                    yield merged_term_id, merged_doc_ids, merged_frequencies, merged_entries
+                merged_term_id, merged_doc_ids, merged_frequencies, merged_entries = term_id, doc_ids, frequencies, entries
+        if merged_term_id is not None:
+            yield merged_term_id, merged_doc_ids, merged_frequencies, merged_entries
+    finally:
+        for run in runs:
+            run.close()  # closes its file right away, also when the merge failed (e.g. too many open files)
 
-def build_index(in_dir, out_dict, out_postings):
+
+def merge_in_passes(run_files, run_dir, positional=False, fan_in=MAX_MERGE_FAN_IN):
+    """
+    Merge groups of at most fan_in consecutive runs into longer runs until at most fan_in runs are left, so no
+    merge (including the final one of build_index) has more than fan_in run files open. A group of consecutive
+    runs covers a range of doc ids of its own, just like a single block, so merge_runs still applies.
+    Returns the runs that are left.
+    """
+    pass_number = 0
+    while len(run_files) > fan_in:
+        merged_files = []
+        for group_start in range(0, len(run_files), fan_in):
+            group = run_files[group_start:group_start + fan_in]
+            if len(group) == 1:
+                merged_files.extend(group)
+                continue
+            merged_file = os.path.join(run_dir, f'pass{pass_number}-run{len(merged_files)}')
+            with open(merged_file, 'wb') as write_postings:
+                for term_id, doc_ids, frequencies, entries in merge_runs(group, positional):
+                    write_run_record(write_postings, term_id, doc_ids, frequencies, entries)
+            for run_file in group:
+                os.remove(run_file)
+            merged_files.append(merged_file)
+        print(f'Merge pass {pass_number + 1}: {len(run_files)} runs into {len(merged_files)}')
+        run_files = merged_files
+        pass_number += 1
+    return run_files
+
+
+def build_index(in_dir, out_dict, out_postings, memory_budget=MEMORY_BUDGET, workers=1, profile=False, codec=None,
+                incremental=False, positional=False):
     """
     build index from documents stored in the input directory,
-    then output the dictionary file and postings file
+    then output the dictionary file and postings file (with the postings codec `codec`, see postings.py; by default
+    the codec of the index that is extended, or 'array').
+    With positional, the positions of every term in every document are written to a positions file next to the
+    postings file (see positions.py).
+    With incremental, only the documents that are not in the index yet are indexed, into a new delta segment
+    (see segments.py).
     """
     print('indexing...')
 
-    # Wipe all contents from the files before running the code. Because we are appending (open with 'ab')
-    # dictionaries from every block, we want to start from clean files.
-    open(out_dict, 'w').close()
-    open(out_postings, 'w').close()
-
     term_to_term_id = {}  # term (str) -> term id (int, 4 bytes)
     term_id_to_term = {} # term id (int, 4 bytes) -> term (str)
     term_id = 1  # we keep a global term id that we will assign to tokens when processing them
 
-    all_documents = [int(f) for f in os.listdir(in_dir)]
-
-    number_of_docs = len(all_documents)
-    block_size = int(number_of_docs / NUMBER_OF_BLOCKS) + 1
-
-    for block_number in range(NUMBER_OF_BLOCKS):
-        block = all_documents[block_number * block_size: (1 + block_number) * block_size]
-
-        # print(f'Block Number: {block_number} \nBlock includes doc id: \n{block}')
-
-        block_dictionary = {}  # term_id -> document frequency of term
-        block_postings = {}  # term_id -> posting[0] -> posting[1] ...
-
-        if block_number == NUMBER_OF_BLOCKS - 1:   # if it is the very last block
-            # Add a special entry that has a list of ALL postings.
-            # It is later used for handling some "NOT" queries.
-            token = 'all_documents_combined'
-            term_to_term_id[token] = term_id
-            term_id_to_term[term_id] = token
-            # the document frequency of this term is nil, since it should never appear in any document
-            block_dictionary[term_id] = 0
-            block_postings[term_id] = sorted(all_documents)
-            term_id += 1
-
-        for doc_id in block:
-            with open(os.path.join(in_dir, str(doc_id)), 'r') as doc_open:
-                doc_text = doc_open.read()
-
-            sentences = nltk.sent_tokenize(doc_text)
-
-            processed_document = []
-            for s in sentences:
-                words = nltk.word_tokenize(s)
-
-                # case-fold all word tokens, then porter-stem the word
-                processed_document.append([normalize_token(token) for token in words])
-
-                # This line was previously used when we also deleted stop words
-                # [...].append([normalize_token(token) for token in words if token.lower() not in STOP_WORDS])
-
-            for sentence in processed_document:
-                for token in sentence:
-                    if token not in term_to_term_id:
-                        term_to_term_id[token] = term_id
-                        term_id_to_term[term_id] = token
-                        term_id += 1
-
-                    tokens_term_id = term_to_term_id[token]
-
-                    if tokens_term_id not in block_dictionary:
-                        # first time seeing it, so it has only been seen in this document (i.e. doc freq (block) = 1)
-                        block_dictionary[tokens_term_id] = 1
-                        block_postings[tokens_term_id] = [doc_id]
-                    else:
-                        if doc_id not in block_postings[tokens_term_id]:  # first time seeing this term for this doc
-                            block_dictionary[tokens_term_id] += 1  # only increment for first occurrence in each docu
-
-                            # bisect is a built-in module. Uses binary search [O(log n)] to
-                            # insert element into a sorted list.
-                            bisect.insort(block_postings[tokens_term_id], doc_id)
-
-        for term, terms_postings in block_postings.items():
-            posting_list = PostingList()
-            posting_list.add_first(Posting(terms_postings[0]))
-            number_of_postings = len(terms_postings)
-
-            if number_of_postings > 1:
-                posting_list.convert_to_linked_list(terms_postings[1:], number_of_postings)
-            block_postings[term] = posting_list  # overwrite the previous list representation with a linked list
-
-        with open(out_dict, 'ab') as write_dict:  # using 'ab' appends this dump to previous dump we have done
-            pickle.dump(block_dictionary, write_dict)
-
-        with open(out_postings, 'ab') as write_postings:
-            pickle.dump(block_postings, write_postings)
-
-        print(f'Done with processing and writing block {block_number} / {NUMBER_OF_BLOCKS}')
-
-    print("... done with reading / writing blocks")
-
-    with open('term_conversion.txt', 'wb') as term_conversion:
-        pickle.dump(term_to_term_id, term_conversion)
-        pickle.dump(term_id_to_term, term_conversion)
-
-    merged_postings = {}
-    read_postings = open(out_postings, 'rb')
-    for _ in range(NUMBER_OF_BLOCKS):
-        to_merge_postings = pickle.load(read_postings)
-        merged_postings = merge_posting_dict(merged_postings, to_merge_postings)
-        print(f'Done with merging block (0 -> {_}) and {_ + 1}')
-
-    read_postings.close()
-
-    merged_dictionary = {}
-    # need to open and keep open for pickle.load() to remember what have been read
-    read_dict = open(out_dict, 'rb')
-    for _ in range(NUMBER_OF_BLOCKS):
-        to_merge_dictionary = pickle.load(read_dict)
-        merged_dictionary = merge_dict(merged_dictionary, to_merge_dictionary)
-    read_dict.close()
-
-    max_length = 0
-    max_term_id = 0
-
-    with open(out_postings, 'wb') as write_postings:
-        for term_id, posting_list in merged_postings.items():
-            if posting_list.length > max_length:
-                max_length = posting_list.length
-                max_term_id = term_id
-
-            number_of_skips = math.sqrt(posting_list.length)
-            skip_distance = math.floor(posting_list.length / number_of_skips)
-            if skip_distance > 1:
-                posting_list.add_skip_ptr(posting_list.head, skip_distance)
-
-            writer_position = write_postings.tell()
-            pickle.dump(merged_postings[term_id], write_postings)
-            # every term_id in the dictionary will be a tuple of (doc_frequency, writer offset)
-            merged_dictionary[term_id] = (merged_dictionary[term_id], writer_position)
-
+    # Documents are processed in ascending doc id order, so every block covers its own range of doc ids.
+    all_documents = sorted(int(f) for f in os.listdir(in_dir))
+
+    segment_dict, segment_postings = out_dict, out_postings  # the files this run writes
+    if incremental and os.path.exists(out_dict):
+        indexed_documents = segments.indexed_documents(out_dict, out_postings)
+        all_documents = [doc_id for doc_id in all_documents if doc_id not in indexed_documents]
+        if not all_documents:
+            print(f'No new documents in {in_dir}, the index is up to date')
+            return
+        delta_number = segments.next_delta_number(out_dict)
+        segment_dict, segment_postings = segments.delta_paths(out_dict, out_postings, delta_number)
+        STEM_CACHE.load(stemming.cache_path(out_dict))  # the saved cache keeps the stems of the earlier segments
+        # phrase queries need the positions of every segment, so a delta segment follows the main one
+        positional = positional or os.path.exists(positions.positions_path(out_postings))
+        if codec is None:
+            # the delta segment is stored like the main one, so --compact keeps it as it is
+            main_segment = segments.Segment(out_dict, out_postings)
+            codec = segments.stored_codec(main_segment)
+            main_segment.close()
+        print(f'Indexing {len(all_documents)} new documents into delta segment {delta_number}')
+    codec = codec or 'array'
+
+    # The segment is written next to the live files and only moved over them once it is complete (see
+    # segments.replace_segment): a searcher or server that has them open keeps reading the old ones meanwhile.
+    new_dict, new_postings = segment_dict + '.tmp', segment_postings + '.tmp'
+    new_positions = positions.positions_path(new_postings)
+
+    # the run files of every block are kept next to the postings file until they have been merged
+    run_dir = tempfile.mkdtemp(prefix='spimi-', dir=os.path.dirname(os.path.abspath(out_postings)))
+    try:
+        run_files = []
+
+        block_postings = {}  # term_id -> [doc_id, doc_id, ...]
+        block_frequencies = {}  # term_id -> [term frequency in doc_id, ...]
+        block_positions = {} if positional else None  # term_id -> [encoded positions in doc_id, ...], see positions.py
+        block_bytes = 0  # (estimated) memory used by block_postings, block_frequencies and block_positions
+        document_lengths = []  # length in tokens of every document, in doc id order
+        vocabulary = set()  # the case folded words of the documents, for the k-gram index
+
+        def flush_block():
+            start = time.perf_counter()
+            run_file = os.path.join(run_dir, f'run{len(run_files)}')
+            write_run(run_file, block_postings, block_frequencies, block_positions)
+            run_files.append(run_file)
+            PHASE_SECONDS['write'] += time.perf_counter() - start
+            print(f'Done with processing and writing block {len(run_files)} ({len(block_postings)} terms)')
+
+        for doc_id, document_terms, term_frequencies, term_positions, document_words in \
+                tokenize_documents(in_dir, all_documents, workers, positional):
+            start = time.perf_counter()
+            document_lengths.append(sum(term_frequencies))
+            vocabulary.update(document_words)
+            for i, token in enumerate(document_terms):
+                if token not in term_to_term_id:
+                    term_to_term_id[token] = term_id
+                    term_id_to_term[term_id] = token
+                    term_id += 1
+
+                tokens_term_id = term_to_term_id[token]
+
+                # document_terms holds every term of the document once and documents come in ascending doc id
+                # order, so the doc id can simply be appended: no membership scan and no sorted insert needed.
+                if tokens_term_id not in block_postings:
+                    # first time seeing it in this block
+                    block_postings[tokens_term_id] = [doc_id]
+                    block_frequencies[tokens_term_id] = [term_frequencies[i]]
+                    block_bytes += 2 * TERM_ENTRY_BYTES  # one in block_postings, one in block_frequencies
+                else:
+                    block_postings[tokens_term_id].append(doc_id)
+                    block_frequencies[tokens_term_id].append(term_frequencies[i])
+                    block_bytes += 2 * POSTING_BYTES
+
+                if positional:
+                    entry = positions.encode_positions(term_positions[i])
+                    block_positions.setdefault(tokens_term_id, []).append(entry)
+                    block_bytes += POSITIONS_ENTRY_BYTES + len(entry)
+            PHASE_SECONDS['invert'] += time.perf_counter() - start
+
+            # A block is only flushed between documents, so a document never ends up in two runs.
+            if block_bytes >= memory_budget:
+                flush_block()
+                block_postings = {}
+                block_frequencies = {}
+                block_positions = {} if positional else None
+                block_bytes = 0
+
+        if block_postings:
+            flush_block()
+
+        print("... done with reading / writing blocks")
+
+        # Add a special entry that has a list of ALL postings. It is later used for handling some "NOT" queries.
+        token = 'all_documents_combined'
+        term_to_term_id[token] = term_id
+        term_id_to_term[term_id] = token
+        all_documents_term_id = term_id
+
+        print(f'Stem cache: {STEM_CACHE}, saved ~{STEM_CACHE.saved_seconds():.2f}s of stemming')
+        STEM_CACHE.save(stemming.cache_path(out_dict))  # lets search.py start with a warm cache
+
+        merged_dictionary = {}
+        max_length = 0
+        max_term_id = 0
+        total_postings = 0
+
+        start = time.perf_counter()
+        number_of_blocks = len(run_files)
+        run_files = merge_in_passes(run_files, run_dir, positional)
+        positions_writer = positions.PositionsWriter(new_positions) if positional else None
+        weights_writer = weights.WeightsWriter(weights.weights_path(new_postings))
+        length_of = dict(zip(all_documents, document_lengths))  # doc id -> length, for the block summaries
+        with open(new_postings, 'wb') as write_postings:
+            # the special entry has the highest term id, so it goes right after the merged runs
+            all_documents_combined = [(all_documents_term_id, array.array(postings.DOC_ID_TYPECODE, all_documents),
+                                       None, None)]
+            for term_id, doc_ids, frequencies, entries in itertools.chain(merge_runs(run_files, positional),
+                                                                          all_documents_combined):
+                write_start = time.perf_counter()
+                if len(doc_ids) > max_length:
+                    max_length = len(doc_ids)
+                    max_term_id = term_id
+
+                # on disk we store the flat array of doc ids plus a side table of skip positions (see postings.py),
+                # or the compressed doc ids with a codec other than 'array'
+                writer_position = write_postings.tell()
+                encoded_postings = postings.encode_postings(doc_ids, codec)
+                write_postings.write(encoded_postings)
+                if frequencies is not None:
+                    # in the same order as the doc ids
+                    weights_writer.add(term_id, frequencies, [length_of[doc_id] for doc_id in doc_ids])
+                if entries is not None:
+                    positions_writer.add(term_id, entries)
+                # the document frequency of all_documents_combined is nil, since it should never appear in any document
+                doc_frequency = len(doc_ids) if term_id != all_documents_term_id else 0
+                # every term_id in the dictionary will be a tuple of (doc_frequency, writer offset, length in bytes)
+                merged_dictionary[term_id] = (doc_frequency, writer_position, len(encoded_postings))
+                PHASE_SECONDS['write'] += time.perf_counter() - write_start
+                PHASE_SECONDS['merge'] -= time.perf_counter() - write_start
+                total_postings += len(doc_ids)
+            postings_bytes = write_postings.tell()
+        weights_writer.close(all_documents, document_lengths, postings_bytes)
+        if positional:
+            positions_writer.close(postings_bytes)
+        elif os.path.exists(new_positions):
+            os.remove(new_positions)  # left over from a build that failed, it would not match the new postings
+        PHASE_SECONDS['merge'] += time.perf_counter() - start  # i.e. the time of the loop minus its writes
+    except BaseException:
+        # the live index is untouched, only the half written new files go
+        for path in (new_postings, weights.weights_path(new_postings), new_positions):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    print(f'Done with merging {number_of_blocks} blocks')
     print(f'Maximum length posting list is {max_length} long. It is the word {term_id_to_term[max_term_id]}.')
-
-    with open(out_dict, 'wb') as write_dict:
-        pickle.dump(merged_dictionary, write_dict)
-
-
-input_directory = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i':  # input directory
-        input_directory = a
-    elif o == '-d':  # dictionary file
-        output_file_dictionary = a
-    elif o == '-p':  # postings file
-        output_file_postings = a
+    print(f'Postings file ({codec}): {postings_bytes} bytes, {postings_bytes / max(1, total_postings):.2f} bytes per posting')
+    if positional:
+        print(f'Positions file: {os.path.getsize(new_positions)} bytes')
+
+    start = time.perf_counter()
+    # Wildcards are matched against the words of all segments, so an incremental build extends the k-gram index
+    # of the whole index. It is in place before the new segment becomes visible.
+    kgrams_file = wildcards.kgrams_path(out_dict)
+    word_terms = wildcards.read_vocabulary(kgrams_file) if segment_dict != out_dict else {}
+    word_terms.update((word, normalize_token(word)) for word in vocabulary if word not in word_terms)
+    wildcards.write_kgram_index(kgrams_file, word_terms)
+    print(f'K-gram index: {len(word_terms)} words')
+    # the same goes for the spelling suggestions, which come from the terms of all segments
+    spelling_file = spelling.spelling_path(out_dict)
+    spelling_terms = spelling.read_terms(spelling_file) if segment_dict != out_dict else []
+    spelling.write_spelling_index(spelling_file, spelling_terms + list(term_to_term_id))
+
+    # the lexicon (term -> term id) and the dictionary (term id -> df and postings location) share one binary file
+    lexicon.write_lexicon(new_dict, term_to_term_id, merged_dictionary, postings_bytes)
+    segments.replace_segment(new_dict, new_postings, segment_dict, segment_postings)
+    PHASE_SECONDS['write'] += time.perf_counter() - start
+
+    if segment_dict != out_dict:
+        # only now that both files are complete does the segment become visible to searchers
+        segments.write_manifest(out_dict, segments.read_manifest(out_dict) + [delta_number])
     else:
-        assert False, "unhandled option"
+        segments.remove_deltas(out_dict, out_postings)  # they are stale now that the whole index was rebuilt
+
+    if profile:
+        print('Time spent per phase:')
+        for phase in PHASES:
+            print(f'    {phase:10} {PHASE_SECONDS[phase]:8.2f}s')
+
+
+# worker processes of the tokenizer pool may import this module, so only parse arguments when run as a script
+if __name__ == '__main__':
+    input_directory = output_file_dictionary = output_file_postings = None
+    memory_budget = MEMORY_BUDGET
+    workers = 1
+    profile = False
+    codec = None  # array, or with --incremental the codec of the index that is extended
+    incremental = compact = positional = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:m:', ['workers=', 'profile', 'codec=', 'incremental', 'compact', 'positions'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':  # input directory
+            input_directory = a
+        elif o == '-d':  # dictionary file
+            output_file_dictionary = a
+        elif o == '-p':  # postings file
+            output_file_postings = a
+        elif o == '-m':  # memory budget of a block
+            memory_budget = int(float(a) * 1024 * 1024)
+        elif o == '--workers':  # number of tokenizer processes
+            workers = int(a)
+        elif o == '--profile':  # report the time spent per indexing phase
+            profile = True
+        elif o == '--codec':  # how the posting lists are stored
+            codec = a
+        elif o == '--positions':  # also store where in the documents the terms occur, for phrase queries
+            positional = True
+        elif o == '--incremental':  # only index new documents, into a delta segment
+            incremental = True
+        elif o == '--compact':  # fold the delta segments into the main index
+            compact = True
+        else:
+            assert False, "unhandled option"
+
+    if compact and output_file_dictionary != None and output_file_postings != None:
+        segments.compact(output_file_dictionary, output_file_postings)
+        sys.exit(0)
 
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
+    if input_directory == None or output_file_postings == None or output_file_dictionary == None or \
+            (codec != None and codec not in postings.CODEC_ENCODINGS):
+        usage()
+        sys.exit(2)
 
-build_index(input_directory, output_file_dictionary, output_file_postings)
+    build_index(input_directory, output_file_dictionary, output_file_postings, memory_budget, workers, profile, codec,
+                incremental, positional)
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+import array
+import heapq
+import mmap
+import struct
+
+# The dictionary file is laid out as:
+#   [header][entries][block index][term blocks]
+# entries:      (doc_frequency, postings offset, postings length) for every term id, as 3 unsigned ints.
+#               Term ids are handed out densely from 1, so entry i belongs to term id i (entry 0 is unused).
+# term blocks:  the terms sorted by their utf-8 bytes and front coded in blocks of TERMS_PER_BLOCK terms.
+#               The first term of a block is stored in full, every following term as the length of the prefix it
+#               shares with the previous term plus the remaining suffix. Every term is followed by its term id.
+# block index:  the offset (into the term blocks) of every block, so a lookup is a binary search over the first
+#               terms of the blocks followed by a short scan of one block.
+MAGIC = b'LEX2'
+# native byte order, same as array.tobytes(): magic, number of entries, terms per block, number of blocks, size of the
+# postings file the entries point into (0 if unknown), which lets a reader detect a dictionary / postings pair that
+# is being replaced (see segments.py)
+HEADER = struct.Struct('=4sIIIQ')
+ENTRY_TYPECODE = 'I'
+ENTRY_SIZE = 3  # unsigned ints per entry
+FULL_TERM = struct.Struct('=H')  # length of the term
+FRONT_CODED_TERM = struct.Struct('=HH')  # length of the shared prefix, length of the suffix
+TERM_ID = struct.Struct('=I')
+TERMS_PER_BLOCK = 16
+
+
+def shared_prefix_length(a, b):
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+def write_lexicon(out_dict, term_to_term_id, dictionary, postings_size=0):
+    """
+    Write the term lexicon (term -> term id) and the dictionary (term id -> (df, offset, length)) as a single
+    binary dictionary file.
+    """
+    number_of_entries = max(dictionary, default=0) + 1
+    entries = [0] * (number_of_entries * ENTRY_SIZE)
+    for term_id, entry in dictionary.items():
+        entries[term_id * ENTRY_SIZE:(term_id + 1) * ENTRY_SIZE] = entry
+
+    encoded_terms = sorted((term.encode('utf-8'), term_id) for term, term_id in term_to_term_id.items())
+    block_index = []
+    term_blocks = bytearray()
+    previous_term = b''
+    for i, (term, term_id) in enumerate(encoded_terms):
+        if i % TERMS_PER_BLOCK == 0:
+            block_index.append(len(term_blocks))
+            term_blocks += FULL_TERM.pack(len(term)) + term
+        else:
+            prefix_length = shared_prefix_length(previous_term, term)
+            term_blocks += FRONT_CODED_TERM.pack(prefix_length, len(term) - prefix_length) + term[prefix_length:]
+        term_blocks += TERM_ID.pack(term_id)
+        previous_term = term
+
+    with open(out_dict, 'wb') as write_dict:
+        write_dict.write(HEADER.pack(MAGIC, number_of_entries, TERMS_PER_BLOCK, len(block_index), postings_size))
+        write_dict.write(array.array(ENTRY_TYPECODE, entries).tobytes())
+        write_dict.write(array.array('I', block_index).tobytes())
+        write_dict.write(term_blocks)
+
+
+class Lexicon:
+    """
+    Read-only view of a dictionary file written by write_lexicon(). The file is memory-mapped and nothing is
+    decoded up front, so opening it costs the same for any vocabulary size.
+    Behaves like the old term_id -> (doc_frequency, offset, length) dict, and term_id() replaces the
+    term -> term id dict.
+    """
+    def __init__(self, dict_file):
+        self.file = open(dict_file, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, number_of_entries, self.terms_per_block, number_of_blocks, self.postings_size = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{dict_file} is not a dictionary file written by index.py')
+
+        view = memoryview(self.mmap)
+        entries_end = HEADER.size + number_of_entries * ENTRY_SIZE * 4
+        block_index_end = entries_end + number_of_blocks * 4
+        self.entries = view[HEADER.size:entries_end].cast(ENTRY_TYPECODE)
+        self.block_index = view[entries_end:block_index_end].cast('I')
+        self.term_blocks = view[block_index_end:]
+
+    def __getitem__(self, term_id):
+        start = term_id * ENTRY_SIZE
+        if term_id <= 0 or start >= len(self.entries) or self.entries[start + 2] == 0:
+            raise KeyError(term_id)  # every stored posting list is at least a header long
+        return tuple(self.entries[start:start + ENTRY_SIZE])
+
+    def __contains__(self, term_id):
+        try:
+            self[term_id]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        """
+        All term ids with postings.
+        """
+        return (term_id for term_id in range(1, len(self.entries) // ENTRY_SIZE) if term_id in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def most_frequent(self, number_of_terms):
+        """
+        Term ids of the number_of_terms terms with the highest document frequency.
+        """
+        document_frequencies = self.entries[0::ENTRY_SIZE].tolist()
+        most_frequent = heapq.nlargest(number_of_terms, range(len(document_frequencies)), key=document_frequencies.__getitem__)
+        return [term_id for term_id in most_frequent if document_frequencies[term_id] > 0]
+
+    def block_terms(self, block_number):
+        """
+        Decode the (term, term id) pairs of one block of the front coded terms.
+        """
+        position = self.block_index[block_number]
+        term = b''
+        for i in range(self.terms_per_block):
+            if position >= len(self.term_blocks):
+                return  # only the last block can hold less than terms_per_block terms
+            if i == 0:
+                (term_length,) = FULL_TERM.unpack_from(self.term_blocks, position)
+                position += FULL_TERM.size
+                term = bytes(self.term_blocks[position:position + term_length])
+                position += term_length
+            else:
+                prefix_length, suffix_length = FRONT_CODED_TERM.unpack_from(self.term_blocks, position)
+                position += FRONT_CODED_TERM.size
+                term = term[:prefix_length] + bytes(self.term_blocks[position:position + suffix_length])
+                position += suffix_length
+            (term_id,) = TERM_ID.unpack_from(self.term_blocks, position)
+            position += TERM_ID.size
+            yield term, term_id
+
+    def first_term(self, block_number):
+        position = self.block_index[block_number]
+        (term_length,) = FULL_TERM.unpack_from(self.term_blocks, position)
+        position += FULL_TERM.size
+        return bytes(self.term_blocks[position:position + term_length])
+
+    def term_id(self, term):
+        """
+        Term id of the given term, or None if it is not in the lexicon.
+        """
+        encoded_term = term.encode('utf-8')
+
+        # binary search for the last block whose first term is <= the term we are looking for
+        low, high = 0, len(self.block_index)
+        while low < high:
+            middle = (low + high) // 2
+            if self.first_term(middle) <= encoded_term:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+
+        for block_term, term_id in self.block_terms(low - 1):
+            if block_term == encoded_term:
+                return term_id
+            if block_term > encoded_term:
+                break
+        return None
+
+    def terms(self):
+        """
+        All (term, term id) pairs, in sorted order.
+        """
+        for block_number in range(len(self.block_index)):
+            for term, term_id in self.block_terms(block_number):
+                yield term.decode('utf-8'), term_id
+
+    def close(self):
+        for view in (self.entries, self.block_index, self.term_blocks):
+            view.release()
+        self.mmap.close()
+        self.file.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+"""
+Positional postings, written by `index.py --positions` next to the postings file (postings.txt.positions) and
+used for "quoted phrase" and NEAR/k queries. The doc ids stay in the postings file: the positions of a term are
+stored in the same order as its doc ids, so the positions of the i-th document of a posting list are entry i.
+
+The positions file is laid out as:
+    [magic][records][table][footer]
+record:  [number of documents][end offset of every entry]*n[entries], the offsets are relative to the first entry
+entry:   the number of positions and the gaps between them (the first position is its gap from 0), all vbyte
+         encoded, so the entry of one document is decoded without touching the others
+table:   the offset of the record of every term id (0 if the term has no record)
+footer:  the offset of the table, number of table entries, size of the postings file the records belong to (checked
+         like the one in the dictionary file, see segments.py)
+Positions are token positions in the document, counted over all of its sentences.
+"""
+import array
+import bisect
+import itertools
+import mmap
+import struct
+
+import compression
+
+MAGIC = b'POS2'
+POSITIONS_SUFFIX = '.positions'
+COUNT = struct.Struct('=I')
+FOOTER = struct.Struct('=QIQ')  # native byte order, same as array.tobytes()
+OFFSET_TYPECODE = 'I'
+TABLE_TYPECODE = 'Q'
+assert array.array(OFFSET_TYPECODE).itemsize == 4 and array.array(TABLE_TYPECODE).itemsize == 8
+
+
+def positions_path(postings_file):
+    return postings_file + POSITIONS_SUFFIX
+
+
+def encode_positions(positions):
+    """
+    The entry of one document: its (ascending) positions of a term.
+    """
+    # one pass over count, count + p0, count + p1, ...: the gaps are the count, p0, p1 - p0, ...
+    number_of_positions = len(positions)
+    return compression.vbyte_encode([number_of_positions] + [number_of_positions + position for position in positions])
+
+
+def decode_positions(entry):
+    if min(entry) >= 128:
+        # every value is a single byte (nearly all entries): drop the count and the stop bits, add up the gaps
+        return list(itertools.accumulate(entry[1:].translate(compression.ONE_BYTE_GAPS)))
+    (number_of_positions,), count_bytes = compression.vbyte_decode(entry, 1)
+    positions, _ = compression.vbyte_decode(entry[count_bytes:], number_of_positions)
+    return positions
+
+
+class PositionsWriter:
+    """
+    Writes the records of the terms in any order, and the table of their offsets on close().
+    """
+    def __init__(self, positions_file):
+        self.file = open(positions_file, 'wb')
+        self.file.write(MAGIC)
+        self.offsets = {}  # term id -> offset of its record
+
+    def add(self, term_id, entries):
+        """
+        Write the record of a term from the encoded entries of its documents, in doc id order.
+        """
+        self.offsets[term_id] = self.file.tell()
+        ends = array.array(OFFSET_TYPECODE)
+        end = 0
+        for entry in entries:
+            end += len(entry)
+            ends.append(end)
+        self.file.write(COUNT.pack(len(entries)))
+        self.file.write(ends.tobytes())
+        self.file.write(b''.join(entries))
+
+    def close(self, postings_size):
+        table = array.array(TABLE_TYPECODE, [0] * (max(self.offsets, default=0) + 1))
+        for term_id, offset in self.offsets.items():
+            table[term_id] = offset
+        table_offset = self.file.tell()
+        self.file.write(table.tobytes())
+        self.file.write(FOOTER.pack(table_offset, len(table), postings_size))
+        self.file.close()
+
+
+class PositionsReader:
+    """
+    Memory-maps the positions file; only the entries of the documents that are asked for are decoded.
+    """
+    def __init__(self, positions_file):
+        self.file = open(positions_file, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            # e.g. written in an older format: rebuild the index
+            self.mmap.close()
+            self.file.close()
+            raise ValueError(f'{positions_file} is not a positions file written by index.py')
+        self.buffer = memoryview(self.mmap)
+        table_offset, number_of_entries, self.postings_size = FOOTER.unpack_from(self.buffer,
+                                                                                 len(self.buffer) - FOOTER.size)
+        self.table = self.buffer[table_offset:table_offset + number_of_entries * 8].cast(TABLE_TYPECODE)
+
+    def record(self, term_id):
+        """
+        The end offsets of the entries of a term and the view they index into.
+        """
+        offset = self.table[term_id] if term_id < len(self.table) else 0
+        if offset == 0:
+            return array.array(OFFSET_TYPECODE), memoryview(b'')
+        number_of_documents, = COUNT.unpack_from(self.buffer, offset)
+        entries_start = offset + COUNT.size + number_of_documents * 4
+        ends = self.buffer[offset + COUNT.size:entries_start].cast(OFFSET_TYPECODE)
+        entries_end = entries_start + (ends[-1] if number_of_documents else 0)
+        return ends, self.buffer[entries_start:entries_end]
+
+    def entries(self, term_id):
+        """
+        The encoded entries of all documents of a term (used to merge segments, see segments.compact).
+        """
+        ends, view = self.record(term_id)
+        return [view[start:end].tobytes() for start, end in zip([0] + ends.tolist(), ends)]
+
+    def close(self):
+        self.table.release()
+        self.buffer.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+
+class TermPositions:
+    """
+    Positions of one term in any document, over all segments of the index. Built from the (doc ids, positions
+    reader, term id) of every segment that has the term; the records are looked up once, the entries of a
+    document only when it is asked for.
+    """
+    def __init__(self, segment_lists):
+        self.segment_lists = [(doc_ids, *reader.record(term_id)) for doc_ids, reader, term_id in segment_lists]
+
+    def of(self, doc_id):
+        for doc_ids, ends, view in self.segment_lists:
+            rank = bisect.bisect_left(doc_ids, doc_id)
+            if rank < len(doc_ids) and doc_ids[rank] == doc_id:
+                start = ends[rank - 1] if rank > 0 else 0
+                return decode_positions(view[start:ends[rank]].tobytes())
+        return []
+
+
+def phrase_at(doc_id, term_positions):
+    """
+    True if the terms occur one after the other in the document. term_positions are the (offset in the phrase,
+    TermPositions) of the terms, rarest first, so most documents are ruled out before the common terms are decoded.
+    """
+    starts = None  # positions at which the phrase can still start
+    for offset, positions in term_positions:
+        candidates = {position - offset for position in positions.of(doc_id)}
+        starts = candidates if starts is None else starts & candidates
+        if not starts:
+            return False
+    return True
+
+
+def within(positions_a, positions_b, distance):
+    """
+    True if a position of a and a position of b (in either order) are at most distance apart. Both are sorted, so
+    only neighbours in the merged order have to be compared.
+    """
+    i = j = 0
+    while i < len(positions_a) and j < len(positions_b):
+        if abs(positions_a[i] - positions_b[j]) <= distance:
+            return True
+        if positions_a[i] < positions_b[j]:
+            i += 1
+        else:
+            j += 1
+    return False
@@ -0,0 +1,537 @@
+#!/usr/bin/python3
+import array
+import bisect
+import itertools
+import math
+import mmap
+import os
+import struct
+
+import compression
+
+# Every doc id (and every skip position) is stored as an unsigned int of 4 bytes.
+DOC_ID_TYPECODE = 'I'
+assert array.array(DOC_ID_TYPECODE).itemsize == 4
+
+# Each term's postings are written as:
+#   [encoding][number of postings][number of skips][doc_id_0 ... doc_id_n-1][skip_pos_0 ... skip_pos_m-1]
+# where the doc ids are sorted in ascending order and the skip positions are indexes into the doc id array.
+# Dense posting lists are written as Roaring-style containers instead (see encode_roaring):
+#   [encoding][number of postings][number of containers][key, cardinality]*m[container_0 ... container_m-1]
+# and with a compressing codec (see compression.py) all other lists are written as
+#   [encoding][number of postings][number of bytes][compressed doc ids, padded to a multiple of 4 bytes]
+HEADER = struct.Struct('=III')  # native byte order, same as array.tobytes()
+CONTAINER = struct.Struct('=II')  # high 16 bits of the doc ids in the container, number of doc ids in it
+ENCODING_ARRAY = 0
+ENCODING_ROARING = 1
+ENCODING_VBYTE = 2
+ENCODING_PFOR = 3
+# codec names accepted by encode_postings (and index.py --codec); 'array' stores the doc ids uncompressed
+CODEC_ENCODINGS = {'array': ENCODING_ARRAY, 'vbyte': ENCODING_VBYTE, 'pfor': ENCODING_PFOR}
+CODEC_NAMES = dict((encoding, codec) for codec, encoding in CODEC_ENCODINGS.items())
+
+# Roaring containers: the doc id space is cut into chunks of 2^16 ids. A chunk with at most ARRAY_CONTAINER_LIMIT
+# postings stores the low 16 bits of its doc ids in a sorted array, a denser one stores a bitmap of 8 KB, which
+# is the point where the bitmap becomes the smaller of the two.
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+BITMAP_BYTES = CHUNK_SIZE // 8
+ARRAY_CONTAINER_LIMIT = 4096
+LOW_BITS_TYPECODE = 'H'
+BIT_CHARACTERS = bytes.maketrans(b'01', b'\x00\x01')
+
+# and_merge gallops through the longer list when it is at least this many times longer than the shorter one, and
+# probes a hash set of the shorter list otherwise (see benchmarks/bench_intersect.py for how these were picked)
+GALLOP_RATIO = 16
+INTERSECTION_STRATEGIES = ['gallop', 'hash']
+
+
+class PostingList:
+    """
+    Array-backed posting list. The doc ids are kept in a sorted array and the skip pointers are kept
+    in a side table of positions (every sqrt(n) postings), so a posting list never has to be built
+    out of one Python object per posting. Lists read through a PostingsReader hold memoryviews into
+    the postings file instead of arrays; both support len(), indexing and slicing.
+    """
+    def __init__(self, doc_ids=None, skips=None):
+        self.doc_ids = doc_ids if doc_ids is not None else array.array(DOC_ID_TYPECODE)
+        self.skips = skips if skips is not None else array.array(DOC_ID_TYPECODE)
+
+    @property
+    def length(self):
+        return len(self.doc_ids)
+
+    def or_merge(self, other):
+        """
+        The union of two posting lists, as an iterative two-pointer merge.
+        Time Complexity: O(x+y)
+        """
+        if isinstance(other, RoaringPostingList):
+            return other.or_merge(self)
+
+        # the merges below work on plain lists: tolist() is a single C-level copy, and indexing a list is
+        # much cheaper than indexing an array or a memoryview of the postings file
+        a, b = self.doc_ids.tolist(), other.doc_ids.tolist()
+        len_a, len_b = len(a), len(b)
+        result = []
+        append = result.append
+        i = j = 0
+        while i < len_a and j < len_b:
+            doc_a, doc_b = a[i], b[j]
+            if doc_a < doc_b:
+                append(doc_a)
+                i += 1
+            elif doc_a > doc_b:
+                append(doc_b)
+                j += 1
+            else:
+                append(doc_a)
+                i += 1
+                j += 1
+        result.extend(a[i:])
+        result.extend(b[j:])
+        return PostingList(array.array(DOC_ID_TYPECODE, result))
+
+    def and_merge(self, other, strategy=None):
+        """
+        The intersection of two posting lists. The algorithm is picked from the ratio of their lengths
+        (see choose_intersection), unless a strategy is given.
+        """
+        if isinstance(other, RoaringPostingList):
+            return other.and_merge(self)
+
+        small, large = (self, other) if len(self) <= len(other) else (other, self)
+        if len(small) == 0:
+            return PostingList()
+
+        strategy = strategy or choose_intersection(len(small), len(large))
+        if strategy == 'gallop':
+            return small.gallop_merge(large)
+        return small.hash_merge(large)
+
+    def gallop_merge(self, other):
+        """
+        Intersection by galloping (exponential search) through `other` for every doc id of this list, which
+        should be the much shorter one. Every search starts where the previous one ended.
+        Time Complexity: O(x log(y/x))
+        """
+        a, b = self.doc_ids.tolist(), other.doc_ids  # b is only probed, so it is not copied
+        len_b = len(b)
+        result = []
+        append = result.append
+        position = 0
+        for doc_id in a:
+            step = 1
+            while position + step < len_b and b[position + step] < doc_id:
+                step *= 2
+            position = bisect.bisect_left(b, doc_id, position + step // 2, min(position + step + 1, len_b))
+            if position == len_b:
+                break
+            if b[position] == doc_id:
+                append(doc_id)
+                position += 1
+        return PostingList(array.array(DOC_ID_TYPECODE, result))
+
+    def hash_merge(self, other):
+        """
+        Intersection by probing a hash set of this list (the shorter one) with every doc id of `other`,
+        which keeps the result in sorted order.
+        Time Complexity: O(x+y), with far fewer interpreted steps per doc id than a two-pointer merge
+        """
+        doc_ids = set(self.doc_ids.tolist())
+        return PostingList(array.array(DOC_ID_TYPECODE, [doc_id for doc_id in other.doc_ids.tolist() if doc_id in doc_ids]))
+
+    def and_not_merge(self, other):
+        """
+        The listA And-Not listB operation is the same as taking ListA - {all elements in listB}
+        Time Complexity: O(x+y)
+        """
+        if isinstance(other, RoaringPostingList):
+            return RoaringPostingList.from_doc_ids(self.doc_ids).and_not_merge(other)
+
+        a, b = self.doc_ids.tolist(), other.doc_ids.tolist()
+        len_a, len_b = len(a), len(b)
+        result = []
+        append = result.append
+        i = j = 0
+        while i < len_a and j < len_b:
+            doc_a, doc_b = a[i], b[j]
+            if doc_a < doc_b:
+                append(doc_a)
+                i += 1
+            elif doc_a > doc_b:
+                j += 1
+            else:
+                i += 1
+                j += 1
+        result.extend(a[i:])
+        return PostingList(array.array(DOC_ID_TYPECODE, result))
+
+    def nbytes(self):
+        """
+        Memory held by the doc ids and skips (for a list read from the postings file: the bytes it maps).
+        """
+        return len(self.doc_ids) * self.doc_ids.itemsize + len(self.skips) * self.skips.itemsize
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __repr__(self):
+        return " ".join(map(str, self.doc_ids))
+
+
+class RoaringPostingList:
+    """
+    Posting list of a dense term, kept like a Roaring bitmap: one container per chunk of 2^16 doc ids, holding
+    either the sorted low 16 bits of the doc ids in the chunk or, for a dense chunk, a bitmap in a single Python
+    int. AND, OR and AND NOT of two bitmaps are then one &, | or & ~ on those ints, which CPython evaluates a
+    machine word at a time instead of one posting at a time. The lists of common terms (and all_documents_combined)
+    are stored this way, so NOT and OR queries over them no longer walk every posting.
+    """
+    def __init__(self, keys=None, containers=None):
+        self.keys = keys if keys is not None else []  # high 16 bits of the doc ids of each container, ascending
+        self.containers = containers if containers is not None else []
+        self.materialized_doc_ids = None
+
+    @classmethod
+    def from_doc_ids(cls, doc_ids):
+        keys, containers = [], []
+        start = 0
+        while start < len(doc_ids):
+            key = doc_ids[start] >> CHUNK_BITS
+            end = bisect.bisect_left(doc_ids, (key + 1) << CHUNK_BITS, start)
+            lows = doc_ids[start:end].tolist() if key == 0 else [doc_id & (CHUNK_SIZE - 1) for doc_id in doc_ids[start:end]]
+            keys.append(key)
+            containers.append(bits_of(lows) if len(lows) > ARRAY_CONTAINER_LIMIT else array.array(LOW_BITS_TYPECODE, lows))
+            start = end
+        return cls(keys, containers)
+
+    def is_dense(self):
+        """
+        True if at least one chunk is stored as a bitmap, which is when the Roaring form pays off.
+        """
+        return any(isinstance(container, int) for container in self.containers)
+
+    def simplify(self):
+        """
+        Results without a bitmap left are turned back into a plain PostingList, so the array merges
+        (galloping in particular) are used for them again.
+        """
+        return self if self.is_dense() else PostingList(self.doc_ids)
+
+    def and_merge(self, other, strategy=None):
+        """
+        The intersection, container by container. Only chunks present in both lists can contribute.
+        Time Complexity: O(number of containers), plus O(x) per container that is an array
+        """
+        other = as_roaring(other)
+        other_containers = dict(zip(other.keys, other.containers))
+        keys, containers = [], []
+        for key, container in zip(self.keys, self.containers):
+            if key in other_containers:
+                add_container(keys, containers, key, container_and(container, other_containers[key]))
+        return RoaringPostingList(keys, containers).simplify()
+
+    def or_merge(self, other):
+        other = as_roaring(other)
+        containers_by_key = dict(zip(self.keys, self.containers))
+        for key, container in zip(other.keys, other.containers):
+            if key in containers_by_key:
+                container = container_or(containers_by_key[key], container)
+            containers_by_key[key] = container
+        keys = sorted(containers_by_key)
+        return RoaringPostingList(keys, [containers_by_key[key] for key in keys]).simplify()
+
+    def and_not_merge(self, other):
+        other = as_roaring(other)
+        other_containers = dict(zip(other.keys, other.containers))
+        keys, containers = [], []
+        for key, container in zip(self.keys, self.containers):
+            if key in other_containers:
+                container = container_and_not(container, other_containers[key])
+            add_container(keys, containers, key, container)
+        return RoaringPostingList(keys, containers).simplify()
+
+    @property
+    def doc_ids(self):
+        """
+        The doc ids as a flat array, only built when something needs them one by one (e.g. for the results file).
+        """
+        if self.materialized_doc_ids is None:
+            doc_ids = array.array(DOC_ID_TYPECODE)
+            for key, container in zip(self.keys, self.containers):
+                lows = (lows_of(container) if isinstance(container, int) else container).tolist()
+                if key > 0:
+                    lows = [(key << CHUNK_BITS) + low for low in lows]
+                doc_ids.fromlist(lows)
+            self.materialized_doc_ids = doc_ids
+        return self.materialized_doc_ids
+
+    @property
+    def skips(self):
+        return array.array(DOC_ID_TYPECODE)
+
+    @property
+    def length(self):
+        return len(self)
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def nbytes(self):
+        materialized = len(self.materialized_doc_ids) * 4 if self.materialized_doc_ids is not None else 0
+        return materialized + sum(BITMAP_BYTES if isinstance(container, int) else len(container) * 2
+                                  for container in self.containers)
+
+    def __len__(self):
+        return sum(cardinality(container) for container in self.containers)
+
+    def __repr__(self):
+        return " ".join(map(str, self.doc_ids))
+
+
+def or_merge_all(posting_lists):
+    """
+    The union of any number of posting lists (e.g. the lists of all terms a wildcard expands to) in a single pass,
+    where a chain of pairwise or_merges would copy the growing result once per list. The doc ids of all lists go
+    into one set that is sorted once: both run in C, which beats a heapq.merge of the lists by an order of
+    magnitude in CPython. Dense lists are merged container by container, every bitmap ORed only once.
+    """
+    posting_lists = list(posting_lists)
+    if not posting_lists:
+        return PostingList()
+    if len(posting_lists) == 1:
+        return posting_lists[0]
+    if not any(isinstance(posting_list, RoaringPostingList) for posting_list in posting_lists):
+        doc_ids = set()
+        for posting_list in posting_lists:
+            doc_ids.update(posting_list.doc_ids)
+        return PostingList(array.array(DOC_ID_TYPECODE, sorted(doc_ids)))
+
+    bitmaps = {}  # key -> OR of the bitmap containers with that key
+    lows = {}  # key -> low 16 bits of the doc ids in the array containers with that key
+    for posting_list in map(as_roaring, posting_lists):
+        for key, container in zip(posting_list.keys, posting_list.containers):
+            if isinstance(container, int):
+                bitmaps[key] = bitmaps.get(key, 0) | container
+            else:
+                lows.setdefault(key, set()).update(container)
+    keys = sorted(bitmaps.keys() | lows.keys())
+    containers = []
+    for key in keys:
+        key_lows = sorted(lows.get(key, ()))
+        if key in bitmaps:
+            containers.append(bitmaps[key] | bits_of(key_lows))
+        else:
+            containers.append(bits_of(key_lows) if len(key_lows) > ARRAY_CONTAINER_LIMIT
+                              else array.array(LOW_BITS_TYPECODE, key_lows))
+    return RoaringPostingList(keys, containers).simplify()
+
+
+def as_roaring(posting_list):
+    return posting_list if isinstance(posting_list, RoaringPostingList) else RoaringPostingList.from_doc_ids(posting_list.doc_ids)
+
+
+def add_container(keys, containers, key, container):
+    # empty containers are dropped, like in Roaring
+    if cardinality(container) > 0:
+        keys.append(key)
+        containers.append(container)
+
+
+def cardinality(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def bits_of(lows):
+    """
+    The bitmap (as an int) of a container given as the low 16 bits of its doc ids.
+    """
+    if isinstance(lows, int):
+        return lows
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in lows:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bitmap, 'little')
+
+
+def lows_of(bits):
+    """
+    The set bits of a bitmap, in ascending order. bin() lists the bits from the most significant one, so the
+    reversed string (without the '0b' prefix) has a '1' at every position we want; all steps run in C.
+    """
+    return array.array(LOW_BITS_TYPECODE, itertools.compress(range(CHUNK_SIZE), bin(bits)[:1:-1].encode().translate(BIT_CHARACTERS)))
+
+
+def shrink(bits):
+    # a bitmap that became sparse goes back to an array container
+    return bits if bits.bit_count() > ARRAY_CONTAINER_LIMIT else lows_of(bits)
+
+
+def container_and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return shrink(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        # probing the bitmap costs O(x) for the array, while building a bitmap of the array would cost as much
+        # and still needs an O(2^16) pass to read the result
+        bitmap = b.to_bytes(BITMAP_BYTES, 'little')
+        return array.array(LOW_BITS_TYPECODE, [low for low in a if bitmap[low >> 3] >> (low & 7) & 1])
+    return array.array(LOW_BITS_TYPECODE, sorted(set(a).intersection(b)))
+
+
+def container_or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return bits_of(a) | bits_of(b)  # at least as dense as the bitmap, so it stays one
+    lows = sorted(set(a).union(b))
+    return bits_of(lows) if len(lows) > ARRAY_CONTAINER_LIMIT else array.array(LOW_BITS_TYPECODE, lows)
+
+
+def container_and_not(a, b):
+    if isinstance(a, int):
+        return shrink(a & ~bits_of(b))
+    if isinstance(b, int):
+        bitmap = b.to_bytes(BITMAP_BYTES, 'little')
+        return array.array(LOW_BITS_TYPECODE, [low for low in a if not bitmap[low >> 3] >> (low & 7) & 1])
+    b = set(b)
+    return array.array(LOW_BITS_TYPECODE, [low for low in a if low not in b])
+
+
+def choose_intersection(length_small, length_large):
+    """
+    Galloping only touches O(x log(y/x)) doc ids of the longer list, which wins once the lists are very uneven.
+    For lists of similar length the hash probe wins: the set is built in C and the probe is a single
+    comprehension. An interpreted two-pointer merge (with or without the skips) is slower than one of the two at
+    every length and ratio we measured, down to single-element lists.
+    """
+    if length_large >= GALLOP_RATIO * length_small:
+        return 'gallop'
+    return 'hash'
+
+
+def skip_positions(number_of_postings):
+    """
+    Positions of the skip pointers for a posting list of the given length. We place sqrt(n) evenly
+    spaced skips, and none at all when the skip distance would be 1 (a skip would just be the next posting).
+    """
+    if number_of_postings == 0:
+        return array.array(DOC_ID_TYPECODE)
+    number_of_skips = math.sqrt(number_of_postings)
+    skip_distance = math.floor(number_of_postings / number_of_skips)
+    if skip_distance <= 1:
+        return array.array(DOC_ID_TYPECODE)
+    return array.array(DOC_ID_TYPECODE, range(0, number_of_postings, skip_distance))
+
+
+def encode_postings(doc_ids, codec='array'):
+    """
+    Serialize a sorted sequence of doc ids (together with its skip table) into the on-disk postings format.
+    Dense lists, with at least one chunk that needs a bitmap, are written as Roaring containers instead.
+    With the 'vbyte' or 'pfor' codec the other lists are compressed, and their skips are rebuilt when read.
+    """
+    doc_ids = array.array(DOC_ID_TYPECODE, doc_ids)
+    roaring = RoaringPostingList.from_doc_ids(doc_ids)
+    if roaring.is_dense():
+        return encode_roaring(roaring)
+    if codec != 'array':
+        encode, _ = compression.CODECS[codec]
+        compressed = encode(doc_ids)
+        padding = b'\0' * (-len(compressed) % 4)
+        return HEADER.pack(CODEC_ENCODINGS[codec], len(doc_ids), len(compressed)) + compressed + padding
+    skips = skip_positions(len(doc_ids))
+    return HEADER.pack(ENCODING_ARRAY, len(doc_ids), len(skips)) + doc_ids.tobytes() + skips.tobytes()
+
+
+def encode_roaring(posting_list):
+    """
+    The container table (key and cardinality of every container) followed by the containers: a bitmap is 8 KB,
+    an array holds 2 bytes per doc id and is padded to a multiple of 4 bytes to keep the records aligned.
+    """
+    table, payloads = [], []
+    for key, container in zip(posting_list.keys, posting_list.containers):
+        table.append(CONTAINER.pack(key, cardinality(container)))
+        if isinstance(container, int):
+            payloads.append(container.to_bytes(BITMAP_BYTES, 'little'))
+        else:
+            payloads.append(container.tobytes() + b'\0\0' * (len(container) % 2))
+    return HEADER.pack(ENCODING_ROARING, len(posting_list), len(table)) + b''.join(table) + b''.join(payloads)
+
+
+class PostingsReader:
+    """
+    Memory-maps the postings file once and hands out zero-copy views over each term's byte range,
+    so looking up a term costs neither an open() nor a deserialization.
+    """
+    def __init__(self, postings_file):
+        self.file = open(postings_file, 'rb')
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.mmap = None  # mmap refuses to map an empty file
+            self.buffer = memoryview(b'')
+        else:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = memoryview(self.mmap)
+
+    def read(self, offset, length):
+        """
+        Return the posting list stored in the `length` bytes starting at `offset`.
+        """
+        view = self.buffer[offset:offset + length]
+        encoding, number_of_postings, number_of_skips = HEADER.unpack_from(view)
+        if encoding == ENCODING_ROARING:
+            return self.read_roaring(view, offset, number_of_postings, number_of_skips)
+        if encoding in CODEC_NAMES and encoding != ENCODING_ARRAY:
+            return self.read_compressed(view, offset, CODEC_NAMES[encoding], number_of_postings, number_of_skips)
+        if encoding != ENCODING_ARRAY:
+            raise ValueError(f'Corrupt postings at offset {offset}: unknown encoding {encoding}')
+        doc_ids_end = HEADER.size + number_of_postings * 4
+        skips_end = doc_ids_end + number_of_skips * 4
+        if skips_end != length:
+            raise ValueError(f'Corrupt postings at offset {offset}: expected {length} bytes, header says {skips_end}')
+        doc_ids = view[HEADER.size:doc_ids_end].cast(DOC_ID_TYPECODE)
+        skips = view[doc_ids_end:skips_end].cast(DOC_ID_TYPECODE)
+        return PostingList(doc_ids, skips)
+
+    def read_compressed(self, view, offset, codec, number_of_postings, number_of_bytes):
+        _, decode = compression.CODECS[codec]
+        data_end = HEADER.size + number_of_bytes
+        if data_end + (-number_of_bytes % 4) != len(view):
+            raise ValueError(f'Corrupt postings at offset {offset}: expected {len(view)} bytes, header says {data_end}')
+        doc_ids, bytes_read = decode(view[HEADER.size:data_end].tobytes(), number_of_postings)
+        if bytes_read != number_of_bytes:
+            raise ValueError(f'Corrupt postings at offset {offset}: {codec} data is {bytes_read} bytes, not {number_of_bytes}')
+        return PostingList(array.array(DOC_ID_TYPECODE, doc_ids), skip_positions(number_of_postings))
+
+    def read_roaring(self, view, offset, number_of_postings, number_of_containers):
+        keys, containers = [], []
+        position = HEADER.size + number_of_containers * CONTAINER.size
+        for key, container_cardinality in CONTAINER.iter_unpack(view[HEADER.size:position]):
+            if container_cardinality > ARRAY_CONTAINER_LIMIT:
+                containers.append(int.from_bytes(view[position:position + BITMAP_BYTES], 'little'))
+                position += BITMAP_BYTES
+            else:
+                containers.append(view[position:position + container_cardinality * 2].cast(LOW_BITS_TYPECODE))
+                position += (container_cardinality + container_cardinality % 2) * 2
+            keys.append(key)
+        if position != len(view) or sum(map(cardinality, containers)) != number_of_postings:
+            raise ValueError(f'Corrupt postings at offset {offset}: container table does not match the header')
+        return RoaringPostingList(keys, containers)
+
+    def close(self):
+        # any views still handed out keep the mapping alive, so we only release our own reference
+        self.buffer.release()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""
+In-process cache of decoded posting lists, keyed on (segment number, term id) (see segments.py). Reading a list
+from the memory-mapped postings file is cheap for the uncompressed format, but Roaring bitmaps and the vbyte /
+pfor codecs have to be decoded on every read, and the same terms come back over and over in a batch of queries.
+"""
+import collections
+
+POSTINGS_CACHE_BYTES = 8 * 1024 * 1024
+PROTECTED_FRACTION = 0.8  # share of the budget for lists that were used more than once
+PREWARM_TERMS = 100  # the lists of this many of the highest df terms are loaded by prewarm()
+
+
+class PostingsCache:
+    """
+    Segmented LRU with a byte budget. A list enters the probationary segment; a second use promotes it to the
+    protected segment, which holds PROTECTED_FRACTION of the budget. Lists pushed out of the protected segment
+    get another chance in the probationary one, and only the least recently used probationary list is evicted.
+    So a scan through many rare terms cannot flush the lists that are used all the time.
+    Pinned lists (e.g. all_documents_combined, needed by every NOT) are never evicted, but do count against
+    the budget.
+    """
+    def __init__(self, max_bytes=POSTINGS_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_protected_bytes = int(max_bytes * PROTECTED_FRACTION)
+        self.probation = collections.OrderedDict()  # key -> posting list, least recently used first
+        self.protected = collections.OrderedDict()
+        self.pinned = {}
+        self.pinned_keys = set()
+        self.sizes = {}  # key -> bytes of the list when it was put in the cache
+        self.probation_bytes = self.protected_bytes = self.pinned_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if key in self.pinned:
+            self.hits += 1
+            return self.pinned[key]
+        if key in self.protected:
+            self.hits += 1
+            self.protected.move_to_end(key)
+            return self.protected[key]
+        if key in self.probation:
+            # second use: promote to the protected segment
+            self.hits += 1
+            posting_list = self.probation.pop(key)
+            self.probation_bytes -= self.sizes[key]
+            self.add_protected(key, posting_list)
+            return posting_list
+        self.misses += 1
+        return None
+
+    def put(self, key, posting_list, protected=False):
+        if key in self:
+            return
+        size = posting_list.nbytes()
+        if key in self.pinned_keys:
+            self.sizes[key] = size
+            self.pinned[key] = posting_list
+            self.pinned_bytes += size
+            self.evict()
+            return
+        if size > self.max_bytes - self.pinned_bytes:
+            return  # would not fit even in an empty cache
+        self.sizes[key] = size
+        if protected:
+            self.add_protected(key, posting_list)
+        else:
+            self.probation[key] = posting_list
+            self.probation_bytes += size
+            self.evict()
+
+    def add_protected(self, key, posting_list):
+        self.protected[key] = posting_list
+        self.protected_bytes += self.sizes[key]
+        while self.protected_bytes > self.max_protected_bytes and len(self.protected) > 1:
+            demoted_key, demoted = self.protected.popitem(last=False)
+            self.protected_bytes -= self.sizes[demoted_key]
+            self.probation[demoted_key] = demoted
+            self.probation_bytes += self.sizes[demoted_key]
+        self.evict()
+
+    def evict(self):
+        while self.probation and self.pinned_bytes + self.protected_bytes + self.probation_bytes > self.max_bytes:
+            evicted_key, _ = self.probation.popitem(last=False)
+            self.probation_bytes -= self.sizes.pop(evicted_key)
+            self.evictions += 1
+        while self.protected and self.pinned_bytes + self.protected_bytes > self.max_bytes:
+            evicted_key, _ = self.protected.popitem(last=False)  # only when the pinned lists take (nearly) everything
+            self.protected_bytes -= self.sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def pin(self, key):
+        """
+        Keep the list of the term in the cache for good once it is put() (an already cached list is moved).
+        """
+        self.pinned_keys.add(key)
+        if key in self.probation:
+            self.probation_bytes -= self.sizes[key]
+            self.put(key, self.probation.pop(key))
+        elif key in self.protected:
+            self.protected_bytes -= self.sizes[key]
+            self.put(key, self.protected.pop(key))
+
+    def clear(self):
+        self.probation.clear()
+        self.protected.clear()
+        self.pinned.clear()
+        self.pinned_keys.clear()
+        self.sizes.clear()
+        self.probation_bytes = self.protected_bytes = self.pinned_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.pinned or key in self.protected or key in self.probation
+
+    def __len__(self):
+        return len(self.probation) + len(self.protected) + len(self.pinned)
+
+    def __repr__(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0.0
+        used_bytes = self.pinned_bytes + self.protected_bytes + self.probation_bytes
+        return (f'{len(self)} lists ({len(self.pinned)} pinned, {len(self.protected)} protected), '
+                f'{used_bytes} of {self.max_bytes} bytes, {self.hits} hits, {self.misses} misses '
+                f'({hit_rate:.1f}% hit rate), {self.evictions} evictions')
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""
+Cache of evaluated (sub-)queries. Results are keyed on the canonical postfix form of a node of the query plan
+(see query_plan.canonical_key): terms are already normalized and the operands of AND and OR are sorted, so
+"Rates AND bank" and "bank AND rate" share one entry.
+"""
+import collections
+
+RESULT_CACHE_POSTINGS = 1 << 20  # doc ids kept in the cache, i.e. about 4 MB of results
+
+
+class ResultCache:
+    """
+    Least recently used cache of posting lists, bounded by the total number of doc ids it holds. Every entry
+    belongs to one generation of the index (see SearchEngine.index_generation): when the index files change,
+    the whole cache is dropped.
+    """
+    def __init__(self, max_postings=RESULT_CACHE_POSTINGS):
+        self.max_postings = max_postings
+        self.entries = collections.OrderedDict()  # canonical key -> posting list, least recently used first
+        self.postings = 0  # doc ids held by the entries
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.queries = 0  # queries searched, and how many of them came straight from the cache
+        self.queries_answered = 0
+
+    def get(self, key):
+        posting_list = self.entries.get(key)
+        if posting_list is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return posting_list
+
+    def get_first(self, keys):
+        """
+        The index of the first of the keys that is in the cache, and its entry; (None, None) if none is. Counted as
+        a single lookup, however many keys it tries.
+        """
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                return i, self.get(key)
+        self.misses += 1
+        return None, None
+
+    def put(self, key, posting_list):
+        size = max(1, len(posting_list))  # empty results are worth keeping too, but are not free
+        if size > self.max_postings:
+            return
+        if key in self.entries:
+            self.postings -= max(1, len(self.entries.pop(key)))
+        self.entries[key] = posting_list
+        self.postings += size
+        while self.postings > self.max_postings:
+            _, evicted = self.entries.popitem(last=False)
+            self.postings -= max(1, len(evicted))
+            self.evictions += 1
+
+    def validate(self, generation):
+        """
+        Drop every entry if they were computed on another generation of the index.
+        """
+        if generation != self.generation:
+            if self.generation is not None:
+                self.invalidations += 1
+            self.entries.clear()
+            self.postings = 0
+            self.generation = generation
+
+    def record_query(self, answered_from_cache):
+        self.queries += 1
+        self.queries_answered += answered_from_cache
+
+    def __repr__(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0.0
+        return (f'{self.queries_answered} of {self.queries} queries answered from the cache, '
+                f'{self.hits} hits in {lookups} lookups ({hit_rate:.1f}% hit rate), '
+                f'{len(self.entries)} entries ({self.postings} doc ids), '
+                f'{self.evictions} evictions, {self.invalidations} invalidations')
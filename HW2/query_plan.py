@@ -0,0 +1,403 @@
+#!/usr/bin/python3
+"""
+Query planning: the postfix (RPN) output of shunting_yard is turned into an expression tree in which chains of
+the same operator are flattened into one n-ary node. The document frequencies in the dictionary give an estimate
+of the size of every node, which is used to run the operands of an AND from the rarest to the most common term.
+
+NOT is kept as a lazy complement: a node whose `negated` flag is set evaluates to the list of documents it does
+NOT match. "x AND NOT y" then becomes a difference, "NOT x AND NOT y" becomes NOT (x OR y), and the (very long)
+all_documents_combined list is only merged with when the whole query is a complement.
+
+A wildcard like trad* is an operand that stands for the OR of all the terms it expands to (see wildcards.py);
+their lists are merged in one go rather than pairwise.
+
+A "quoted phrase" and a NEAR/k b are positional nodes: the doc ids of their terms are intersected like an AND
+(rarest term first), and only the documents that are left have their positions read (see positions.py), so they
+cost little more than the AND itself.
+
+Every node has a canonical key (its postfix form with the operands of AND and OR sorted), under which the
+results of operations are kept in the engine's result cache (see query_cache.py), and under which a batch of
+queries shares the nodes that occur more than once (see SharedResults).
+"""
+import array
+import collections
+
+from positions import phrase_at, within
+from postings import DOC_ID_TYPECODE, PostingList
+from wildcards import is_wildcard
+
+SHARED, CACHED = 'shared', 'cached'  # where SearchEngine.lookup_result found a result
+
+
+class Term:
+    negated = False
+    cached = False
+    shared = False
+
+    def __init__(self, term):
+        self.term = term
+        self.key = term
+        self.estimate = None  # estimated number of matching documents, set by plan()
+        self.actual = None  # number of matching documents, set by evaluate()
+        self.suggested = None  # set by the first call of suggestions()
+
+    def plan(self, engine):
+        self.estimate = engine.document_frequency(self.term)
+        return self
+
+    def suggestions(self, engine):
+        """
+        (term, document frequency) the engine suggests for a term that is not in the dictionary. Only looked up
+        when someone reads them (--explain or the info log): a plain search does not pay for them.
+        """
+        if self.estimate != 0:
+            return []
+        if self.suggested is None:
+            self.suggested = engine.suggest(self.term)
+        return self.suggested
+
+    def list_estimate(self, engine):
+        return self.estimate
+
+    def evaluate(self, engine):
+        result, _ = engine.lookup_result(self.key, cache=False)  # term lists are only shared within a batch
+        if result is None:
+            result = engine.search_term(self.term)
+            if result is None:
+                result = PostingList()  # a term that is not in the dictionary matches no document
+            engine.store_result(self.key, result, cache=False)
+        self.actual = len(result)
+        return result
+
+    def nodes(self):
+        yield self
+
+    def explain(self, engine, depth=0):
+        suggestions = self.suggestions(engine)
+        did_you_mean = f', did you mean {format_suggestions(suggestions)}?' if suggestions else ''
+        return [f'{"    " * depth}{self.term}  (estimated {self.estimate}, actual {format_actual(self.actual)}{did_you_mean})']
+
+
+class Wildcard(Term):
+    """
+    The terms of all the words that match a pattern, ORed. Its key is the pattern, so the union is kept in the
+    result cache like the result of an operation.
+    """
+    def __init__(self, pattern):
+        super().__init__(pattern)
+        self.terms = None  # what the pattern expands to, set by plan()
+
+    def plan(self, engine):
+        self.terms = engine.expand_wildcard(self.term)
+        self.estimate = min(sum(engine.document_frequency(term) for term in self.terms), engine.number_of_documents)
+        return self
+
+    def evaluate(self, engine):
+        result, source = engine.lookup_result(self.key)
+        self.cached, self.shared = source == CACHED, source == SHARED
+        if result is None:
+            result = engine.search_terms(self.terms)
+            engine.store_result(self.key, result)
+        self.actual = len(result)
+        return result
+
+    def suggestions(self, engine):
+        return []  # a pattern has no spelling suggestions, it expands to the terms that do exist
+
+    def explain(self, engine, depth=0):
+        return [f'{"    " * depth}{self.term}  (expands to {len(self.terms)} terms, estimated {self.estimate}, '
+                f'actual {format_actual(self.actual)}{format_source(self)})']
+
+
+class Operation:
+    def __init__(self, operator, children):
+        self.operator = operator
+        self.children = children
+        self.key = canonical_key(operator, children)
+        self.negated = False  # True if evaluate() returns the documents this node does NOT match
+        self.estimate = None
+        self.actual = None
+        self.cached = False  # True if evaluate() took the result from the result cache
+        self.shared = False  # True if evaluate() took the result of the same node evaluated earlier in the batch
+
+    def plan(self, engine):
+        for child in self.children:
+            child.plan(engine)
+
+        if self.operator == 'NOT':
+            self.negated = not self.children[0].negated
+            self.estimate = engine.number_of_documents - self.children[0].estimate
+            return self
+
+        positives = sorted((child for child in self.children if not child.negated), key=lambda child: child.estimate)
+        negatives = [child for child in self.children if child.negated]
+        if self.operator == 'AND':
+            # The intersection is never larger than its smallest operand, so we start with the rarest one and
+            # every following merge works on the smallest possible intermediate result. Negated operands are
+            # subtracted afterwards, the ones that remove the most documents first.
+            self.negated = not positives
+            negatives.sort(key=lambda child: child.list_estimate(engine), reverse=not self.negated)
+            self.estimate = min(child.estimate for child in self.children)
+        else:  # OR
+            # NOT x OR y = NOT (x AND NOT y): the complement is an intersection, so the rarest list goes first
+            self.negated = bool(negatives)
+            negatives.sort(key=lambda child: child.list_estimate(engine))
+            self.estimate = min(sum(child.estimate for child in self.children), engine.number_of_documents)
+        self.children = positives + negatives
+        return self
+
+    def list_estimate(self, engine):
+        """
+        Estimated length of the list evaluate() returns.
+        """
+        return engine.number_of_documents - self.estimate if self.negated else self.estimate
+
+    def evaluate(self, engine):
+        if self.operator == 'NOT':
+            # NOT only flips the meaning of the list of its operand, there is nothing worth caching
+            result = self.children[0].evaluate(engine)
+        else:
+            result, source = engine.lookup_result(self.key)
+            self.cached, self.shared = source == CACHED, source == SHARED
+            if result is None:
+                result = self.compute(engine)
+                engine.store_result(self.key, result)
+
+        self.actual = engine.number_of_documents - len(result) if self.negated else len(result)
+        return result
+
+    def nodes(self):
+        yield self
+        for child in self.children:
+            yield from child.nodes()
+
+    def compute(self, engine):
+        positives = [child for child in self.children if not child.negated]
+        negatives = [child for child in self.children if child.negated]
+
+        if self.operator == 'AND' and positives:
+            # x AND y AND NOT z = (x AND y) - z
+            result = intersect(positives, engine, cache_prefixes=True)
+            result = subtract(result, negatives, engine)
+        elif self.operator == 'AND':
+            # NOT x AND NOT y = NOT (x OR y)
+            result = union(negatives, engine)
+        elif negatives:
+            # NOT x OR NOT y OR z = NOT ((x AND y) - z)
+            result = intersect(negatives, engine)
+            result = subtract(result, positives, engine)
+        else:
+            result = union(positives, engine)
+        return result
+
+    def suggestions(self, engine):
+        return []  # only terms have spelling suggestions
+
+    def explain(self, engine, depth=0):
+        lazy = ', kept as a complement' if self.negated else ''
+        lines = [f'{"    " * depth}{self.operator}  (estimated {self.estimate}, actual {format_actual(self.actual)}{lazy}'
+                 f'{format_source(self)})']
+        for child in self.children:
+            lines.extend(child.explain(engine, depth + 1))
+        return lines
+
+
+class Phrase(Operation):
+    """
+    The terms next to each other, in this order. Its key is the phrase itself, in quotes.
+    """
+    def __init__(self, children):
+        super().__init__('PHRASE', children)
+        self.key = '"' + ' '.join(child.key for child in children) + '"'
+
+    def plan(self, engine):
+        plan_positional(self, engine)
+        return self
+
+    def compute(self, engine):
+        # the children keep the order of the phrase, the offset of a term in it is its index
+        by_rarity = sorted(range(len(self.children)), key=lambda i: self.children[i].estimate)
+        candidates = intersect([self.children[i] for i in by_rarity], engine)
+        if len(candidates) == 0:
+            return candidates
+        term_positions = [(i, engine.term_positions(self.children[i].term)) for i in by_rarity]
+        return PostingList(array.array(DOC_ID_TYPECODE, [doc_id for doc_id in candidates
+                                                         if phrase_at(doc_id, term_positions)]))
+
+
+class Near(Operation):
+    """
+    Two terms at most `distance` positions apart, in either order.
+    """
+    def __init__(self, distance, children):
+        super().__init__(f'NEAR/{distance}', children)
+        self.distance = distance
+
+    def plan(self, engine):
+        plan_positional(self, engine)
+        self.children.sort(key=lambda child: child.estimate)
+        return self
+
+    def compute(self, engine):
+        candidates = intersect(self.children, engine)
+        if len(candidates) == 0:
+            return candidates
+        a, b = (engine.term_positions(child.term) for child in self.children)
+        return PostingList(array.array(DOC_ID_TYPECODE, [doc_id for doc_id in candidates
+                                                         if within(a.of(doc_id), b.of(doc_id), self.distance)]))
+
+
+def plan_positional(node, engine):
+    if not engine.has_positions():
+        raise ValueError('phrase and NEAR queries need an index built with index.py --positions')
+    for child in node.children:
+        child.plan(engine)
+    node.estimate = min(child.estimate for child in node.children)  # the same bound as for an AND
+
+
+class SharedResults:
+    """
+    Results of the nodes that occur more than once in a batch of (planned) queries. Every evaluation of a node
+    looks its key up here first; a result is kept from its first evaluation until its last use in the batch,
+    whatever the size of the result cache.
+
+    Not every node of a plan is evaluated: an AND stops at an empty intermediate result, a node found in the
+    result cache does not evaluate its operands and NOT has no result of its own. finish() counts the uses of
+    those nodes once their query is done, so their results are not held until the end of the batch.
+    """
+    def __init__(self, plans):
+        self.uses = collections.Counter(node.key for plan in plans for node in plan.nodes())
+        self.looked_up = collections.Counter()  # keys looked up by the query being evaluated
+        self.results = {}
+        self.reused = 0
+
+    def shared(self):
+        return sum(1 for uses in self.uses.values() if uses > 1)
+
+    def lookup(self, key):
+        self.uses[key] -= 1
+        self.looked_up[key] += 1
+        result = self.results.get(key)
+        if result is not None:
+            self.reused += 1
+            if self.uses[key] <= 0:
+                del self.results[key]  # that was the last use
+        return result
+
+    def store(self, key, result):
+        if self.uses[key] > 0:
+            self.results[key] = result
+
+    def finish(self, plan):
+        """
+        The query of the plan has been evaluated: the nodes it did not look up will not be used either.
+        """
+        skipped = collections.Counter(node.key for node in plan.nodes()) - self.looked_up
+        for key, uses in skipped.items():
+            self.uses[key] -= uses
+            if self.uses[key] <= 0:
+                self.results.pop(key, None)
+        self.looked_up.clear()
+
+
+def intersect(children, engine, cache_prefixes=False):
+    """
+    With cache_prefixes, the children are the (positive) operands of an AND, so the intersection of the first k
+    of them is the sub-expression "c1 AND ... AND ck". The longest one found in the result cache is reused,
+    and the ones computed here are added to it, so hot pairs like "a AND b" are shared between queries.
+    """
+    result, merged = None, 1
+    if cache_prefixes and len(children) > 2:
+        longest_first = range(len(children) - 1, 1, -1)
+        i, result = engine.result_cache.get_first([canonical_key('AND', children[:k]) for k in longest_first])
+        if result is not None:
+            merged = longest_first[i]
+    if result is None:
+        result = children[0].evaluate(engine)
+
+    for k in range(merged, len(children)):
+        if len(result) == 0:
+            break  # nothing left to intersect with, the remaining operands are never even fetched
+        result = result.and_merge(children[k].evaluate(engine))
+        if cache_prefixes and k + 1 < len(children):
+            engine.result_cache.put(canonical_key('AND', children[:k + 1]), result)
+    return result
+
+
+def subtract(result, children, engine):
+    for child in children:
+        if len(result) == 0:
+            break
+        result = result.and_not_merge(child.evaluate(engine))
+    return result
+
+
+def union(children, engine):
+    result = children[0].evaluate(engine)
+    for child in children[1:]:
+        result = result.or_merge(child.evaluate(engine))
+    return result
+
+
+def canonical_key(operator, children):
+    """
+    The postfix form of an operation with the given (already keyed) operands. AND and OR are commutative, so
+    their operands are sorted; a flattened chain of n operands ends with the operator n-1 times.
+    """
+    if operator == 'NOT':
+        return f'{children[0].key} NOT'
+    return ' '.join(sorted(child.key for child in children) + [operator] * (len(children) - 1))
+
+
+def format_actual(actual):
+    return actual if actual is not None else 'not evaluated'
+
+
+def format_source(node):
+    if node.cached:
+        return ', from the result cache'
+    if node.shared:
+        return ', shared in the batch'
+    return ''
+
+
+def format_suggestions(suggestions):
+    return ' or '.join(f'{term} (df {document_frequency})' for term, document_frequency in suggestions)
+
+
+def build_tree(RPN):
+    """
+    Turn the postfix query into an expression tree. Nested operations with the same (associative) operator are
+    flattened, so "a AND b AND c" becomes a single AND node with three operands.
+    """
+    stack = []
+    for token in RPN:
+        binary = token in ('AND', 'OR') or token.startswith('NEAR/')
+        if (token == 'NOT' and len(stack) < 1) or (binary and len(stack) < 2):
+            raise ValueError(f'Malformed query: operator {token} is missing an operand')
+        if token == 'NOT':
+            stack.append(Operation('NOT', [stack.pop()]))
+        elif token.startswith('NEAR/'):
+            right, left = stack.pop(), stack.pop()
+            if type(left) is not Term or type(right) is not Term:
+                raise ValueError(f'Malformed query: {token} takes two single terms')
+            stack.append(Near(int(token[len('NEAR/'):]), [left, right]))
+        elif token.startswith('"'):
+            stack.append(Phrase([Term(term) for term in token.strip('"').split()]))
+        elif token in ('AND', 'OR'):
+            right, left = stack.pop(), stack.pop()
+            children = []
+            for child in (left, right):
+                if isinstance(child, Operation) and child.operator == token:
+                    children.extend(child.children)
+                else:
+                    children.append(child)
+            stack.append(Operation(token, children))
+        elif is_wildcard(token):
+            stack.append(Wildcard(token))
+        else:
+            stack.append(Term(token))
+
+    if len(stack) != 1:
+        raise ValueError(f'Malformed query: {" ".join(RPN)}')
+    return stack[0]
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+"""
+Ranked retrieval with BM25.
+
+    score(d) = sum over the query terms t of  idf(t) * tf(t, d) * (k1 + 1) / (tf(t, d) + K(d))
+    K(d)     = k1 * (1 - b + b * |d| / average document length)
+
+The term frequencies and document lengths come from the .tf file written by index.py (see weights.py). There are
+three strategies, which return exactly the same top k:
+
+exhaustive       term at a time: the posting list of every query term is walked once, adding the term's
+                 contribution to an accumulator per document, and the k best documents are then picked with a
+                 bounded heap, without sorting all the documents that matched.
+wand             document at a time over cursors on the posting lists (Broder et al., WAND). Every term has an
+                 upper bound of its score; a document is only scored if the bounds of the terms it can contain
+                 add up to more than the k-th best score so far, all other postings are skipped.
+block-max-wand   WAND plus the upper bounds of the blocks between the skip pointers (Ding and Suel): a candidate
+                 whose block bounds cannot beat the k-th best score skips to the end of the shallowest block.
+"""
+import bisect
+import heapq
+import math
+import operator
+
+import weights
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOP_K = 10  # documents returned per ranked query, unless another k is given
+RANKING_STRATEGIES = ['exhaustive', 'wand', 'block-max-wand']
+# WAND and Block-Max WAND score a fraction of the postings, but every document they score costs a round of cursor
+# bookkeeping in Python: on lists as short as Reuters' the plain loop of term_at_a_time is as fast (see
+# benchmarks/bench_ranking.py). The pruning pays off once the posting lists are long.
+DEFAULT_STRATEGY = 'exhaustive'
+# Upper bounds are raised by this fraction, so a bound that equals a score cannot end up below it by rounding
+# (the bound and the score add up the same numbers in a different order).
+BOUND_SLACK = 1e-9
+NO_MORE_DOCUMENTS = float('inf')
+BY_DOC_ID = operator.attrgetter('doc_id')
+
+
+def idf(number_of_documents, document_frequency):
+    # the +1 keeps the idf of terms that occur in more than half of the documents positive
+    return math.log(1 + (number_of_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def average_length(document_lengths):
+    return sum(document_lengths.values()) / max(1, len(document_lengths))
+
+
+def length_norm(length, average):
+    return BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+
+
+def length_norms(document_lengths):
+    """
+    doc id -> K(d), computed once for the whole index.
+    """
+    average = average_length(document_lengths)
+    return {doc_id: length_norm(length, average) for doc_id, length in document_lengths.items()}
+
+
+def term_at_a_time(postings, norms):
+    """
+    postings are the (weight, doc ids, term frequencies, block summaries) of the query terms, where the weight is
+    the idf of the term times (k1 + 1) times its frequency in the query. Returns the accumulators: doc id -> score.
+    """
+    accumulators = {}
+    get = accumulators.get
+    for weight, doc_ids, frequencies, _ in postings:
+        for doc_id, frequency in zip(doc_ids.tolist(), frequencies.tolist()):
+            accumulators[doc_id] = get(doc_id, 0.0) + weight * frequency / (frequency + norms[doc_id])
+    return accumulators
+
+
+def top_k(accumulators, k=TOP_K):
+    """
+    The k highest scoring (doc id, score), best first; equal scores go to the lowest doc id. nlargest keeps a
+    heap of k entries, so this is O(n log k) for n scored documents.
+    """
+    return heapq.nlargest(k, accumulators.items(), key=lambda item: (item[1], -item[0]))
+
+
+class Cursor:
+    """
+    Position in the posting list of one query term (in one segment), for document at a time evaluation.
+    """
+    def __init__(self, weight, doc_ids, frequencies, blocks, average):
+        self.weight = weight
+        self.doc_ids = doc_ids.tolist()
+        self.frequencies = frequencies
+        self.position = 0
+        self.doc_id = self.doc_ids[0] if self.doc_ids else NO_MORE_DOCUMENTS
+        # the last doc id and the score bound of every block, and a sentinel block after the last one
+        max_frequencies, min_lengths = blocks
+        starts = weights.block_starts(len(self.doc_ids))
+        self.block_last_doc_ids = [self.doc_ids[end - 1] for end in starts[1:] + [len(self.doc_ids)]]
+        self.block_last_doc_ids.append(NO_MORE_DOCUMENTS)
+        self.block_bounds = [weight * frequency / (frequency + length_norm(length, average)) * (1 + BOUND_SLACK)
+                             for frequency, length in zip(max_frequencies.tolist(), min_lengths.tolist())]
+        self.block_bounds.append(0.0)
+        self.upper_bound = max(self.block_bounds)
+        self.block = 0
+
+    def advance(self, target):
+        """
+        Move to the first posting with a doc id of at least target.
+        """
+        self.position = bisect.bisect_left(self.doc_ids, target, self.position)
+        self.doc_id = self.doc_ids[self.position] if self.position < len(self.doc_ids) else NO_MORE_DOCUMENTS
+
+    def next(self):
+        self.position += 1
+        self.doc_id = self.doc_ids[self.position] if self.position < len(self.doc_ids) else NO_MORE_DOCUMENTS
+
+    def block_bound(self, target):
+        """
+        The score bound of the block that holds target (if the term occurs in target at all), moving the block
+        pointer only: the postings of the block are not touched.
+        """
+        if self.block_last_doc_ids[self.block] < target:
+            self.block = bisect.bisect_left(self.block_last_doc_ids, target, self.block)
+        return self.block_bounds[self.block]
+
+    def block_end(self):
+        return self.block_last_doc_ids[self.block]
+
+
+def document_at_a_time(postings, norms, average, k, block_max=True):
+    """
+    (Block-Max) WAND over the (weight, doc ids, term frequencies, block summaries) of the query terms. Returns the
+    k best (doc id, score), best first, and the number of postings that were scored.
+    """
+    cursors = [Cursor(weight, doc_ids, frequencies, blocks, average)
+               for weight, doc_ids, frequencies, blocks in postings if len(doc_ids)]
+    top = []  # min-heap of (score, -doc id) of the k best documents so far
+    threshold = 0.0  # the score a document has to beat to get in, once there are k
+    scored = 0
+    if k <= 0:
+        return [], scored
+    active = list(cursors)  # the cursors that are not exhausted, in doc id order
+    while True:
+        # only a few cursors moved since the last round, sorting the nearly sorted list is cheap
+        active.sort(key=BY_DOC_ID)
+        while active and active[-1].doc_id == NO_MORE_DOCUMENTS:
+            active.pop()
+        # the pivot is the first cursor at which the bounds add up to more than the threshold: no document before
+        # its doc id can make it into the top k
+        bound = 0.0
+        pivot = None
+        for i, cursor in enumerate(active):
+            bound += cursor.upper_bound
+            if bound > threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc_id = active[pivot].doc_id
+        while pivot + 1 < len(active) and active[pivot + 1].doc_id == pivot_doc_id:
+            pivot += 1
+
+        block_bound = 0.0
+        if block_max:
+            for cursor in active[:pivot + 1]:
+                block_bound += cursor.block_bound(pivot_doc_id)
+        if block_max and block_bound <= threshold:
+            # Nothing in the current blocks can make it: skip past the first block to end (or to the next cursor).
+            # Documents of the later cursors are not in these blocks, so they have nothing to add.
+            target = min(cursor.block_end() for cursor in active[:pivot + 1]) + 1
+            if pivot + 1 < len(active):
+                target = min(target, active[pivot + 1].doc_id)
+            for cursor in active[:pivot + 1]:
+                cursor.advance(target)
+        elif active[0].doc_id == pivot_doc_id:
+            # every cursor up to the pivot is on this document: score it, adding the terms up in query order
+            # like term_at_a_time does, so both give the very same score
+            score = 0.0
+            norm = norms[pivot_doc_id]
+            for cursor in cursors:
+                if cursor.doc_id == pivot_doc_id:
+                    frequency = cursor.frequencies[cursor.position]
+                    score += cursor.weight * frequency / (frequency + norm)
+                    cursor.next()
+            scored += pivot + 1
+            # documents come in ascending doc id order, so a tie with the k-th best loses (as in top_k)
+            if len(top) < k:
+                heapq.heappush(top, (score, -pivot_doc_id))
+            elif (score, -pivot_doc_id) > top[0]:
+                heapq.heapreplace(top, (score, -pivot_doc_id))
+            if len(top) == k:
+                threshold = top[0][0]
+        else:
+            # the documents before the pivot cannot make it, move the cursors in front of it up to the pivot
+            for cursor in active[:pivot]:
+                cursor.advance(pivot_doc_id)
+    return [(-negated_doc_id, score) for score, negated_doc_id in sorted(top, reverse=True)], scored
+
+
+def rank(postings, norms, average, k=TOP_K, strategy=DEFAULT_STRATEGY):
+    """
+    The k best (doc id, score) for the (weight, doc ids, term frequencies, block summaries) of the query terms,
+    best first, and the number of postings that were scored.
+    """
+    if strategy == 'exhaustive':
+        return top_k(term_at_a_time(postings, norms), k), sum(len(doc_ids) for _, doc_ids, _, _ in postings)
+    if strategy not in RANKING_STRATEGIES:
+        raise ValueError(f'Unknown ranking strategy {strategy}, expected one of {", ".join(RANKING_STRATEGIES)}')
+    return document_at_a_time(postings, norms, average, k, block_max=strategy == 'block-max-wand')
@@ -1,388 +1,65 @@
 #!/usr/bin/python3
-import pickle
+import collections
+import logging
+import os
 import re
-import nltk
 import sys
+import time
 import getopt
 
-OPERATORS = ["NOT", "AND", "OR"]
-PRECEDENCE_DICT = {"NOT": 3, "AND": 2, "OR": 1}  # the precedence order for not, and, or.
-PORTER_STEMMER = nltk.stem.porter.PorterStemmer()
-STOP_WORDS = set(nltk.corpus.stopwords.words('english') + [".", ",", ";", ":"])
-NUMBER_OF_BLOCKS = 10
-
-with open('term_conversion.txt', 'rb') as read_term_converter:
-    term_to_term_id = pickle.load(read_term_converter)  # term (str) -> term id (int, 4 bytes)
-    term_id_to_term = pickle.load(read_term_converter)  # term id (int, 4 bytes) -> term (str)
-
-
-class Posting:
-    def __init__(self, data):
-        self.doc_id = data
-        self.next = None
-        self.skip = None
-
-    def __repr__(self):
-        return str(self.doc_id) + str(f' ({self.skip.doc_id})') if self.skip is not None else str(self.doc_id)
-
-
-class PostingList:
-    def __init__(self):
-        self.head = None
-        self.length = 1
-
-    def add_first(self, node):
-        node.next = self.head
-        self.head = node
-
-    def convert_to_linked_list(self, list_of_postings, number_of_postings):
-        self.length = number_of_postings
-        current_node = self.head
-        for posting_doc_id in list_of_postings:
-            current_node.next = Posting(posting_doc_id)
-            current_node = current_node.next
-
-    def alt_or_merge(self, a, b):
-        head_a = a
-        while a is not None and a.next is not None:
-            print(f'A: {a}, B: {b}')
-            if a.doc_id == b.doc_id:
-                # in this case, we want to break the tie in favor of the posting that have the
-                # lowest numbered next posting
-
-                c = a
-                d = b
-                tie_broken = False
-                while not tie_broken:
-                    a_next = c.next.doc_id if c.next is not None else 0
-                    b_next = d.next.doc_id if d.next is not None else 0
-
-                    result = a  # does not matter which one of a or b we pick
-                    if a_next < b_next:
-                        a = a.next  # continue the forward traversal of the lists
-                        tie_broken = True
-                    elif a_next > b_next:
-                        a = b.next  # continue the forward traversal of the lists
-                        tie_broken = True
-                    else:
-                        c = a.next
-                        d = b.next
-
-            elif a.doc_id < b.doc_id:
-
-                # if this is the case, then we check if we can use the skip ptr or not.
-                if a.skip is not None and b.doc_id - a.skip.doc_id >= 0:
-                    prev_skip = a  # if we use the skip pointer, we remember where we skipped from.
-                    # "With great power comes great responsibility."
-                    a = a.skip  # traverse forward using the skip pointer
-                else:
-                    a = a.next
-
-            elif a.doc_id > b.doc_id:
-                if b.skip is not None and a.doc_id - b.skip.doc_id >= 0:
-                    b = b.skip
-                else:
-                    b = b.next  # traverse forward in b's postings
-
-        return head_a
-
-    def or_merge(self, a, b):
-        """
-        This is the same as a merge between the two posting lists. We are looking for the union of two linked lists.
-        Time Complexity: O(x+y)
-        """
-        result = None
-
-        # Base cases
-        if a is None:
-            return b
-        elif b is None:
-            return a
-
-        # Pick either a or b, and recur
-        if a.doc_id < b.doc_id:
-            result = a
-            result.next = self.or_merge(a.next, b)
-        elif a.doc_id > b.doc_id:
-            result = b
-            result.next = self.or_merge(a, b.next)
-        else:
-            # if both are the same, we want to set to include only one of the postings and set
-            # the next to the smallest of a.next and b.next.
-            tie_broken = False
-            while not tie_broken:
-                a_next = a.next.doc_id if a.next is not None else 0
-                b_next = b.next.doc_id if b.next is not None else 0
-
-                result = a  # does not matter which one of a or b we pick
-                if a_next < b_next:
-                    result.next = self.or_merge(a, a.next)
-                elif a_next >= b_next:
-                    result.next = self.or_merge(a, b.next)
-                else:
-                    result.next = self.or_merge(a, b.next)
-
-
-        return result
-
-    def and_merge(self, a, b):
-        """
-        This is the same as looking for the intersection of two linked lists.
-        Time Complexity: O(x+y)
-        """
-        result = None
-
-        # Base case. An AND operation always return null if one of the lists are empty
-        if a is None or b is None:
-            return None
-
-        if a.doc_id == b.doc_id:
-            # if the two postings are the same, it should (hopefully) not matter which one we choose to add to our list
-            result = a
-            result.next = self.and_merge(a.next, b)
-
-        elif a.doc_id < b.doc_id:
-            if a.next is None:
-                return None
-            # we only use the skip ptr if it gets us closer to the larger doc_id of b
-            if a.skip is not None and b.doc_id - a.skip.doc_id >= 0:
-                result = self.and_merge(a.skip, b)
-            else:
-                result = self.and_merge(a.next, b)
-
-        elif a.doc_id > b.doc_id:
-            if b.next is None:
-                return None
-            # we only use the skip ptr if it gets us closer to the larger doc_id of a
-            if b.skip is not None and a.doc_id - b.skip.doc_id >= 0:
-                result = self.and_merge(a, b.skip)
-            else:
-                result = self.and_merge(a, b.next)
-
-        return result
-
-    def and_not_merge(self, a, b):
-        head_a = a
-        prev_a = None
-        prev_skip = None
-        while a is not None and a.next is not None:
-            print(f'A: {a}, B: {b}')
-            if a.doc_id == b.doc_id:
-                if prev_a is None:
-                    # this if statement would only apply if the very first postings of both lists match.
-                    head_a = a.next
-
-                # If the doc id's are the same, we manipulate the pointer of the
-                # previous posting to the node after the current. Deciding the previous posting is a bit
-                # tricky because we are using skip pointers, hence the below if-statement.
-
-                # this if statement makes sure no previous skip ptr causes us to delete all
-                # nodes between the skip start to the skip end.
-                if prev_skip:
-                    c = prev_skip
-                    d = prev_skip
-                    while c is not None and c.next is not None:
-                        if c.doc_id == b.doc_id:
-                            d.next = c.next  # set the previous posting's next to the current's next posting
-                            a = d  # continue traversing from node a (= d (= first node before the collision))
-                            break  # we are done with this while-loop within while-loop and break
-                        else:
-                            d = c
-                            c = c.next  # continue traversing and remember last posting with var d.
-                else:
-                    if prev_a is None:
-                        prev_a = a
-                        a = head_a
-                    else:
-                        prev_a.next = a.next  # set the previous posting's next to the current's next posting
-                        a = a.next  # continue the forward traversal of the lists
-
-            elif a.doc_id < b.doc_id:
-                prev_skip = None
-                prev_a = a
-
-                # if this is the case, then we check if we can use the skip ptr or not.
-                if a.skip is not None and b.doc_id - a.skip.doc_id >= 0:
-                    prev_skip = a   # if we use the skip pointer, we remember where we skipped from.
-                                    # "With great power comes great responsibility."
-                    a = a.skip  # traverse forward using the skip pointer
-                else:
-                    a = a.next
-
-            elif a.doc_id > b.doc_id:
-                prev_skip = None
-                prev_a = a
-
-                if b.next is None:
-                    break
-                else:
-                    b = b.next  # traverse forward in b's postings
-
-        return head_a
-
-    """
-    ### LEGACY CODE ###
-    def find_first_non_match(self, a, b):
-        print(f'Comparing {a} with {b}')
-        if b.doc_id > a.doc_id:
-            print(f'We settle for {a}')
-            return a, a.next
-        if b.doc_id < a.doc_id:
-            if b.next is None:
-                return a, a.next
-            else:
-                return self.find_first_non_match(a, b.next)
-        else:
-            return self.find_first_non_match(a.next, b.next)
-
-
-    def and_not_merge(self, a, b, prev=None):
-        
-        #The listA And-Not listB operation is the same as taking ListA - {all elements in listB}
-        #Time Complexity: O(x+y)
-
-        # base cases
-        if b is None:
-            return a
-        if a is None:
-            return None
-
-        result = None
-
-        print(f'A: {a}, B: {b}')
-
-        if a.doc_id == b.doc_id:
-            # if the two postings are the same, we do not set this node, instead we set it to the next
-
-            if a.next is None:
-                return None
-
-            if prev:
-                # our idea is to skip the current node (a) by
-                # setting the previous node's next to the node in front of a.
-                prev.next, restart_node = self.find_first_non_match(a.next, b)
-
-                result = prev.next
-
-                print(f'We found {prev} -> {result} is safe')
-                print(f'TEST {a.next}')
-                print(f'Starting process from {result} again, also {b} and {result}')
-
-                result = self.and_not_merge(result, b, prev)
-
-            else:
-                # only if this was the very first posting in listA, otherwise we always have a "prev"
-                prev, restart_node = self.find_first_non_match(a.next, b)
-                result = prev
-                result.next = self.and_not_merge(restart_node, b, result)
-
-            # print(f'{prev} is now linked to {result} instead of {a} == {b}')
-
-        elif a.doc_id < b.doc_id:
-            if a.next is None:
-                return a
+import positions
+import ranking
+import stemming
+import segments
+import spelling
+import wildcards
+from postings import PostingList, or_merge_all
+from postings_cache import POSTINGS_CACHE_BYTES, PREWARM_TERMS, PostingsCache
+from query_cache import RESULT_CACHE_POSTINGS, ResultCache
+from query_plan import CACHED, SHARED, SharedResults, build_tree, format_suggestions
 
-            # we only use the skip ptr if it gets us closer to the larger doc_id of b
-            if a.skip is not None and b.doc_id - a.skip.doc_id >= 0:
-                result = self.and_not_merge(a.skip, b, a)
-            else:
-                result = self.and_not_merge(a.next, b, a)
-
-        elif a.doc_id > b.doc_id:
-            if b.next is None:
-                return a
-            # we only use the skip ptr if it gets us closer to the larger doc_id of a
-            if b.skip is not None and a.doc_id - b.skip.doc_id >= 0:
-                result = self.and_not_merge(a, b.skip, a)
-            else:
-                result = self.and_not_merge(a, b.next, a)
-
-        return result
-    """
-
-    def add_skip_ptr(self, curr_node, skip_distance, curr_idx=0, looking_for_next=False):
-
-        result = curr_node
-
-        if looking_for_next:
-            # if curr_idx is evenly divided by skip_distance, we want to add a skip pointer to this node
-            if curr_idx % skip_distance == 0:
-                return result
-            else:
-                if result is None or result.next is None:
-                    return None
-                else:
-                    # iterate deeper (if not and end of list) to find where to put the pointer
-                    return self.add_skip_ptr(result.next, skip_distance, curr_idx + 1, looking_for_next)
-        else:
-            if curr_idx % skip_distance == 0:
-                looking_for_next = True
-                result.skip = self.add_skip_ptr(result.next, skip_distance, curr_idx + 1, looking_for_next)
-
-        # main loop
-        if result.next is not None:
-            self.add_skip_ptr(result.next, skip_distance, curr_idx + 1, False)
-
-    def __iter__(self):
-        node = self.head
-        while node is not None:
-            yield node
-            node = node.next
+OPERATORS = ["NOT", "AND", "OR"]
+PRECEDENCE_DICT = {"NEAR": 4, "NOT": 3, "AND": 2, "OR": 1}  # the precedence order for near, not, and, or.
+NEAR_OPERATOR = re.compile(r'NEAR/\d+$')  # a NEAR/k b: a and b at most k positions apart
+# a "quoted phrase", a parenthesis or anything else up to the next space, parenthesis or quote
+QUERY_TOKEN = re.compile(r'"[^"]*"|[()]|[^\s()"]+')
+LOG_LEVELS = ['debug', 'info', 'warning', 'error']
+QUERY_CHUNKS_PER_JOB = 4  # with --jobs, the queries are cut in this many chunks per worker to balance the load
+OPEN_ATTEMPTS = 5  # tries to open an index whose files are being replaced, OPEN_RETRY_SECONDS apart
+OPEN_RETRY_SECONDS = 0.1
 
-    def __repr__(self):
-        node = self.head
-        nodes = []
-        while node is not None:
-            nodes.append(str(node.doc_id))
-            node = node.next
-        return " ".join(nodes)
+log = logging.getLogger('search')
 
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
-
-
-def exec_operation(listA, listB, operation):
-    resulting_postings = PostingList()
-
-    if operation == 'AND':
-        resulting_postings.head = resulting_postings.and_merge(listA.head, listB.head)
-    elif operation == 'OR':
-        resulting_postings.head = resulting_postings.alt_or_merge(listA.head, listB.head)
-    elif operation == 'ANDNOT':
-        resulting_postings.head = resulting_postings.and_not_merge(listA.head, listB.head)
-    elif operation == 'ORNOT':
-        print(f'This operation is not yet implemented')
-    elif operation == 'NOT':
-        # the query "NOT term" is executed as all_docs AND NOT term. Costly operation!
-        resulting_postings.head = resulting_postings.and_not_merge(listA.head, listB.head)
-    else:
-        print(f'Invalid operation: {operation}')
-
-    return resulting_postings
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [--explain]")
+    print("       " + sys.argv[0] + " -d dictionary-file -p postings-file --serve [--port N | --socket path] [--workers N]")
+    print("       (both accept [--postings-cache size-in-mb] [--pin term,term,...] [--log-level debug|info|warning|error])")
+    print("       (and -q/-o runs on N processes with [--jobs N])")
+    print("       -q/-o with --ranked treats every query as free text and writes its [--top k] documents by BM25 score")
+    print("       (scored with [--ranking " + '|'.join(ranking.RANKING_STRATEGIES) + "])")
 
 
-def normalize_token(token):
-    token = token.lower()  # case folding
-    token = PORTER_STEMMER.stem(token)  # porter-stemming
-    return token
+def precedence(operator):
+    return PRECEDENCE_DICT['NEAR' if NEAR_OPERATOR.match(operator) else operator]
 
 
-def shunting_yard(q):
+def shunting_yard(q, normalize_token):
     # while there are tokens to read
 
-    q = q.replace('(', '( ')
-    q = q.replace(')', ' )')
-
-    tokens = q.split()
+    if q.count('"') % 2:
+        raise ValueError('Malformed query: unbalanced quotes')
+    tokens = QUERY_TOKEN.findall(q)
 
     output_q = []
     operator_stack = []  # stack implementation, use stack.append() and stack.pop() for add/remove
 
     for token in tokens:
-        if token in OPERATORS:
-            while len(operator_stack) > 0 and operator_stack[-1] != '(' \
-                    and PRECEDENCE_DICT[operator_stack[-1]] >= PRECEDENCE_DICT[token]:
+        if token in OPERATORS or NEAR_OPERATOR.match(token):
+            # NOT is a prefix operator that applies to what follows it, so it never pops
+            # anything (this is what makes "NOT NOT a" work)
+            while token != 'NOT' and len(operator_stack) > 0 and operator_stack[-1] != '(' \
+                    and precedence(operator_stack[-1]) >= precedence(token):
                 output_q.append(operator_stack.pop())
             operator_stack.append(token)
 
@@ -390,139 +67,586 @@ def shunting_yard(q):
             operator_stack.append(token)
 
         elif token == ')':
-            while operator_stack[-1] != '(':
-                if len(operator_stack) < 1:
-                    raise "MismatchError"
+            while operator_stack and operator_stack[-1] != '(':
                 output_q.append(operator_stack.pop())
+            if not operator_stack:
+                raise ValueError('Malformed query: mismatched parentheses')
             operator_stack.pop()  # pop the left parenthesis from the stack and discard it
 
+        elif token.startswith('"'):  # a phrase is a single operand, made of its normalized terms
+            if wildcards.is_wildcard(token):
+                raise ValueError(f'Malformed query: no wildcards in a phrase, {token}')
+            terms = [normalize_token(word) for word in token.strip('"').split()]
+            if len(terms) > 1:
+                output_q.append('"' + ' '.join(terms) + '"')
+            elif terms:
+                output_q.append(terms[0])
+
+        elif wildcards.is_wildcard(token):  # matched against the words as they are, so only case folded
+            output_q.append(token.lower())
+
         else:  # token must be a search term
             output_q.append(normalize_token(token))
 
     while len(operator_stack) > 0:
         top_of_stack = operator_stack.pop()
         if top_of_stack == '(' or top_of_stack == ')':
-            raise "MismatchError"
+            raise ValueError('Malformed query: mismatched parentheses')
         output_q.append(top_of_stack)
     return output_q
 
 
-def process_query(q):
-    postix_q = shunting_yard(q)
-    return postix_q
+class SearchEngine:
+    """
+    Boolean search over an index built by index.py. Nothing is loaded up front: the dictionaries, the postings
+    files and the stem cache (and with it NLTK) are opened the first time a query needs them, so importing
+    this module or creating a SearchEngine costs next to nothing.
+    The index is the main segment plus the delta segments of `index.py --incremental` (see segments.py); the
+    posting list of a term is the union of its lists in all segments.
+    """
+    def __init__(self, dict_file, postings_file, result_cache_postings=RESULT_CACHE_POSTINGS,
+                 postings_cache_bytes=POSTINGS_CACHE_BYTES, pinned_terms=()):
+        self.dict_file = dict_file
+        self.postings_file = postings_file
+        self.postings_cache = PostingsCache(postings_cache_bytes)
+        self.pinned_terms = list(pinned_terms)  # raw query terms, normalized when they are pinned
+        self._segments = None
+        self._stem_cache = None
+        self._kgram_index = None
+        self._spelling_index = None
+        self._number_of_documents = None
+        self._document_norms = None
+        self._average_document_length = None
+        self.result_cache = ResultCache(result_cache_postings)
+        self.generation = None
+        self.shared_results = None  # SharedResults of the batch being evaluated, see search_batch()
+
+    @property
+    def segments(self):
+        # opened (and memory-mapped) on the first lookup, then kept until the index files change
+        if self._segments is None:
+            self.check_index_generation()
+        return self._segments
+
+    @property
+    def dictionary(self):
+        # The dictionary of the main segment is memory-mapped rather than read into memory. It maps term -> term_id with
+        # dictionary.term_id(term), and term_id -> (doc_freq, file_offset, postings_length_in_bytes) with dictionary[term_id]
+        return self.segments[0].dictionary
+
+    @property
+    def postings_reader(self):
+        return self.segments[0].postings_reader
+
+    @property
+    def stem_cache(self):
+        if self._stem_cache is None:
+            self.load_stem_cache()
+        return self._stem_cache
+
+    def load_stem_cache(self):
+        self._stem_cache = stemming.StemCache()
+        # start with the stems of the indexed documents already cached
+        self._stem_cache.load(stemming.cache_path(self.dict_file))
+
+    @property
+    def kgram_index(self):
+        # opened by the first wildcard query, then kept until the index files change
+        if self._kgram_index is None:
+            self.check_index_generation()
+            kgrams_file = wildcards.kgrams_path(self.dict_file)
+            if not os.path.exists(kgrams_file):
+                raise ValueError('wildcard queries need the k-gram index of index.py, rebuild the index')
+            self._kgram_index = wildcards.KGramIndex(kgrams_file)
+        return self._kgram_index
+
+    @property
+    def spelling_index(self):
+        # opened by the first spelling suggestion that is asked for; None for an index built without one
+        if self._spelling_index is None:
+            self.check_index_generation()
+            spelling_file = spelling.spelling_path(self.dict_file)
+            if os.path.exists(spelling_file):
+                self._spelling_index = spelling.SpellingIndex(spelling_file)
+        return self._spelling_index
+
+    def normalize_token(self, token):
+        return self.stem_cache.normalize(token)  # case folding + porter-stemming, memoized
+
+    def process_query(self, q):
+        postix_q = shunting_yard(q, self.normalize_token)
+        return postix_q
+
+    def retrieve_postings_list(self, term_id, segment_number=0):
+        key = (segment_number, term_id)
+        posting_list = self.postings_cache.get(key)
+        if posting_list is None:
+            posting_list = self.segments[segment_number].posting_list(term_id)
+            self.postings_cache.put(key, posting_list)
+        return posting_list
+
+    def term_ids(self, term):
+        """
+        (segment number, term id) for every segment that has the term.
+        """
+        keys = []
+        for segment_number, segment in enumerate(self.segments):
+            term_id = segment.dictionary.term_id(term)
+            if term_id is not None:
+                keys.append((segment_number, term_id))
+        return keys
+
+    def pin_terms(self):
+        """
+        Pin the lists of all_documents_combined (needed by every query that is a complement) and of the
+        pinned_terms in the postings cache.
+        """
+        for term in [segments.ALL_DOCUMENTS] + [self.normalize_token(term) for term in self.pinned_terms]:
+            for key in self.term_ids(term):
+                self.postings_cache.pin(key)
+
+    def open(self):
+        """
+        Open the index files and load the stem cache now rather than on the first query, e.g. in a worker that is
+        started before the queries come in.
+        """
+        self.check_index_generation()
+        if self._stem_cache is None:
+            self.load_stem_cache()
+
+    def prewarm(self, number_of_terms=PREWARM_TERMS):
+        """
+        Load the lists of the terms with the highest document frequency (and of the pinned terms) into the
+        postings cache, so even the first queries find them there.
+        """
+        self.check_index_generation()
+        # the delta segments are small next to the main one, their lists are loaded when they are first used
+        keys = list(self.postings_cache.pinned_keys) + [(0, term_id) for term_id in self.dictionary.most_frequent(number_of_terms)]
+        for segment_number, term_id in keys:
+            if (segment_number, term_id) not in self.postings_cache:
+                posting_list = self.segments[segment_number].posting_list(term_id)
+                self.postings_cache.put((segment_number, term_id), posting_list, protected=True)
+
+    def search_term(self, term_to_search):
+        """
+        Posting list of an (already normalized, see shunting_yard) term, or None if it is not in the dictionary.
+        """
+        posting_lists = [self.retrieve_postings_list(term_id, segment_number)
+                         for segment_number, term_id in self.term_ids(term_to_search)]
+        if not posting_lists:
+            return None
+
+        return or_merge_all(posting_lists)
 
+    def suggest(self, term, number_of_suggestions=spelling.MAX_SUGGESTIONS):
+        """
+        "Did you mean" for a (normalized) term that is not in the dictionary: the closest terms of the dictionary
+        as (term, document frequency), the most frequent first (see spelling.py).
+        """
+        if self.spelling_index is None:
+            return []
+        suggestions = [(candidate, self.document_frequency(candidate)) for candidate, _ in self.spelling_index.lookup(term)]
+        suggestions.sort(key=lambda suggestion: (-suggestion[1], suggestion[0]))
+        return suggestions[:number_of_suggestions]
 
-def retrieve_postings_list(dictionary, term_id):
-    with open(postings_file, 'rb') as read_postings:
-        reader_offset = dictionary[term_id][1]
-        read_postings.seek(reader_offset)
-        return pickle.load(read_postings)
+    def expand_wildcard(self, pattern):
+        """
+        The terms of the indexed words that match the pattern (see wildcards.py).
+        """
+        return self.kgram_index.expand(pattern)
 
+    def search_terms(self, terms):
+        """
+        Union of the posting lists of the (already normalized) terms in all segments, in a single k-way merge.
+        Lists that are not in the postings cache are read without adding them, so a wildcard that expands to
+        hundreds of rare terms does not evict the lists of the hot ones.
+        """
+        posting_lists = []
+        for term in terms:
+            for segment_number, term_id in self.term_ids(term):
+                if (segment_number, term_id) in self.postings_cache:
+                    posting_lists.append(self.postings_cache.get((segment_number, term_id)))
+                else:
+                    posting_lists.append(self.segments[segment_number].posting_list(term_id))
+        return or_merge_all(posting_lists)
 
-def search_term(term_to_search, dictionary):
-    searched_term = normalize_token(term_to_search) if term_to_search != 'all_documents_combined' else term_to_search
-    try:
-        term_id = term_to_term_id[searched_term]
-    except KeyError:
-        return None
+    def has_positions(self):
+        return all(segment.positions_reader is not None for segment in self.segments)
 
-    return retrieve_postings_list(dictionary, term_id)
+    def term_positions(self, term):
+        """
+        Where the term occurs in each of its documents, over all segments (see positions.TermPositions).
+        """
+        return positions.TermPositions([(self.retrieve_postings_list(term_id, segment_number).doc_ids,
+                                         self.segments[segment_number].positions_reader, term_id)
+                                        for segment_number, term_id in self.term_ids(term)])
 
+    def has_weights(self):
+        return all(segment.weights_reader is not None for segment in self.segments)
 
-def run_search(dict_file, postings_file, queries_file, results_file):
+    def term_frequencies(self, term):
+        """
+        (doc ids, term frequency in each of them, block summaries) of the term in every segment that has it.
+        """
+        return [(self.retrieve_postings_list(term_id, segment_number).doc_ids,
+                 self.segments[segment_number].weights_reader.frequencies(term_id),
+                 self.segments[segment_number].weights_reader.blocks(term_id))
+                for segment_number, term_id in self.term_ids(term)]
+
+    @property
+    def document_norms(self):
+        # the length normalization of BM25 for every document, see ranking.length_norms
+        if self._document_norms is None:
+            document_lengths = {}
+            for segment in self.segments:
+                document_lengths.update(segment.weights_reader.document_lengths())
+            self._document_norms = ranking.length_norms(document_lengths)
+            self._average_document_length = ranking.average_length(document_lengths)
+        return self._document_norms
+
+    @property
+    def average_document_length(self):
+        if self._average_document_length is None:
+            self.document_norms  # computed together with the norms
+        return self._average_document_length
+
+    def document_frequency(self, term):
+        # a document is indexed in exactly one segment, so the frequencies add up
+        return sum(self.segments[segment_number].dictionary[term_id][0]
+                   for segment_number, term_id in self.term_ids(term))
+
+    def all_documents(self):
+        return self.search_term(segments.ALL_DOCUMENTS)
+
+    @property
+    def number_of_documents(self):
+        # the document frequency of all_documents_combined is 0, the length of its posting list is what we want
+        if self._number_of_documents is None:
+            self._number_of_documents = len(self.all_documents())
+        return self._number_of_documents
+
+    def index_generation(self):
+        """
+        Identifies the version of the index files on disk: rebuilding or compacting the index changes their inode,
+        size or modification time, and adding a delta segment replaces the manifest.
+        """
+        generation = []
+        for path in (self.dict_file, self.postings_file, segments.manifest_path(self.dict_file)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                generation.append(None)  # an index without delta segments has no manifest
+                continue
+            generation.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(generation)
+
+    def check_index_generation(self):
+        """
+        Reopen the index (and drop the cached results) if the files changed since we opened them.
+        """
+        generation = self.index_generation()
+        if generation == self.generation:
+            return
+        for attempt in range(OPEN_ATTEMPTS):
+            try:
+                opened_segments = segments.open_segments(self.dict_file, self.postings_file)
+                break
+            except (segments.IncompleteSegment, FileNotFoundError) as e:
+                # caught in the middle of a compaction (or a rebuild): its files are being replaced
+                if self._segments is not None:
+                    log.info(f'Index is being updated, keep searching the previous version: {e}')
+                    return
+                if attempt == OPEN_ATTEMPTS - 1:
+                    raise
+                time.sleep(OPEN_RETRY_SECONDS)
+        self.close()
+        self._segments = opened_segments
+        self._number_of_documents = self._document_norms = self._average_document_length = None
+        self.generation = generation
+        self.result_cache.validate(generation)
+        self.postings_cache.clear()
+        self.pin_terms()
+
+    def lookup_result(self, key, cache=True):
+        """
+        Result of the plan node with the given key, if it was already evaluated in this batch or (with cache)
+        is in the result cache, and where it came from: SHARED, CACHED or None if it was in neither. Called once
+        for every evaluation of a node.
+        """
+        result = self.shared_results.lookup(key) if self.shared_results is not None else None
+        if result is not None:
+            return result, SHARED
+        if cache:
+            result = self.result_cache.get(key)
+            if result is not None:
+                return result, CACHED
+        return None, None
+
+    def store_result(self, key, result, cache=True):
+        if self.shared_results is not None:
+            self.shared_results.store(key, result)
+        if cache:
+            self.result_cache.put(key, result)
+
+    def plan_query(self, query):
+        """
+        Parse and plan one query. Returns None for an empty query.
+        """
+        RPN = self.process_query(query)  # Process this query
+        log.debug(f'Searching for query: {query.strip()} which is translated to RPN: {RPN}')
+        if not RPN:
+            return None
+        self.check_index_generation()
+        return build_tree(RPN).plan(self)
+
+    def evaluate_plan(self, plan, query, explain=False):
+        if plan is None:
+            return PostingList()
+        result = plan.evaluate(self)
+        self.result_cache.record_query(plan.cached)
+        if plan.negated:
+            # the only place where all_documents_combined is needed: the query as a whole is a complement
+            result = self.all_documents().and_not_merge(result)
+
+        if log.isEnabledFor(logging.INFO):
+            for node in plan.nodes():
+                suggestions = node.suggestions(self)
+                if suggestions:
+                    log.info(f'No document has {node.term!r}, did you mean {format_suggestions(suggestions)}?')
+
+        if explain:
+            print(f'Plan for query: {query.strip()}')
+            print('\n'.join(plan.explain(self, depth=1)))
+        return result
+
+    def search(self, query, explain=False):
+        """
+        Evaluate one query, returns the resulting posting list. With explain, the query plan is printed
+        together with the estimated and actual number of documents of every step.
+        """
+        return self.evaluate_plan(self.plan_query(query), query, explain)
+
+    def ranked_postings(self, query):
+        """
+        The (weight, doc ids, term frequencies, block summaries) of every term of a free-text query in every
+        segment, as ranking.rank takes them.
+        """
+        self.check_index_generation()
+        if not self.has_weights():
+            raise ValueError('ranked queries need the term frequencies of index.py, rebuild the index')
+        query_terms = collections.Counter(self.normalize_token(token) for token in query.split())
+        term_postings = []
+        for term, query_frequency in query_terms.items():
+            document_frequency = self.document_frequency(term)
+            if document_frequency == 0:
+                continue  # not in the index, adds nothing to any score
+            weight = ranking.idf(self.number_of_documents, document_frequency) * (ranking.BM25_K1 + 1) * query_frequency
+            term_postings.extend((weight, *lists) for lists in self.term_frequencies(term))
+        return term_postings
+
+    def search_ranked(self, query, k=ranking.TOP_K, strategy=ranking.DEFAULT_STRATEGY):
+        """
+        Score the documents for a free-text query with BM25, with one of the strategies of ranking.py.
+        Returns the k best (doc id, score), best first.
+        """
+        term_postings = self.ranked_postings(query)
+        top, _ = ranking.rank(term_postings, self.document_norms, self.average_document_length, k, strategy)
+        return top
+
+    def search_batch(self, queries, explain=False):
+        """
+        Evaluate a batch of queries. All of them are parsed and planned first, so the terms and sub-expressions
+        they have in common are known up front: each is fetched or evaluated once, and its result is kept until
+        its last use in the batch. Yields the result of every query, in order. A query that cannot be parsed
+        is logged and yields an empty posting list.
+        """
+        plans = []
+        for query in queries:
+            try:
+                plans.append(self.plan_query(query))
+            except ValueError as e:
+                log.warning(f'Skipping query {query.strip()!r}: {e}')
+                plans.append(None)
+
+        self.shared_results = SharedResults([plan for plan in plans if plan is not None])
+        log.info(f'Batch of {len(plans)} queries, {self.shared_results.shared()} terms and sub-expressions occur more than once')
+        try:
+            for query, plan in zip(queries, plans):
+                result = self.evaluate_plan(plan, query, explain)
+                if plan is not None:
+                    self.shared_results.finish(plan)
+                yield result
+            log.info(f'{self.shared_results.reused} evaluations were answered with a shared result')
+        finally:
+            self.shared_results = None
+
+    def close(self):
+        if self._kgram_index is not None:
+            self._kgram_index.close()
+            self._kgram_index = None
+        if self._spelling_index is not None:
+            self._spelling_index.close()
+            self._spelling_index = None
+        if self._segments is not None:
+            for segment in self._segments:
+                segment.close()
+            self._segments = None
+
+
+worker_engine = None  # the SearchEngine of a --jobs worker process
+
+
+def start_search_worker(dict_file, postings_file, postings_cache_bytes, pinned_terms, log_level):
+    global worker_engine
+    logging.basicConfig(level=log_level, format='%(levelname)s %(message)s')  # in case the worker was spawned
+    # every worker maps the same (read-only) index files, so the pages of the index are shared between them
+    worker_engine = SearchEngine(dict_file, postings_file, postings_cache_bytes=postings_cache_bytes,
+                                 pinned_terms=pinned_terms)
+    worker_engine.open()
+    worker_engine.prewarm()
+
+
+def ranked_line(ranked):
+    return ' '.join(str(doc_id) for doc_id, _ in ranked)
+
+
+def search_chunk(query_lines, explain, top_k=None, strategy=ranking.DEFAULT_STRATEGY):
+    if top_k is not None:
+        return [ranked_line(worker_engine.search_ranked(query, top_k, strategy)) for query in query_lines]
+    return [str(result) for result in worker_engine.search_batch(query_lines, explain)]
+
+
+def run_search_jobs(dict_file, postings_file, query_lines, results_file, explain, postings_cache_bytes, pinned_terms,
+                    jobs, top_k=None, strategy=ranking.DEFAULT_STRATEGY):
+    """
+    Shard the queries over a pool of `jobs` processes. Chunks of consecutive queries are evaluated as a batch
+    by one worker and come back in the order they were sent, so the results file keeps the order of the
+    queries file.
+    """
+    import functools
+    import multiprocessing
+
+    chunk_size = max(1, -(-len(query_lines) // (jobs * QUERY_CHUNKS_PER_JOB)))
+    chunks = [query_lines[i:i + chunk_size] for i in range(0, len(query_lines), chunk_size)]
+    initargs = (dict_file, postings_file, postings_cache_bytes, list(pinned_terms), log.getEffectiveLevel())
+    with multiprocessing.Pool(jobs, initializer=start_search_worker, initargs=initargs) as pool, \
+            open(results_file, 'w') as write_res:
+        for results in pool.imap(functools.partial(search_chunk, explain=explain, top_k=top_k, strategy=strategy), chunks):
+            write_res.writelines(result + '\n' for result in results)
+    print(f'Searched {len(query_lines)} queries in {len(chunks)} chunks on {jobs} processes')
+
+
+def run_search(dict_file, postings_file, queries_file, results_file, explain=False,
+               postings_cache_bytes=POSTINGS_CACHE_BYTES, pinned_terms=(), jobs=1, ranked=False, top_k=ranking.TOP_K,
+               strategy=ranking.DEFAULT_STRATEGY):
     """
     using the given dictionary file and postings file,
-    perform searching on the given queries file and output the results to a file
+    perform searching on the given queries file and output the results to a file.
+    With ranked, every query is free text and its line holds its top_k documents, best first, found with the
+    given ranking strategy.
     """
     print('running search on the queries...')
 
-    with open(dict_file, 'rb') as read_dict:
-        # We are able to read the full dictionary into memory
-        # The dictionary is structured as - term_id : (doc_freq, file_offset)
-        dictionary = pickle.load(read_dict)
-
-    # create / wipe the results file before we start handling the queries
-    open(results_file, 'w').close()
-
     with open(queries_file, 'r') as queries:
-        for query in queries:
-            RPN = process_query(query)  # Process this query
-            print(f'Searching for query: {query} which is translated to RPN: {RPN}')
-
-            prev_list = None
-            exec_queue = []
-
-            i = 0
-            while i < len(RPN):
-                print(exec_queue)
-                term = RPN[i]
-                print(f'Current term: {term}')
-                if term in OPERATORS:
-                    # this should only be called for first iteration, then we do accumulating runs
-                    if prev_list is None:
-                        prev_list = search_term(exec_queue.pop(0), dictionary)
-
-                    if term == 'NOT':
-                        on_last_index = i + 1 == len(RPN)
-                        if not on_last_index:
-                            if RPN[i + 1] == 'AND':
-                                # exec "term1 AND NOT term2"
-                                second_list = search_term(exec_queue.pop(0), dictionary)
-                                prev_list = exec_operation(prev_list, second_list, 'ANDNOT')
-                                i += 1
-                            elif RPN[i + 1] == 'OR':
-                                # exec "term1 OR NOT term2"
-                                all_docs_list = search_term('all_documents_combined', dictionary)
-                                prev_list = exec_operation(all_docs_list, prev_list, 'NOT')
-                            else:
-                                # exec "NOT term1"
-                                all_docs_list = search_term('all_documents_combined', dictionary)
-                                prev_list = exec_operation(all_docs_list, prev_list, 'NOT')
-                        else:
-                            # exec "NOT term1"
-                            print("EXECUTING QUERY")
-                            print(f'exec q {exec_queue}')
-                            all_docs_list = search_term('all_documents_combined', dictionary)
-                            prev_list = exec_operation(all_docs_list, prev_list, 'NOT')
-                    elif term == 'AND':
-                        second_list = search_term(exec_queue.pop(0), dictionary)
-                        prev_list = exec_operation(prev_list, second_list, 'AND')
-                    elif term == 'OR':
-                        second_list = search_term(exec_queue.pop(0), dictionary)
-                        prev_list = exec_operation(prev_list, second_list, 'OR')
-                else:
-                    exec_queue.append(term)
-                i += 1
+        query_lines = queries.readlines()
 
-            if exec_queue:
-                prev_list = search_term(exec_queue.pop(0), dictionary)
+    if jobs > 1:
+        run_search_jobs(dict_file, postings_file, query_lines, results_file, explain, postings_cache_bytes,
+                        pinned_terms, jobs, top_k if ranked else None, strategy)
+        return
 
-            with open(results_file, 'a') as write_res:
-                write_res.write(str(prev_list) + '\n')
+    engine = SearchEngine(dict_file, postings_file, postings_cache_bytes=postings_cache_bytes, pinned_terms=pinned_terms)
+    engine.prewarm()
 
+    # one buffered writer for the whole batch, every query still gets its line (empty if nothing matched)
+    with open(results_file, 'w') as write_res:
+        if ranked:
+            for query in query_lines:
+                write_res.write(ranked_line(engine.search_ranked(query, top_k, strategy)) + '\n')
+        else:
+            for result in engine.search_batch(query_lines, explain):
+                write_res.write(str(result) + '\n')
+
+    print(f'Stem cache: {engine.stem_cache}')
+    print(f'Result cache: {engine.result_cache}')
+    print(f'Postings cache: {engine.postings_cache}')
+    engine.close()
+
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = file_of_output = None
+    serve_queries = explain = False
+    port = unix_socket = workers = None
+    postings_cache_bytes = POSTINGS_CACHE_BYTES
+    pinned_terms = []
+    log_level = 'warning'
+    jobs = 1
+    ranked = False
+    top_k = ranking.TOP_K
+    strategy = ranking.DEFAULT_STRATEGY
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:', ['serve', 'port=', 'socket=', 'workers=', 'explain',
+                                                                    'postings-cache=', 'pin=', 'log-level=', 'jobs=',
+                                                                    'ranked', 'top=', 'ranking='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '--explain':  # print the plan of every query
+            explain = True
+        elif o == '--serve':  # keep the index loaded and answer queries over a socket
+            serve_queries = True
+        elif o == '--port':
+            port = int(a)
+        elif o == '--socket':  # unix socket to listen on instead of a TCP port
+            unix_socket = a
+        elif o == '--workers':  # number of processes evaluating queries
+            workers = int(a)
+        elif o == '--postings-cache':  # memory budget of the postings cache, in MB
+            postings_cache_bytes = int(float(a) * 1024 * 1024)
+        elif o == '--pin':  # terms whose posting lists are never evicted from the postings cache
+            pinned_terms.extend(term for term in a.split(',') if term)
+        elif o == '--log-level':  # debug traces every query
+            log_level = a.lower()
+        elif o == '--jobs':  # number of processes the queries file is sharded over
+            jobs = int(a)
+        elif o == '--ranked':  # free-text queries, ranked by BM25
+            ranked = True
+        elif o == '--top':  # documents per ranked query
+            top_k = int(a)
+        elif o == '--ranking':  # exhaustive, wand or block-max-wand
+            strategy = a
+        else:
+            assert False, "unhandled option"
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+    if log_level not in LOG_LEVELS or strategy not in ranking.RANKING_STRATEGIES:
+        usage()
+        sys.exit(2)
+    logging.basicConfig(level=log_level.upper(), format='%(levelname)s %(message)s')
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
+    if serve_queries:
+        if dictionary_file == None or postings_file == None:
+            usage()
+            sys.exit(2)
 
-for o, a in opts:
-    if o == '-d':
-        dictionary_file = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    else:
-        assert False, "unhandled option"
+        import server
+        server.serve(dictionary_file, postings_file, port=port or server.DEFAULT_PORT, unix_socket=unix_socket,
+                     workers=workers, postings_cache_bytes=postings_cache_bytes, pinned_terms=pinned_terms)
+        sys.exit(0)
 
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
-    usage()
-    sys.exit(2)
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
+        usage()
+        sys.exit(2)
 
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, explain, postings_cache_bytes, pinned_terms,
+               jobs, ranked, top_k, strategy)
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+"""
+Incremental indexing. `index.py --incremental` indexes only the documents that are not in the index yet, into a
+delta segment: a dictionary and postings file of its own next to the main ones (dictionary.txt.delta1,
+postings.txt.delta1, ...). The delta segments of an index are listed in a manifest (dictionary.txt.segments),
+which is replaced atomically once a new segment is completely written, so a searcher never sees half a segment.
+
+The searcher ORs the posting lists of a term over all segments. `index.py --compact` folds the delta segments back
+into the main dictionary and postings files. The lexicon is append-only: terms keep their term id, and terms that
+only occur in delta segments get new ids after the existing ones.
+"""
+import collections
+import itertools
+import os
+
+import lexicon
+import positions
+import postings
+import weights
+
+SEGMENTS_SUFFIX = '.segments'
+ALL_DOCUMENTS = 'all_documents_combined'
+
+
+class IncompleteSegment(Exception):
+    """
+    The dictionary, term frequencies or positions file does not belong to the postings file next to it (yet): they
+    are being replaced.
+    """
+
+
+def manifest_path(dict_file):
+    return dict_file + SEGMENTS_SUFFIX
+
+
+def delta_paths(dict_file, postings_file, delta_number):
+    return f'{dict_file}.delta{delta_number}', f'{postings_file}.delta{delta_number}'
+
+
+def delta_files(dict_file, postings_file, delta_number):
+    """
+    All files of a delta segment: its dictionary, its postings, its term frequencies and (if it has one) its
+    positions file.
+    """
+    delta_dict_file, delta_postings_file = delta_paths(dict_file, postings_file, delta_number)
+    return [delta_dict_file, delta_postings_file, weights.weights_path(delta_postings_file),
+            positions.positions_path(delta_postings_file)]
+
+
+def read_manifest(dict_file):
+    """
+    Numbers of the delta segments of the index, oldest first.
+    """
+    try:
+        with open(manifest_path(dict_file), 'r') as manifest:
+            return [int(line) for line in manifest if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def write_manifest(dict_file, delta_numbers):
+    path = manifest_path(dict_file)
+    if not delta_numbers:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path + '.tmp', 'w') as manifest:
+        manifest.write(''.join(f'{delta_number}\n' for delta_number in delta_numbers))
+    os.replace(path + '.tmp', path)  # atomic, readers see either the old or the new list of segments
+
+
+def remove_deltas(dict_file, postings_file):
+    """
+    Drop all delta segments, e.g. after a full rebuild of the main segment.
+    """
+    delta_numbers = read_manifest(dict_file)
+    write_manifest(dict_file, [])
+    for delta_number in delta_numbers:
+        for path in delta_files(dict_file, postings_file, delta_number):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def next_delta_number(dict_file):
+    return max(read_manifest(dict_file), default=0) + 1
+
+
+def replace_segment(new_dict_file, new_postings_file, dict_file, postings_file):
+    """
+    Move a segment that was written next to the live one (its dictionary, postings, term frequencies and positions
+    files) over it. Every file is replaced, never rewritten, so whoever has the old files memory-mapped keeps
+    reading them. The postings file goes first and the dictionary last: a searcher that opens the segment in
+    between sees a dictionary that does not match the postings file and keeps using the files it has open (see
+    IncompleteSegment). A side file the new segment lacks is removed, it would not match the new postings.
+    """
+    os.replace(new_postings_file, postings_file)
+    for side_path in (weights.weights_path, positions.positions_path):
+        if os.path.exists(side_path(new_postings_file)):
+            os.replace(side_path(new_postings_file), side_path(postings_file))
+        elif os.path.exists(side_path(postings_file)):
+            os.remove(side_path(postings_file))
+    os.replace(new_dict_file, dict_file)
+
+
+class Segment:
+    """
+    The dictionary and postings file of one segment, all memory-mapped, and its term frequencies and positions
+    files if it has them (an index built before they existed has neither).
+    """
+    def __init__(self, dict_file, postings_file):
+        self.dictionary = lexicon.Lexicon(dict_file)
+        self.postings_reader = postings.PostingsReader(postings_file)
+        positions_file = positions.positions_path(postings_file)
+        self.positions_reader = positions.PositionsReader(positions_file) if os.path.exists(positions_file) else None
+        weights_file = weights.weights_path(postings_file)
+        self.weights_reader = weights.WeightsReader(weights_file) if os.path.exists(weights_file) else None
+        postings_size = os.fstat(self.postings_reader.file.fileno()).st_size
+        for reader, path in [(self.dictionary, dict_file), (self.weights_reader, weights_file),
+                             (self.positions_reader, positions_file)]:
+            if reader is not None and reader.postings_size and reader.postings_size != postings_size:
+                self.close()
+                raise IncompleteSegment(f'{path} expects a postings file of {reader.postings_size} bytes, '
+                                        f'{postings_file} has {postings_size}')
+
+    def documents(self):
+        """
+        Doc ids of the documents of the segment, ascending.
+        """
+        term_id = self.dictionary.term_id(ALL_DOCUMENTS)
+        return self.posting_list(term_id).doc_ids.tolist() if term_id is not None else []
+
+    def posting_list(self, term_id):
+        _, offset, length = self.dictionary[term_id]
+        return self.postings_reader.read(offset, length)
+
+    def close(self):
+        if self.positions_reader is not None:
+            self.positions_reader.close()
+        if self.weights_reader is not None:
+            self.weights_reader.close()
+        self.postings_reader.close()
+        self.dictionary.close()
+
+
+def open_segments(dict_file, postings_file):
+    """
+    The main segment followed by the delta segments of the index. A delta segment whose documents the main segment
+    already has is left out: the main segment was just compacted (or rebuilt) and the manifest still lists the
+    delta. Searching both would count those documents twice in the document frequencies and the BM25 scores.
+    """
+    segments = [Segment(dict_file, postings_file)]
+    try:
+        main_documents = None
+        for delta_number in read_manifest(dict_file):
+            segment = Segment(*delta_paths(dict_file, postings_file, delta_number))
+            if main_documents is None:
+                main_documents = set(segments[0].documents())
+            if main_documents.issuperset(segment.documents()):
+                segment.close()
+            else:
+                segments.append(segment)
+    except BaseException:
+        for segment in segments:
+            segment.close()
+        raise
+    return segments
+
+
+def indexed_documents(dict_file, postings_file):
+    """
+    Doc ids of all the documents in the index, over all segments.
+    """
+    doc_ids = set()
+    for segment in open_segments(dict_file, postings_file):
+        doc_ids.update(segment.documents())
+        segment.close()
+    return doc_ids
+
+
+def stored_codec(segment):
+    """
+    The codec the lists of a segment were written with (dense lists are Roaring containers with any codec).
+    """
+    for term_id in segment.dictionary:
+        _, offset, _ = segment.dictionary[term_id]
+        encoding = postings.HEADER.unpack_from(segment.postings_reader.buffer, offset)[0]
+        if encoding != postings.ENCODING_ROARING:
+            return postings.CODEC_NAMES[encoding]
+    return 'array'
+
+
+def compact(dict_file, postings_file):
+    """
+    Fold all delta segments into the main segment. The new main files are written next to the old ones and then
+    moved over them (see replace_segment). Until the manifest is rewritten, open_segments leaves out the delta
+    segments whose documents are now in the main segment.
+    """
+    delta_numbers = read_manifest(dict_file)
+    if not delta_numbers:
+        print('Nothing to compact: the index has no delta segments')
+        return
+
+    segments = open_segments(dict_file, postings_file)
+    codec = stored_codec(segments[0])
+    positional = all(segment.positions_reader is not None for segment in segments)
+    weighted = all(segment.weights_reader is not None for segment in segments)
+
+    # the main segment keeps its term ids, the terms that are new in the delta segments are appended
+    term_to_term_id = dict(segments[0].dictionary.terms())
+    next_term_id = max(term_to_term_id.values(), default=0) + 1
+    sources = collections.defaultdict(list)  # term id -> [(segment, term id in that segment)]
+    for segment in segments:
+        for term, segment_term_id in segment.dictionary.terms():
+            if term not in term_to_term_id:
+                term_to_term_id[term] = next_term_id
+                next_term_id += 1
+            if segment_term_id in segment.dictionary:
+                sources[term_to_term_id[term]].append((segment, segment_term_id))
+
+    all_documents_term_id = term_to_term_id.get(ALL_DOCUMENTS)
+    merged_dictionary = {}
+    compacted_dict_file, compacted_postings_file = dict_file + '.compact', postings_file + '.compact'
+    compacted_positions_file = positions.positions_path(compacted_postings_file)
+    compacted_weights_file = weights.weights_path(compacted_postings_file)
+    positions_writer = positions.PositionsWriter(compacted_positions_file) if positional else None
+    weights_writer = weights.WeightsWriter(compacted_weights_file) if weighted else None
+    document_lengths = {}
+    if weighted:
+        for segment in segments:
+            document_lengths.update(segment.weights_reader.document_lengths())
+    with open(compacted_postings_file, 'wb') as write_postings:
+        for term_id in sorted(sources):
+            if term_id == all_documents_term_id or not (weighted or positional):
+                lists = [segment.posting_list(segment_term_id).doc_ids.tolist() for segment, segment_term_id in sources[term_id]]
+                doc_ids = lists[0] if len(lists) == 1 else sorted(set(itertools.chain.from_iterable(lists)))
+            else:
+                # A document is in one segment only, so the doc ids of all segments (with their term frequencies and
+                # positions) are simply put in doc id order.
+                rows = []
+                for segment, segment_term_id in sources[term_id]:
+                    columns = [segment.posting_list(segment_term_id).doc_ids.tolist()]
+                    if weighted:
+                        columns.append(segment.weights_reader.frequencies(segment_term_id).tolist())
+                    if positional:
+                        columns.append(segment.positions_reader.entries(segment_term_id))
+                    rows.extend(zip(*columns))
+                columns = list(zip(*sorted(rows)))
+                doc_ids = columns.pop(0)
+                if weighted:
+                    weights_writer.add(term_id, columns.pop(0), [document_lengths[doc_id] for doc_id in doc_ids])
+                if positional:
+                    positions_writer.add(term_id, columns.pop(0))
+            encoded_postings = postings.encode_postings(doc_ids, codec)
+            doc_frequency = len(doc_ids) if term_id != all_documents_term_id else 0
+            merged_dictionary[term_id] = (doc_frequency, write_postings.tell(), len(encoded_postings))
+            write_postings.write(encoded_postings)
+        postings_size = write_postings.tell()
+    if positional:
+        positions_writer.close(postings_size)
+    if weighted:
+        doc_ids = sorted(document_lengths)
+        weights_writer.close(doc_ids, [document_lengths[doc_id] for doc_id in doc_ids], postings_size)
+    lexicon.write_lexicon(compacted_dict_file, term_to_term_id, merged_dictionary, postings_size)
+
+    for segment in segments:
+        segment.close()
+    # some delta segment may lack the positions or term frequencies, then the compacted index has none either
+    replace_segment(compacted_dict_file, compacted_postings_file, dict_file, postings_file)
+    # (a delta segment that was added while we were compacting stays in the manifest)
+    write_manifest(dict_file, [delta_number for delta_number in read_manifest(dict_file) if delta_number not in delta_numbers])
+    for delta_number in delta_numbers:
+        for path in delta_files(dict_file, postings_file, delta_number):
+            if os.path.exists(path):
+                os.remove(path)
+    print(f'Compacted {len(delta_numbers)} delta segments into {dict_file} and {postings_file} '
+          f'({len(merged_dictionary)} terms, codec {codec})')
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""
+Long-running query server, started with `search.py --serve`. The index is opened once per worker process and
+kept hot; clients send one Boolean query per line and get back one line with the matching doc ids (the same
+line run_search writes to the results file), or a line starting with "ERROR" if the query failed.
+"""
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+
+from postings_cache import POSTINGS_CACHE_BYTES
+from search import SearchEngine
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 3245
+
+engine = None  # the SearchEngine of a worker process
+
+
+def start_worker(dict_file, postings_file, postings_cache_bytes, pinned_terms):
+    global engine
+    engine = SearchEngine(dict_file, postings_file, postings_cache_bytes=postings_cache_bytes, pinned_terms=pinned_terms)
+    # open everything now rather than on the first query, and load the most common posting lists
+    engine.open()
+    engine.prewarm()
+
+
+def answer_query(query):
+    return str(engine.search(query))
+
+
+class WorkerPool:
+    """
+    The worker processes. A pool whose worker died (e.g. killed by the OS) is broken for good, so it is replaced by
+    a new one, which opens the index again, and the query is retried there once.
+    """
+    def __init__(self, workers, initargs):
+        self.workers = workers
+        self.initargs = initargs
+        self.executor = self.start()
+
+    def start(self):
+        # Workers are forked from a fork server that is started with the first pool, before the server listens, so
+        # a worker started later does not inherit the listening socket or the open connections (which would keep
+        # the port bound, and a closed connection open, for as long as the worker lives).
+        forkserver = 'forkserver' in multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver') if forkserver else None
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context, initializer=start_worker,
+                                                      initargs=self.initargs)
+
+    async def run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, function, *args)
+            except concurrent.futures.process.BrokenProcessPool:
+                if attempt == 1:
+                    raise
+                if executor is self.executor:  # the first query that notices restarts the pool, the others reuse it
+                    print('a worker process died, restarting the workers')
+                    executor.shutdown(wait=False)
+                    self.executor = self.start()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+async def handle_client(reader, writer, pool):
+    """
+    Answers the queries of one connection in order. Queries of different connections are evaluated
+    concurrently, at most one per worker process.
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            query = line.decode('utf-8').strip()
+            try:
+                answer = await pool.run(answer_query, query)
+            except Exception as e:
+                answer = f'ERROR {type(e).__name__}: {e}'
+            writer.write(answer.encode('utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        pass  # the client went away, nothing left to answer
+    finally:
+        writer.close()
+
+
+async def run_server(dict_file, postings_file, host, port, unix_socket, workers, postings_cache_bytes, pinned_terms):
+    pool = WorkerPool(workers, (dict_file, postings_file, postings_cache_bytes, pinned_terms))
+    try:
+        # make sure every worker has loaded the index before we accept the first connection
+        await asyncio.gather(*(pool.run(str, None) for _ in range(workers)))
+
+        def on_connection(reader, writer):
+            return handle_client(reader, writer, pool)
+
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(on_connection, path=unix_socket)
+            print(f'serving queries on {unix_socket} with {workers} workers')
+        else:
+            server = await asyncio.start_server(on_connection, host, port)
+            print(f'serving queries on {host}:{port} with {workers} workers')
+
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.shutdown()
+
+
+def serve(dict_file, postings_file, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, workers=None,
+          postings_cache_bytes=POSTINGS_CACHE_BYTES, pinned_terms=()):
+    workers = workers or os.cpu_count() or 1
+    try:
+        asyncio.run(run_server(dict_file, postings_file, host, port, unix_socket, workers, postings_cache_bytes,
+                               list(pinned_terms)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
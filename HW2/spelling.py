@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+"""
+"Did you mean" suggestions for query terms that are not in the dictionary, with symmetric delete (as in SymSpell):
+index.py stores every string that is left of a term after deleting up to MAX_EDIT_DISTANCE of its characters,
+together with the terms it comes from. Two strings are at most d edits apart (insertions, deletions,
+substitutions and transpositions) only if deleting at most d characters from each of them gives the same string,
+so the candidates for a misspelled term are found with a few dict lookups of its own deletes instead of comparing
+it with the whole vocabulary. Only the candidates are then checked with the real edit distance.
+
+The suggestions are the terms at the smallest edit distance, the ones with the highest document frequency first.
+Only alphabetic terms are indexed: numbers and codes have no meaningful spelling.
+
+The index lives next to the dictionary (dictionary.txt.spelling) and covers the terms of all segments:
+    [header][terms and deletes, one per line][offsets of the lists of every delete][term numbers]
+Every delete has two lists: the terms it is a delete of at most one character of, and those it is a delete of
+more characters of. A term one edit away only needs the first ones, which are much shorter.
+"""
+import array
+import mmap
+import os
+import struct
+
+MAGIC = b'SPL1'
+SPELLING_SUFFIX = '.spelling'
+HEADER = struct.Struct('=4sIIIQ')  # magic, max edit distance, number of terms, number of deletes, bytes of text
+MAX_EDIT_DISTANCE = 2
+MAX_SUGGESTIONS = 5
+TERM_NUMBER_TYPECODE = 'I'
+assert array.array(TERM_NUMBER_TYPECODE).itemsize == 4
+
+
+def spelling_path(dict_file):
+    return dict_file + SPELLING_SUFFIX
+
+
+def is_word(term):
+    return term.isalpha()
+
+
+def deletes(term, distance):
+    """
+    The strings left of the term after deleting exactly `distance` characters.
+    """
+    strings = {term}
+    for _ in range(distance):
+        strings = {string[:i] + string[i + 1:] for string in strings for i in range(len(string))}
+    return strings
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus transpositions of neighbours), or max_distance + 1 once it
+    is certain to be larger than max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # a common prefix and suffix cost nothing, only what is left between them needs the table (for a typo in a
+    # long word that is a couple of characters)
+    prefix_length = len(os.path.commonprefix([a, b]))
+    a, b = a[prefix_length:], b[prefix_length:]
+    suffix_length = len(os.path.commonprefix([a[::-1], b[::-1]]))
+    a, b = a[:len(a) - suffix_length], b[:len(b) - suffix_length]
+    if not a or not b:
+        return min(len(a) + len(b), max_distance + 1)
+    previous_row, row = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        previous_row, row, last_row = row, [i] + [0] * len(b), previous_row
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], last_row[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return row[-1]
+
+
+def write_spelling_index(spelling_file, terms, max_edit_distance=MAX_EDIT_DISTANCE):
+    """
+    Index the deletes of the (alphabetic) terms. The file is written next to the old one and moved over it, so a
+    searcher never reads half of it.
+    """
+    terms = sorted(term for term in set(terms) if is_word(term))
+    near_lists, far_lists = {}, {}  # delete -> numbers of the terms it is a delete of (at most 1 / more), ascending
+    for term_number, term in enumerate(terms):
+        seen = set()
+        for distance in range(max_edit_distance + 1):
+            for string in deletes(term, distance) - seen:
+                (near_lists if distance <= 1 else far_lists).setdefault(string, []).append(term_number)
+                seen.add(string)
+    strings = sorted(near_lists.keys() | far_lists.keys())
+
+    text = '\n'.join(terms + strings).encode('utf-8')
+    offsets = array.array(TERM_NUMBER_TYPECODE, [0])
+    term_numbers = array.array(TERM_NUMBER_TYPECODE)
+    for string in strings:
+        for term_lists in (near_lists, far_lists):
+            term_numbers.extend(term_lists.get(string, ()))
+            offsets.append(len(term_numbers))
+
+    with open(spelling_file + '.tmp', 'wb') as write_spelling:
+        write_spelling.write(HEADER.pack(MAGIC, max_edit_distance, len(terms), len(strings), len(text)))
+        write_spelling.write(text + b'\0' * (-len(text) % 4))
+        write_spelling.write(offsets.tobytes())
+        write_spelling.write(term_numbers.tobytes())
+    os.replace(spelling_file + '.tmp', spelling_file)
+
+
+def read_terms(spelling_file):
+    """
+    The terms of an existing spelling index (empty if there is none), so an incremental build can extend it.
+    """
+    if not os.path.exists(spelling_file):
+        return []
+    spelling_index = SpellingIndex(spelling_file)
+    terms = list(spelling_index.terms)
+    spelling_index.close()
+    return terms
+
+
+class SpellingIndex:
+    """
+    Memory-maps a spelling index written by write_spelling_index. The terms and deletes are decoded once, the
+    lists of term numbers stay in the file.
+    """
+    def __init__(self, spelling_file):
+        self.file = open(spelling_file, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_edit_distance, number_of_terms, number_of_deletes, text_bytes = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{spelling_file} is not a spelling index written by index.py')
+        view = memoryview(self.mmap)
+        text_end = HEADER.size + text_bytes + (-text_bytes % 4)
+        lines = bytes(view[HEADER.size:HEADER.size + text_bytes]).decode('utf-8').split('\n') if text_bytes else []
+        self.terms = lines[:number_of_terms]
+        self.delete_numbers = {string: i for i, string in enumerate(lines[number_of_terms:])}
+        offsets_end = text_end + (2 * number_of_deletes + 1) * 4
+        self.offsets = view[text_end:offsets_end].cast(TERM_NUMBER_TYPECODE)
+        self.term_numbers = view[offsets_end:].cast(TERM_NUMBER_TYPECODE)
+
+    def candidates(self, term, distance, near_only):
+        """
+        The indexed terms that share a delete of exactly `distance` characters of the term; with near_only, only a
+        delete of at most one character of theirs.
+        """
+        term_numbers = set()
+        for string in deletes(term, distance):
+            delete_number = self.delete_numbers.get(string)
+            if delete_number is not None:
+                start = self.offsets[2 * delete_number]
+                end = self.offsets[2 * delete_number + (1 if near_only else 2)]
+                term_numbers.update(self.term_numbers[start:end])
+        return term_numbers
+
+    def lookup(self, term):
+        """
+        The indexed terms closest to the term and their edit distance, or [] if none is within the maximum
+        distance. The deletes are tried one more character at a time, and a term that is one edit away (most
+        typos) is found without generating the many deletes of two characters.
+        """
+        for max_distance in range(1, self.max_edit_distance + 1):
+            # every term within max_distance shares a delete of at most max_distance characters with the term
+            candidates = set()
+            for distance in range(max_distance + 1):
+                candidates.update(self.candidates(term, distance, near_only=max_distance == 1))
+            found = [(self.terms[term_number], distance) for term_number in candidates
+                     for distance in [edit_distance(term, self.terms[term_number], max_distance)]
+                     if distance <= max_distance]
+            if found:
+                closest = min(distance for _, distance in found)
+                return [(candidate, distance) for candidate, distance in found if distance == closest]
+        return []
+
+    def close(self):
+        for view in (self.offsets, self.term_numbers):
+            view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+        self.file.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+import collections
+import os
+import pickle
+import time
+
+STEM_CACHE_SIZE = 65536  # number of raw tokens we remember the normalized form of
+STEM_CACHE_FILE = 'stem_cache.txt'  # written next to the dictionary file
+
+
+def cache_path(dict_file):
+    return os.path.join(os.path.dirname(os.path.abspath(dict_file)), STEM_CACHE_FILE)
+
+
+class StemCache:
+    """
+    Memoizes normalize_token (case folding + porter-stemming), keyed on the raw token. Text is Zipfian, so a
+    small number of surface forms make up most token occurrences. The least recently used entry is evicted
+    once the cache is full.
+    """
+    def __init__(self, max_size=STEM_CACHE_SIZE):
+        self.max_size = max_size
+        self.stemmer = None  # importing NLTK is slow, so it only happens on the first miss
+        self.entries = collections.OrderedDict()  # raw token -> normalized token, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.stem_seconds = 0.0  # time spent actually stemming (i.e. on misses)
+        self.track_new_entries = False  # only needed when the cache lives in a worker process, see take_delta()
+        self.new_entries = {}  # entries added since the last take_delta()
+
+    def normalize(self, token):
+        entries = self.entries
+        normalized = entries.get(token)
+        if normalized is not None:
+            self.hits += 1
+            entries.move_to_end(token)
+            return normalized
+
+        self.misses += 1
+        if self.stemmer is None:
+            from nltk.stem.porter import PorterStemmer
+            self.stemmer = PorterStemmer()
+        start = time.perf_counter()
+        normalized = self.stemmer.stem(token.lower())  # case folding, then porter-stemming
+        self.stem_seconds += time.perf_counter() - start
+
+        entries[token] = normalized
+        if self.track_new_entries:
+            self.new_entries[token] = normalized
+        if len(entries) > self.max_size:
+            entries.popitem(last=False)
+        return normalized
+
+    def saved_seconds(self):
+        """
+        Estimated stemming time saved by the cache: every hit would have cost an average miss.
+        """
+        if self.misses == 0:
+            return 0.0
+        return self.hits * self.stem_seconds / self.misses
+
+    def take_delta(self):
+        """
+        Counters and new entries since the previous call. Used to ship the work of a cache living in another
+        process (e.g. a tokenizer worker) back to the main cache with absorb().
+        """
+        delta = (self.new_entries, self.hits, self.misses, self.stem_seconds)
+        self.new_entries = {}
+        self.hits = self.misses = 0
+        self.stem_seconds = 0.0
+        return delta
+
+    def absorb(self, delta):
+        new_entries, hits, misses, stem_seconds = delta
+        for token, normalized in new_entries.items():
+            self.entries[token] = normalized
+            self.entries.move_to_end(token)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self.hits += hits
+        self.misses += misses
+        self.stem_seconds += stem_seconds
+
+    def save(self, path):
+        # written next to the old file and moved over it, a searcher loading the cache never reads half of it
+        with open(path + '.tmp', 'wb') as write_cache:
+            pickle.dump(list(self.entries.items()), write_cache)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path):
+        """
+        Warm the cache with the entries saved by save(). A missing file just leaves the cache cold.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as read_cache:
+            for token, normalized in pickle.load(read_cache):
+                self.entries[token] = normalized
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __repr__(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f'{len(self.entries)} entries, {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate)'
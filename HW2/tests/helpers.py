@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+"""
+Shared by the tests: puts HW2 on the path (like the benchmarks do) and builds small indexes from documents given
+as strings. NLTK needs its punkt and stopwords data, as for index.py itself.
+"""
+import contextlib
+import io
+import os
+import sys
+
+HW2 = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HW2)
+
+import nltk  # noqa: E402
+
+nltk.data.path.append(os.path.join(HW2, 'nltk_data'))
+
+# a few Reuters-like documents, keyed by doc id
+DOCUMENTS = {
+    1: 'The bank raised its interest rate. Oil prices fell.',
+    2: 'Oil and gas exports rose as the price of crude oil climbed.',
+    3: 'The central bank left rates unchanged, traders said.',
+    4: 'Wheat exports to Egypt were up, the trade ministry said.',
+    5: 'Gold prices rose on the news. The interest in gold grew.',
+}
+
+
+def write_documents(directory, documents):
+    os.makedirs(directory, exist_ok=True)
+    for doc_id, text in documents.items():
+        with open(os.path.join(directory, str(doc_id)), 'w') as write_document:
+            write_document.write(text)
+
+
+def build_index(directory, documents=DOCUMENTS, **options):
+    """
+    Index the documents into directory/dictionary.txt and directory/postings.txt (with the options of
+    index.build_index), quietly. Returns the two paths.
+    """
+    import index
+
+    documents_directory = os.path.join(directory, 'documents')
+    write_documents(documents_directory, documents)
+    dict_file, postings_file = os.path.join(directory, 'dictionary.txt'), os.path.join(directory, 'postings.txt')
+    with contextlib.redirect_stdout(io.StringIO()):
+        index.build_index(documents_directory, dict_file, postings_file, **options)
+    return dict_file, postings_file
+
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+"""
+Round trips of the vbyte and PForDelta codecs of compression.py.
+"""
+import random
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import compression
+from compression import PFOR_BLOCK, PFOR_BLOCK_SIZE
+
+LARGEST_DOC_ID = 2 ** 32 - 1
+
+
+def lists():
+    """
+    Sorted doc id lists that hit the edge cases of both codecs.
+    """
+    rng = random.Random(3)
+    yield []
+    yield [0]  # a gap of 0, which packs into a bit width of 0
+    yield [1]
+    yield [LARGEST_DOC_ID]
+    yield [0, LARGEST_DOC_ID]
+    # gaps right at the vbyte byte boundaries
+    yield list(compression.doc_ids_of([127, 128, 2 ** 14 - 1, 2 ** 14, 2 ** 21, 2 ** 28, 1]))
+    # around the PForDelta block size
+    for length in [PFOR_BLOCK_SIZE - 1, PFOR_BLOCK_SIZE, PFOR_BLOCK_SIZE + 1, 2 * PFOR_BLOCK_SIZE, 1000]:
+        yield sorted(rng.sample(range(1, 50 * length), length))
+    yield list(range(1, 3 * PFOR_BLOCK_SIZE))  # every gap is 1
+    # mostly small gaps with a few huge ones: the exceptions of PForDelta
+    gaps = [rng.randrange(1, 8) for _ in range(3 * PFOR_BLOCK_SIZE)]
+    for i in range(0, len(gaps), 37):
+        gaps[i] = rng.randrange(1 << 20, 1 << 24)
+    yield compression.doc_ids_of(gaps)
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trips(self):
+        for codec, (encode, decode) in compression.CODECS.items():
+            for doc_ids in lists():
+                with self.subTest(codec=codec, length=len(doc_ids), first=doc_ids[:3]):
+                    encoded = encode(doc_ids)
+                    self.assertEqual(decode(encoded, len(doc_ids)), (doc_ids, len(encoded)))
+                    # the decoders stop after the postings they were asked for, whatever follows them
+                    self.assertEqual(decode(encoded + b'\x81\x81\0\0', len(doc_ids)), (doc_ids, len(encoded)))
+
+    def test_empty_lists_take_no_bytes(self):
+        for codec, (encode, decode) in compression.CODECS.items():
+            self.assertEqual(encode([]), b'')
+            self.assertEqual(decode(b'', 0), ([], 0))
+
+    def test_one_byte_gaps(self):
+        self.assertEqual(compression.vbyte_encode([1, 2, 129]), bytes([129, 129, 255]))
+        self.assertEqual(compression.vbyte_encode([128]), bytes([1, 128]))
+
+    def test_pfor_exceptions(self):
+        gaps = [1] * PFOR_BLOCK_SIZE
+        gaps[5] = gaps[77] = 1 << 30
+        encoded = compression.pfor_encode(compression.doc_ids_of(gaps))
+        bit_width, number_of_exceptions, number_of_gaps = PFOR_BLOCK.unpack_from(encoded)
+        self.assertEqual((bit_width, number_of_exceptions, number_of_gaps), (1, 2, PFOR_BLOCK_SIZE))
+        self.assertEqual(compression.gaps_of(compression.pfor_decode(encoded, PFOR_BLOCK_SIZE)[0]), gaps)
+
+    def test_pfor_bit_width(self):
+        self.assertEqual(compression.pfor_bit_width([0]), 0)
+        self.assertEqual(compression.pfor_bit_width([1] * 9 + [1000]), 1)  # 90% of the gaps fit into one bit
+        self.assertEqual(compression.pfor_bit_width([1] * 8 + [1000] * 2), 10)
+
+    def test_truncated_data(self):
+        doc_ids = list(range(1, 3 * PFOR_BLOCK_SIZE))
+        for codec, (encode, decode) in compression.CODECS.items():
+            encoded = encode(doc_ids)
+            for length in [0, 3, len(encoded) // 2, len(encoded) - 1]:
+                with self.subTest(codec=codec, length=length):
+                    with self.assertRaisesRegex(ValueError, 'data ends'):
+                        decode(encoded[:length], len(doc_ids))
+        with self.assertRaisesRegex(ValueError, 'ends after 2 of 3 postings'):
+            compression.vbyte_decode(compression.vbyte_encode([1, 2]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""
+Round trips of the front coded dictionary file (LEX2) written by lexicon.write_lexicon.
+"""
+import os
+import tempfile
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import lexicon
+
+
+class LexiconTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dict_file = os.path.join(self.directory.name, 'dictionary.txt')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_and_open(self, term_to_term_id, dictionary, postings_size=0):
+        lexicon.write_lexicon(self.dict_file, term_to_term_id, dictionary, postings_size)
+        opened = lexicon.Lexicon(self.dict_file)
+        self.addCleanup(opened.close)
+        return opened
+
+    def test_terms_and_entries_round_trip(self):
+        # shared prefixes, a term that is the prefix of the next one, and non-ascii terms; the sort order is the
+        # order of the utf-8 bytes
+        terms = ['bank', 'banker', 'banks', 'rate', 'rates', 'zürich', 'zurich', 'ölpreis', 'a', 'b']
+        term_to_term_id = {term: term_id for term_id, term in enumerate(terms, 1)}
+        dictionary = {term_id: (term_id * 10, term_id * 100, 12 + term_id) for term_id in term_to_term_id.values()}
+        opened = self.write_and_open(term_to_term_id, dictionary, postings_size=4321)
+
+        self.assertEqual(list(opened.terms()), sorted(term_to_term_id.items(), key=lambda item: item[0].encode()))
+        for term, term_id in term_to_term_id.items():
+            self.assertEqual(opened.term_id(term), term_id)
+            self.assertEqual(opened[term_id], dictionary[term_id])
+        self.assertEqual(opened.postings_size, 4321)
+        self.assertEqual(sorted(opened), sorted(dictionary))
+
+    def test_missing_terms(self):
+        opened = self.write_and_open({'bank': 1, 'rate': 2}, {1: (1, 0, 16), 2: (1, 16, 16)})
+        for term in ['', 'aaa', 'ban', 'bankz', 'oil', 'ratez', 'zzz']:
+            with self.subTest(term=term):
+                self.assertIsNone(opened.term_id(term))
+
+    def test_block_boundaries(self):
+        for number_of_terms in [1, lexicon.TERMS_PER_BLOCK - 1, lexicon.TERMS_PER_BLOCK, lexicon.TERMS_PER_BLOCK + 1,
+                                3 * lexicon.TERMS_PER_BLOCK]:
+            with self.subTest(number_of_terms=number_of_terms):
+                term_to_term_id = {f'term{i:03}': i for i in range(1, number_of_terms + 1)}
+                opened = self.write_and_open(term_to_term_id, {i: (1, 0, 12) for i in term_to_term_id.values()})
+                self.assertEqual(len(opened.block_index), -(-number_of_terms // lexicon.TERMS_PER_BLOCK))
+                self.assertEqual(dict(opened.terms()), term_to_term_id)
+                for term, term_id in term_to_term_id.items():
+                    self.assertEqual(opened.term_id(term), term_id)
+
+    def test_empty_lexicon(self):
+        opened = self.write_and_open({}, {})
+        self.assertIsNone(opened.term_id('bank'))
+        self.assertEqual(list(opened.terms()), [])
+        self.assertEqual(len(opened), 0)
+        self.assertEqual(opened.most_frequent(10), [])
+
+    def test_term_ids_without_postings(self):
+        # term id 2 has no entry (e.g. it only occurs in a delta segment), term id 3 is past the last entry
+        opened = self.write_and_open({'bank': 1, 'oil': 2, 'rate': 3}, {1: (5, 0, 32)})
+        self.assertIn(1, opened)
+        for term_id in [0, 2, 3, 1000]:
+            self.assertNotIn(term_id, opened)
+            with self.assertRaises(KeyError):
+                opened[term_id]
+        self.assertEqual(opened.term_id('oil'), 2)  # still in the lexicon
+
+    def test_most_frequent(self):
+        dictionary = {1: (3, 0, 24), 2: (9, 24, 48), 3: (1, 72, 16), 4: (9, 88, 48)}
+        opened = self.write_and_open({'a': 1, 'b': 2, 'c': 3, 'd': 4}, dictionary)
+        self.assertEqual(sorted(opened.most_frequent(2)), [2, 4])
+        self.assertEqual(len(opened.most_frequent(10)), 4)
+
+    def test_not_a_dictionary_file(self):
+        with open(self.dict_file, 'wb') as write_dict:
+            write_dict.write(b'LEX1' + bytes(lexicon.HEADER.size))
+        with self.assertRaisesRegex(ValueError, 'not a dictionary file'):
+            lexicon.Lexicon(self.dict_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+"""
+Round trips of the positions file (POS2) of positions.py, and the phrase and NEAR checks on top of it.
+"""
+import array
+import os
+import tempfile
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import positions
+
+
+class PositionsFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.positions_file = os.path.join(self.directory.name, 'postings.txt.positions')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_and_open(self, records, postings_size=0):
+        """
+        records: term id -> positions of the term in each of its documents, in doc id order
+        """
+        writer = positions.PositionsWriter(self.positions_file)
+        for term_id, documents in records.items():
+            writer.add(term_id, [positions.encode_positions(document) for document in documents])
+        writer.close(postings_size)
+        reader = positions.PositionsReader(self.positions_file)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_entries_round_trip(self):
+        for document in [[], [0], [5], [0, 1, 2], [3, 130, 131, 20000], list(range(0, 1000, 7)), [2 ** 31]]:
+            with self.subTest(document=document[:5]):
+                self.assertEqual(positions.decode_positions(positions.encode_positions(document)), document)
+
+    def test_records_round_trip(self):
+        records = {
+            3: [[0, 4], [1], [7, 200, 201]],
+            1: [[12]],
+            7: [list(range(300))],
+            9: [],  # a term with no documents still gets a record
+        }
+        reader = self.write_and_open(records, postings_size=1234)
+        self.assertEqual(reader.postings_size, 1234)
+        for term_id, documents in records.items():
+            self.assertEqual([positions.decode_positions(entry) for entry in reader.entries(term_id)], documents)
+        # no record, and past the end of the table
+        for term_id in [2, 8, 100]:
+            self.assertEqual(reader.entries(term_id), [])
+
+    def test_empty_file(self):
+        reader = self.write_and_open({})
+        self.assertEqual(reader.entries(1), [])
+
+    def test_term_positions(self):
+        # the same term in two segments: doc ids 1 and 4 in the first one, 6 in the second
+        reader = self.write_and_open({1: [[0, 9], [3]], 2: [[2, 5]]})
+        term_positions = positions.TermPositions([(array.array('I', [1, 4]), reader, 1),
+                                                  (array.array('I', [6]), reader, 2)])
+        self.assertEqual(term_positions.of(1), [0, 9])
+        self.assertEqual(term_positions.of(4), [3])
+        self.assertEqual(term_positions.of(6), [2, 5])
+        self.assertEqual(term_positions.of(0), [])
+        self.assertEqual(term_positions.of(5), [])
+
+    def test_not_a_positions_file(self):
+        with open(self.positions_file, 'wb') as write_positions:
+            write_positions.write(b'POS1' + bytes(positions.FOOTER.size))
+        with self.assertRaisesRegex(ValueError, 'not a positions file'):
+            positions.PositionsReader(self.positions_file)
+
+
+class PhraseTest(unittest.TestCase):
+    class Positions:
+        def __init__(self, by_doc_id):
+            self.by_doc_id = by_doc_id
+
+        def of(self, doc_id):
+            return self.by_doc_id.get(doc_id, [])
+
+    def test_phrase_at(self):
+        interest = self.Positions({1: [3, 10], 2: [4]})
+        rate = self.Positions({1: [11], 2: [3, 7]})
+        term_positions = [(1, rate), (0, interest)]  # offsets in "interest rate", rarest first
+        self.assertTrue(positions.phrase_at(1, term_positions))
+        self.assertFalse(positions.phrase_at(2, term_positions))  # both terms, but not next to each other
+        self.assertFalse(positions.phrase_at(3, term_positions))
+
+    def test_within(self):
+        self.assertTrue(positions.within([1, 20], [22], 2))
+        self.assertTrue(positions.within([22], [1, 20], 2))  # in either order
+        self.assertFalse(positions.within([1, 20], [23], 2))
+        self.assertFalse(positions.within([], [1], 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
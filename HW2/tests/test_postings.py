@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+"""
+Round trips of posting lists through the postings file format (encode_postings and PostingsReader), and the merges
+of Roaring-style lists against plain sets.
+"""
+import array
+import os
+import random
+import tempfile
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import postings
+from postings import CHUNK_SIZE, PostingList, RoaringPostingList
+
+LIMIT = postings.ARRAY_CONTAINER_LIMIT
+
+
+def posting_list(doc_ids):
+    return PostingList(array.array(postings.DOC_ID_TYPECODE, doc_ids))
+
+
+class PostingsFileTest(unittest.TestCase):
+    """
+    Writes the encoded lists one after the other into a postings file and reads every one back.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.postings_file = os.path.join(self.directory.name, 'postings.txt')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def round_trip(self, lists, codec='array'):
+        locations = []
+        with open(self.postings_file, 'wb') as write_postings:
+            for doc_ids in lists:
+                encoded = postings.encode_postings(doc_ids, codec)
+                self.assertEqual(len(encoded) % 4, 0)  # every list starts aligned
+                locations.append((write_postings.tell(), len(encoded)))
+                write_postings.write(encoded)
+        reader = postings.PostingsReader(self.postings_file)
+        self.addCleanup(reader.close)
+        return [reader.read(offset, length) for offset, length in locations]
+
+    def test_array_lists(self):
+        lists = [[], [0], [7], [1, 2, 3], list(range(5, 500, 5)), [1, 2 ** 32 - 1]]
+        for doc_ids, read in zip(lists, self.round_trip(lists)):
+            self.assertIs(type(read), PostingList)
+            self.assertEqual(read.doc_ids.tolist(), doc_ids)
+            self.assertEqual(read.skips.tolist(), postings.skip_positions(len(doc_ids)).tolist())
+
+    def test_dense_lists_are_roaring(self):
+        rng = random.Random(1)
+        dense_chunk = sorted(rng.sample(range(CHUNK_SIZE), LIMIT + 1))  # the smallest chunk that needs a bitmap
+        lists = [
+            dense_chunk,
+            # one bitmap, plus array containers of an odd (padded) and an even number of doc ids in other chunks
+            dense_chunk + [CHUNK_SIZE + 1, CHUNK_SIZE + 5, CHUNK_SIZE + 9] + [5 * CHUNK_SIZE, 5 * CHUNK_SIZE + 1],
+            # doc ids on both sides of a chunk boundary, and a full chunk
+            list(range(CHUNK_SIZE - LIMIT - 1, CHUNK_SIZE + 2)),
+            list(range(CHUNK_SIZE, 2 * CHUNK_SIZE)),
+        ]
+        for doc_ids, read in zip(lists, self.round_trip(lists)):
+            self.assertIs(type(read), RoaringPostingList)
+            self.assertEqual(read.doc_ids.tolist(), doc_ids)
+            self.assertEqual(len(read), len(doc_ids))
+
+    def test_compressed_lists(self):
+        lists = [[], [0], [2 ** 32 - 1], list(range(3, 3000, 7)), list(range(1, 2 * LIMIT, 3))]
+        for codec in ['vbyte', 'pfor']:
+            for doc_ids, read in zip(lists, self.round_trip(lists, codec)):
+                with self.subTest(codec=codec, length=len(doc_ids)):
+                    self.assertIs(type(read), PostingList)
+                    self.assertEqual(read.doc_ids.tolist(), doc_ids)
+                    self.assertEqual(read.skips.tolist(), postings.skip_positions(len(doc_ids)).tolist())
+
+    def test_an_array_container_at_the_limit_is_not_dense(self):
+        doc_ids = list(range(LIMIT)) + [CHUNK_SIZE + doc_id for doc_id in range(LIMIT)]
+        (read,) = self.round_trip([doc_ids])
+        self.assertIs(type(read), PostingList)
+        self.assertEqual(read.doc_ids.tolist(), doc_ids)
+
+    def test_corrupt_lists(self):
+        encoded = postings.encode_postings([1, 2, 3])
+        with open(self.postings_file, 'wb') as write_postings:
+            write_postings.write(encoded + postings.HEADER.pack(99, 0, 0))
+        reader = postings.PostingsReader(self.postings_file)
+        self.addCleanup(reader.close)
+        with self.assertRaisesRegex(ValueError, 'expected 12 bytes'):
+            reader.read(0, postings.HEADER.size)  # cut off the doc ids
+        with self.assertRaisesRegex(ValueError, 'unknown encoding 99'):
+            reader.read(len(encoded), postings.HEADER.size)
+
+    def test_empty_postings_file(self):
+        open(self.postings_file, 'wb').close()
+        reader = postings.PostingsReader(self.postings_file)
+        reader.close()
+
+
+class RoaringMergeTest(unittest.TestCase):
+    """
+    Every merge, between all combinations of plain and Roaring lists, against the same set operation.
+    """
+    def lists(self):
+        rng = random.Random(2)
+        dense = set(rng.sample(range(CHUNK_SIZE), 3 * LIMIT)) | set(range(2 * CHUNK_SIZE - 10, 2 * CHUNK_SIZE + 10))
+        other_dense = set(rng.sample(range(CHUNK_SIZE // 2, 3 * CHUNK_SIZE), 5 * LIMIT))
+        sparse = set(rng.sample(range(3 * CHUNK_SIZE), 300)) | {0, CHUNK_SIZE - 1, CHUNK_SIZE}
+        return [set(), {CHUNK_SIZE}, sparse, dense, other_dense]
+
+    def as_lists(self, doc_ids):
+        doc_ids = sorted(doc_ids)
+        yield posting_list(doc_ids)
+        yield RoaringPostingList.from_doc_ids(array.array(postings.DOC_ID_TYPECODE, doc_ids))
+
+    def test_merges(self):
+        for a in self.lists():
+            for b in self.lists():
+                for list_a in self.as_lists(a):
+                    for list_b in self.as_lists(b):
+                        with self.subTest(a=len(a), b=len(b), roaring=(type(list_a), type(list_b))):
+                            self.assertEqual(list(list_a.and_merge(list_b)), sorted(a & b))
+                            self.assertEqual(list(list_a.or_merge(list_b)), sorted(a | b))
+                            self.assertEqual(list(list_a.and_not_merge(list_b)), sorted(a - b))
+
+    def test_or_merge_all(self):
+        lists = self.lists()
+        merged = postings.or_merge_all(list(self.as_lists(doc_ids))[i % 2] for i, doc_ids in enumerate(lists))
+        self.assertEqual(list(merged), sorted(set().union(*lists)))
+        self.assertEqual(list(postings.or_merge_all([])), [])
+
+    def test_sparse_results_are_plain_lists_again(self):
+        dense = RoaringPostingList.from_doc_ids(array.array(postings.DOC_ID_TYPECODE, range(2 * LIMIT)))
+        self.assertTrue(dense.is_dense())
+        result = dense.and_merge(posting_list([1, 2, 3]))
+        self.assertIsInstance(result, PostingList)
+        self.assertEqual(list(result), [1, 2, 3])
+
+    def test_bitmaps(self):
+        lows = [0, 1, 7, 8, 4095, CHUNK_SIZE - 1]
+        self.assertEqual(postings.lows_of(postings.bits_of(lows)).tolist(), lows)
+        self.assertEqual(postings.lows_of(0).tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+"""
+WAND and Block-Max WAND skip documents, but must return the same top k as scoring every document.
+"""
+import random
+import tempfile
+import unittest
+
+import helpers
+import ranking
+from search import SearchEngine
+
+WORDS = ['bank', 'rate', 'oil', 'price', 'gold', 'wheat', 'export', 'trade', 'market', 'share', 'profit', 'loss']
+
+
+def random_documents(number_of_documents, seed):
+    # Zipf-like word frequencies and document lengths, so lists and blocks differ a lot in their score bounds
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, len(WORDS) + 1)]
+    return {doc_id: ' '.join(rng.choices(WORDS, weights, k=rng.randrange(3, 80))) + '.'
+            for doc_id in range(1, number_of_documents + 1)}
+
+
+class RankingStrategiesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.engine = SearchEngine(*helpers.build_index(cls.directory.name, random_documents(400, 5)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.close()
+        cls.directory.cleanup()
+
+    def test_strategies_agree(self):
+        queries = ['bank', 'bank rate', 'gold wheat loss', 'profit loss share market', ' '.join(WORDS), 'nothing']
+        for query in queries:
+            for k in [1, 10, 50]:
+                expected = self.engine.search_ranked(query, k, 'exhaustive')
+                for strategy in ranking.RANKING_STRATEGIES:
+                    with self.subTest(query=query, k=k, strategy=strategy):
+                        ranked = self.engine.search_ranked(query, k, strategy)
+                        self.assertEqual([doc_id for doc_id, _ in ranked], [doc_id for doc_id, _ in expected])
+                        for (_, score), (_, expected_score) in zip(ranked, expected):
+                            self.assertAlmostEqual(score, expected_score)
+
+    def test_unknown_strategy(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown ranking strategy'):
+            self.engine.search_ranked('bank', 10, 'bm26')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+"""
+Parsing of Boolean queries, the handling of malformed ones and spelling suggestions, e.g.
+    python3 -m unittest discover -s tests
+"""
+import os
+import tempfile
+import unittest
+
+import helpers
+from query_plan import SharedResults
+from search import SearchEngine, run_search, shunting_yard
+
+MISMATCHED = ['(bank', 'bank)', ') AND (', 'bank AND (oil OR gas))', '((bank AND oil)', '(bank AND oil']
+
+
+def identity(token):
+    return token
+
+
+class ShuntingYardTest(unittest.TestCase):
+    def test_precedence_and_parentheses(self):
+        self.assertEqual(shunting_yard('a OR b AND c', identity), ['a', 'b', 'c', 'AND', 'OR'])
+        self.assertEqual(shunting_yard('(a OR b) AND c', identity), ['a', 'b', 'OR', 'c', 'AND'])
+        self.assertEqual(shunting_yard('NOT (a AND b)', identity), ['a', 'b', 'AND', 'NOT'])
+        self.assertEqual(shunting_yard('((a))', identity), ['a'])
+
+    def test_mismatched_parentheses_are_a_value_error(self):
+        for query in MISMATCHED:
+            with self.subTest(query=query):
+                with self.assertRaisesRegex(ValueError, 'mismatched parentheses'):
+                    shunting_yard(query, identity)
+
+    def test_unbalanced_quotes_are_a_value_error(self):
+        with self.assertRaisesRegex(ValueError, 'unbalanced quotes'):
+            shunting_yard('"interest rate', identity)
+
+
+class SearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.dict_file, cls.postings_file = helpers.build_index(cls.directory.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_search_batch_gives_malformed_queries_an_empty_result(self):
+        engine = SearchEngine(self.dict_file, self.postings_file)
+        queries = ['bank'] + MISMATCHED + ['oil AND price']
+        with self.assertLogs('search', 'WARNING') as logs:
+            results = [list(result) for result in engine.search_batch(queries)]
+        engine.close()
+        self.assertEqual(results, [[1, 3]] + [[]] * len(MISMATCHED) + [[1, 2]])
+        self.assertEqual(len(logs.records), len(MISMATCHED))
+
+    def test_run_search_writes_an_empty_line_for_a_malformed_query(self):
+        queries_file = os.path.join(self.directory.name, 'queries.txt')
+        results_file = os.path.join(self.directory.name, 'results.txt')
+        with open(queries_file, 'w') as write_queries:
+            write_queries.write('bank\n(bank AND rate\nbank)\noil\n')
+        with self.assertLogs('search', 'WARNING'):
+            helpers.quietly(run_search, self.dict_file, self.postings_file, queries_file, results_file)
+        with open(results_file, 'r') as results:
+            self.assertEqual(results.read(), '1 3\n\n\n1 2\n')
+
+    def test_suggestions_are_only_looked_up_when_they_are_read(self):
+        engine = SearchEngine(self.dict_file, self.postings_file)
+        self.assertEqual(list(engine.search('intrest AND rate')), [])
+        self.assertIsNone(engine._spelling_index)  # the plain search never opened the spelling index
+        plan = engine.plan_query('intrest AND rate')
+        self.assertIn('did you mean interest (df 2)?', '\n'.join(plan.explain(engine)))
+        self.assertIsNotNone(engine._spelling_index)
+        engine.close()
+
+    def test_results_shared_in_a_batch_are_not_result_cache_hits(self):
+        engine = SearchEngine(self.dict_file, self.postings_file)
+        queries = ['bank AND oil AND rate', 'bank AND oil AND rate AND price', 'bank AND oil AND rate']
+        plans = [engine.plan_query(query) for query in queries]
+        engine.shared_results = SharedResults(plans)
+        results = [list(engine.evaluate_plan(plan, query)) for plan, query in zip(plans, queries)]
+        engine.shared_results = None
+        self.assertEqual(results, [[1], [1], [1]])
+        self.assertIn('shared in the batch', plans[2].explain(engine)[0])
+        # one lookup per AND, and one for the prefixes of the longer ones (the second one finds the first query)
+        self.assertEqual((engine.result_cache.hits, engine.result_cache.misses), (1, 3))
+        self.assertEqual(engine.result_cache.queries_answered, 0)
+        engine.close()
+
+    def test_search_batch_releases_the_results_of_nodes_it_skipped(self):
+        engine = SearchEngine(self.dict_file, self.postings_file)
+        # "bank OR oil" is never evaluated in the first query, the AND stops at the empty list of zzz
+        queries = ['zzz AND (bank OR oil)', 'bank OR oil', 'NOT wheat AND gold', 'NOT wheat']
+        held = []
+        for result in engine.search_batch(queries):
+            held.append(sorted(engine.shared_results.results))
+        engine.close()
+        self.assertEqual(held, [[], [], ['wheat'], []])  # wheat is kept for the last query only
+
+
+if __name__ == '__main__':
+    unittest.main()
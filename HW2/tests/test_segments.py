@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Incremental indexing into delta segments, the manifest and compaction (segments.py). An index that was built
+incrementally, before and after --compact, has to answer every query like an index built in one go.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import helpers
+import segments
+from search import SearchEngine
+
+NEW_DOCUMENTS = {
+    6: 'The bank cut its interest rate again. Oil rose.',
+    7: 'Exports of crude oil fell, the ministry said.',
+    12: 'Traders said gold and oil prices rose.',
+}
+QUERIES = ['bank', 'oil AND NOT bank', 'rate OR gold', 'NOT said', '"interest rate"', 'oil NEAR/2 price', 'expor*']
+RANKED_QUERIES = ['oil prices', 'interest rate bank', 'gold']
+
+
+class SegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index_directory = os.path.join(self.directory.name, 'index')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def build_full(self, **options):
+        # the index of all documents at once, to compare with
+        directory = os.path.join(self.directory.name, 'full')
+        return helpers.build_index(directory, {**helpers.DOCUMENTS, **NEW_DOCUMENTS}, positional=True, **options)
+
+    def build_incremental(self, **options):
+        dict_file, postings_file = helpers.build_index(self.index_directory, positional=True, **options)
+        helpers.build_index(self.index_directory, NEW_DOCUMENTS, positional=True, incremental=True)
+        return dict_file, postings_file
+
+    def answers(self, dict_file, postings_file):
+        engine = SearchEngine(dict_file, postings_file)
+        answers = [list(engine.search(query)) for query in QUERIES]
+        answers += [[(doc_id, round(score, 9)) for doc_id, score in engine.search_ranked(query)]
+                    for query in RANKED_QUERIES]
+        engine.close()
+        return answers
+
+    def test_manifest(self):
+        dict_file = os.path.join(self.directory.name, 'dictionary.txt')
+        self.assertEqual(segments.read_manifest(dict_file), [])
+        self.assertEqual(segments.next_delta_number(dict_file), 1)
+        segments.write_manifest(dict_file, [1, 3])
+        self.assertEqual(segments.read_manifest(dict_file), [1, 3])
+        self.assertEqual(segments.next_delta_number(dict_file), 4)
+        segments.write_manifest(dict_file, [])
+        self.assertFalse(os.path.exists(segments.manifest_path(dict_file)))
+
+    def test_delta_segment_answers_like_a_full_index(self):
+        dict_file, postings_file = self.build_incremental()
+        self.assertEqual(segments.read_manifest(dict_file), [1])
+        for path in segments.delta_files(dict_file, postings_file, 1):
+            self.assertTrue(os.path.exists(path), path)
+        self.assertEqual(segments.indexed_documents(dict_file, postings_file), {1, 2, 3, 4, 5, 6, 7, 12})
+        self.assertEqual(self.answers(dict_file, postings_file), self.answers(*self.build_full()))
+
+    def test_compact(self):
+        dict_file, postings_file = self.build_incremental(codec='pfor')
+        helpers.quietly(segments.compact, dict_file, postings_file)
+        self.assertEqual(segments.read_manifest(dict_file), [])
+        for path in segments.delta_files(dict_file, postings_file, 1):
+            self.assertFalse(os.path.exists(path), path)
+        main = segments.Segment(dict_file, postings_file)
+        self.assertEqual(main.documents(), [1, 2, 3, 4, 5, 6, 7, 12])
+        self.assertEqual(segments.stored_codec(main), 'pfor')
+        main.close()
+        self.assertEqual(self.answers(dict_file, postings_file), self.answers(*self.build_full()))
+
+    def test_a_delta_whose_documents_are_in_the_main_segment_is_left_out(self):
+        # the state between the compacted main segment replacing the old one and the manifest being rewritten
+        dict_file, postings_file = self.build_incremental()
+        saved = os.path.join(self.directory.name, 'saved')
+        os.makedirs(saved)
+        delta_files = [path for path in segments.delta_files(dict_file, postings_file, 1) if os.path.exists(path)]
+        for path in delta_files + [segments.manifest_path(dict_file)]:
+            shutil.copy(path, saved)
+        helpers.quietly(segments.compact, dict_file, postings_file)
+        for path in delta_files + [segments.manifest_path(dict_file)]:
+            shutil.copy(os.path.join(saved, os.path.basename(path)), path)
+
+        opened = segments.open_segments(dict_file, postings_file)
+        self.assertEqual(len(opened), 1)
+        for segment in opened:
+            segment.close()
+        self.assertEqual(self.answers(dict_file, postings_file), self.answers(*self.build_full()))
+
+    def test_no_new_documents(self):
+        dict_file, postings_file = helpers.build_index(self.index_directory)
+        helpers.build_index(self.index_directory, incremental=True)
+        self.assertEqual(segments.read_manifest(dict_file), [])
+        helpers.quietly(segments.compact, dict_file, postings_file)  # nothing to compact
+
+    def test_postings_file_that_does_not_match_the_dictionary(self):
+        dict_file, postings_file = helpers.build_index(self.index_directory, positional=True)
+        with open(postings_file, 'ab') as write_postings:
+            write_postings.write(b'\0\0\0\0')  # as if a new postings file had replaced it
+        with self.assertRaisesRegex(segments.IncompleteSegment, 'expects a postings file of'):
+            segments.Segment(dict_file, postings_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+The symmetric delete index of spelling.py: its suggestions have to be the closest terms a scan of the whole
+vocabulary finds, and edit_distance has to agree with a plain optimal string alignment table.
+"""
+import os
+import random
+import tempfile
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import spelling
+
+TERMS = ['interest', 'interst', 'rate', 'rates', 'bank', 'bill', 'will', 'oil', 'mill', 'trade', 'grade', 'a', 'an',
+         'ab', 'zürich', 'cotton', 'count', 'counti', 'export', 'report']
+
+
+def osa_distance(a, b):
+    # the textbook table, without any of the shortcuts of spelling.edit_distance
+    table = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+    return table[-1][-1]
+
+
+def scan(terms, term, max_distance):
+    found = [(candidate, osa_distance(term, candidate)) for candidate in terms]
+    found = [(candidate, distance) for candidate, distance in found if distance <= max_distance]
+    closest = min((distance for _, distance in found), default=None)
+    return sorted((candidate, distance) for candidate, distance in found if distance == closest)
+
+
+def misspellings(terms, rng):
+    for term in terms:
+        for _ in range(5):
+            misspelling = term
+            for _ in range(rng.randrange(1, 4)):
+                i = rng.randrange(len(misspelling) + 1)
+                misspelling = rng.choice([
+                    misspelling[:i] + rng.choice('abcenrt') + misspelling[i:],
+                    misspelling[:i] + misspelling[i + 1:],
+                    misspelling[:i] + rng.choice('abcenrt') + misspelling[i + 1:],
+                    misspelling[:i] + misspelling[i + 1:i + 2] + misspelling[i:i + 1] + misspelling[i + 2:],
+                ])
+            if misspelling:
+                yield misspelling
+
+
+class SpellingIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spelling_file = os.path.join(self.directory.name, 'dictionary.txt.spelling')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_and_open(self, terms, max_edit_distance=spelling.MAX_EDIT_DISTANCE):
+        spelling.write_spelling_index(self.spelling_file, terms, max_edit_distance)
+        spelling_index = spelling.SpellingIndex(self.spelling_file)
+        self.addCleanup(spelling_index.close)
+        return spelling_index
+
+    def test_edit_distance(self):
+        rng = random.Random(6)
+        pairs = [('', ''), ('', 'ab'), ('ab', 'ba'), ('abc', 'ca'), ('interest', 'intrest'), ('rate', 'tare')]
+        pairs += [(''.join(rng.choices('abc', k=rng.randrange(6))), ''.join(rng.choices('abc', k=rng.randrange(6))))
+                  for _ in range(300)]
+        for a, b in pairs:
+            for max_distance in [1, 2]:
+                with self.subTest(a=a, b=b, max_distance=max_distance):
+                    # beyond max_distance it may give up early (max_distance + 1) or finish the table
+                    distance = spelling.edit_distance(a, b, max_distance)
+                    self.assertEqual(min(distance, max_distance + 1), min(osa_distance(a, b), max_distance + 1))
+
+    def test_lookup_finds_the_closest_terms(self):
+        for max_edit_distance in [1, 2]:
+            spelling_index = self.write_and_open(TERMS, max_edit_distance)
+            for misspelling in misspellings(TERMS, random.Random(7)):
+                with self.subTest(misspelling=misspelling, max_edit_distance=max_edit_distance):
+                    self.assertEqual(sorted(spelling_index.lookup(misspelling)),
+                                     scan(TERMS, misspelling, max_edit_distance))
+
+    def test_lookup(self):
+        spelling_index = self.write_and_open(TERMS)
+        self.assertEqual(spelling_index.lookup('interest'), [('interest', 0)])
+        self.assertEqual(sorted(spelling_index.lookup('intrest')), [('interest', 1), ('interst', 1)])
+        self.assertEqual(spelling_index.lookup('tarde'), [('trade', 1)])  # a transposition is one edit
+        self.assertEqual(spelling_index.lookup('xyzzy'), [])
+        self.assertEqual(sorted(spelling_index.lookup('b')), [('a', 1), ('ab', 1)])
+
+    def test_only_words_are_indexed(self):
+        self.write_and_open(TERMS + ['1987', 'u.s.', 'bank'])
+        self.assertEqual(spelling.read_terms(self.spelling_file), sorted(set(TERMS)))
+
+    def test_empty_index(self):
+        spelling_index = self.write_and_open([])
+        self.assertEqual(spelling_index.lookup('bank'), [])
+
+    def test_missing_and_foreign_files(self):
+        self.assertEqual(spelling.read_terms(self.spelling_file), [])
+        with open(self.spelling_file, 'wb') as write_spelling:
+            write_spelling.write(b'SPL0' + bytes(spelling.HEADER.size))
+        with self.assertRaisesRegex(ValueError, 'not a spelling index'):
+            spelling.SpellingIndex(self.spelling_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+"""
+Round trips of the term frequencies file (TFS3) of weights.py: the frequencies, the block summaries and the
+document lengths.
+"""
+import os
+import random
+import tempfile
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import weights
+
+
+class WeightsFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.weights_file = os.path.join(self.directory.name, 'postings.txt.tf')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_and_open(self, records, document_lengths, postings_size=0):
+        """
+        records: term id -> (doc ids, term frequency in each of those documents)
+        """
+        writer = weights.WeightsWriter(self.weights_file)
+        for term_id, (doc_ids, frequencies) in records.items():
+            writer.add(term_id, frequencies, [document_lengths[doc_id] for doc_id in doc_ids])
+        doc_ids = sorted(document_lengths)
+        writer.close(doc_ids, [document_lengths[doc_id] for doc_id in doc_ids], postings_size)
+        reader = weights.WeightsReader(self.weights_file)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_round_trip(self):
+        rng = random.Random(4)
+        document_lengths = {doc_id: rng.randrange(1, 500) for doc_id in range(1, 301)}
+        records = {}
+        # odd and even numbers of documents (the frequencies are padded to 4 bytes), one-element lists, and lists
+        # long enough to have several blocks
+        for term_id, length in enumerate([1, 2, 3, 4, 5, 16, 17, 99, 100, 300], 1):
+            doc_ids = sorted(rng.sample(sorted(document_lengths), length))
+            records[term_id] = (doc_ids, [rng.randrange(1, 20) for _ in doc_ids])
+        reader = self.write_and_open(records, document_lengths, postings_size=99)
+
+        self.assertEqual(reader.postings_size, 99)
+        self.assertEqual(reader.document_lengths(), document_lengths)
+        for term_id, (doc_ids, frequencies) in records.items():
+            with self.subTest(length=len(doc_ids)):
+                self.assertEqual(reader.frequencies(term_id).tolist(), frequencies)
+                starts = weights.block_starts(len(doc_ids))
+                blocks = list(zip(starts, starts[1:] + [len(doc_ids)]))
+                max_frequencies, min_lengths = reader.blocks(term_id)
+                self.assertEqual(max_frequencies.tolist(), [max(frequencies[start:end]) for start, end in blocks])
+                self.assertEqual(min_lengths.tolist(),
+                                 [min(document_lengths[doc_id] for doc_id in doc_ids[start:end]) for start, end in blocks])
+
+    def test_large_frequencies_are_capped(self):
+        reader = self.write_and_open({1: ([1, 2], [70000, 3])}, {1: 80000, 2: 10})
+        self.assertEqual(reader.frequencies(1).tolist(), [weights.MAX_FREQUENCY, 3])
+        self.assertEqual(reader.blocks(1)[0].tolist(), [weights.MAX_FREQUENCY])
+
+    def test_missing_and_empty_records(self):
+        reader = self.write_and_open({2: ([], []), 4: ([7], [1])}, {7: 3})
+        for term_id in [1, 2, 3, 5, 1000]:
+            with self.subTest(term_id=term_id):
+                self.assertEqual(reader.frequencies(term_id).tolist(), [])
+                self.assertEqual([blocks.tolist() for blocks in reader.blocks(term_id)], [[], []])
+        self.assertEqual(reader.frequencies(4).tolist(), [1])
+
+    def test_no_documents(self):
+        reader = self.write_and_open({}, {})
+        self.assertEqual(reader.document_lengths(), {})
+        self.assertEqual(reader.frequencies(1).tolist(), [])
+
+    def test_not_a_weights_file(self):
+        with open(self.weights_file, 'wb') as write_weights:
+            write_weights.write(b'TFS2' + bytes(weights.FOOTER.size))
+        with self.assertRaisesRegex(ValueError, 'not a term frequencies file'):
+            weights.WeightsReader(self.weights_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
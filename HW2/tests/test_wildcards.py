@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""
+The k-gram index of wildcards.py: every pattern has to match exactly the words a regular expression over the whole
+vocabulary matches.
+"""
+import fnmatch
+import os
+import tempfile
+import unittest
+
+import helpers  # noqa: F401 (puts HW2 on the path)
+import wildcards
+
+VOCABULARY = {
+    'trade': 'trade', 'traded': 'trade', 'trader': 'trader', 'traders': 'trader', 'trading': 'trade',
+    'tradition': 'tradit', 'nation': 'nation', 'station': 'station', 'cotton': 'cotton', 'cartoon': 'cartoon',
+    'a': 'a', 'an': 'an', 'at': 'at', 'u.s.': 'u.s.', 'zürich': 'zürich', 'x-ray': 'x-ray', 'aaa': 'aaa',
+}
+PATTERNS = ['trad*', '*ation', 'c*t*n', '*', 'a*', '*a', 'a*a', 'x*', 'y*', '*z*', 'trade', 'trade*', '*trade',
+            't*r*', '**', 'u.*', 'u*s*', 'z*rich', '*-*', 'T*', 'aa*aa', 'a*a*a']
+
+
+class KGramIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.kgrams_file = os.path.join(self.directory.name, 'dictionary.txt.kgrams')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_and_open(self, vocabulary):
+        wildcards.write_kgram_index(self.kgrams_file, vocabulary)
+        kgram_index = wildcards.KGramIndex(self.kgrams_file)
+        self.addCleanup(kgram_index.close)
+        return kgram_index
+
+    def test_patterns_match_like_a_scan(self):
+        kgram_index = self.write_and_open(VOCABULARY)
+        for pattern in PATTERNS:
+            with self.subTest(pattern=pattern):
+                expected = sorted(word for word in VOCABULARY if fnmatch.fnmatchcase(word, pattern.lower()))
+                self.assertEqual([kgram_index.words[word_id] for word_id in kgram_index.matching_words(pattern)],
+                                 expected)
+                self.assertEqual(kgram_index.expand(pattern), sorted({VOCABULARY[word] for word in expected}))
+
+    def test_vocabulary_round_trip(self):
+        wildcards.write_kgram_index(self.kgrams_file, {**VOCABULARY, '': 'x', 'two\nlines': 'y'})
+        self.assertEqual(wildcards.read_vocabulary(self.kgrams_file), VOCABULARY)  # minus the words it cannot store
+        self.assertFalse(os.path.exists(self.kgrams_file + '.tmp'))
+
+    def test_empty_vocabulary(self):
+        kgram_index = self.write_and_open({})
+        self.assertEqual(kgram_index.matching_words('trad*'), [])
+        self.assertEqual(kgram_index.matching_words('*'), [])
+
+    def test_missing_and_foreign_files(self):
+        self.assertEqual(wildcards.read_vocabulary(self.kgrams_file), {})
+        with open(self.kgrams_file, 'wb') as write_kgrams:
+            write_kgrams.write(b'KGR0' + bytes(wildcards.HEADER.size))
+        with self.assertRaisesRegex(ValueError, 'not a k-gram index'):
+            wildcards.KGramIndex(self.kgrams_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+"""
+Term frequencies and document lengths for ranked retrieval (see ranking.py), written by index.py next to the
+postings file (postings.txt.tf). Like the positions file, the term frequencies of a term are stored in the order
+of its doc ids in the postings file, so the Boolean posting lists stay exactly as they are.
+
+For dynamic pruning every record also has a summary of the blocks of the posting list, which are the stretches
+between its skip pointers (see postings.skip_positions): the highest term frequency and the shortest document in
+the block. BM25 grows with the term frequency and shrinks with the document length, so the score of these two
+together bounds the score of every document of the block, whatever the average document length of the index
+(which changes when segments are added).
+
+The file is laid out as:
+    [magic][records][document lengths][table][footer]
+record:            [number of documents][term frequency in every document, as unsigned shorts, padded to 4 bytes]
+                   [number of blocks][highest term frequency of every block][shortest document of every block]
+document lengths:  [doc id of every document][its length in tokens], two arrays of unsigned ints
+table:             the offset of the record of every term id (0 if the term has no record)
+footer:            offset of the table, number of table entries, offset of the document lengths, number of documents,
+                   size of the postings file the records belong to (checked like the one in the dictionary file,
+                   see segments.py)
+"""
+import array
+import mmap
+import struct
+
+import postings
+
+MAGIC = b'TFS3'
+WEIGHTS_SUFFIX = '.tf'
+COUNT = struct.Struct('=I')
+FOOTER = struct.Struct('=QIQIQ')  # native byte order, same as array.tobytes()
+FREQUENCY_TYPECODE = 'H'
+MAX_FREQUENCY = 65535  # larger term frequencies are stored as this, BM25 saturates long before
+LENGTH_TYPECODE = 'I'  # also the typecode of the block summaries
+TABLE_TYPECODE = 'Q'
+assert array.array(FREQUENCY_TYPECODE).itemsize == 2 and array.array(TABLE_TYPECODE).itemsize == 8
+
+
+def weights_path(postings_file):
+    return postings_file + WEIGHTS_SUFFIX
+
+
+def block_starts(number_of_postings):
+    """
+    Position of the first posting of every block: the skip positions, or a single block for a list too short
+    to have skips.
+    """
+    starts = postings.skip_positions(number_of_postings).tolist()
+    return starts or ([0] if number_of_postings else [])
+
+
+class WeightsWriter:
+    """
+    Writes the records of the terms in any order, and the document lengths and the table on close().
+    """
+    def __init__(self, weights_file):
+        self.file = open(weights_file, 'wb')
+        self.file.write(MAGIC)
+        self.offsets = {}  # term id -> offset of its record
+
+    def add(self, term_id, frequencies, lengths):
+        """
+        Write the term frequencies of a term, in the order of its doc ids, and the lengths of those documents.
+        """
+        self.offsets[term_id] = self.file.tell()
+        frequencies = array.array(FREQUENCY_TYPECODE, [min(frequency, MAX_FREQUENCY) for frequency in frequencies])
+        self.file.write(COUNT.pack(len(frequencies)))
+        self.file.write(frequencies.tobytes() + b'\0\0' * (len(frequencies) % 2))
+        starts = block_starts(len(frequencies))
+        blocks = list(zip(starts, starts[1:] + [len(frequencies)]))
+        self.file.write(COUNT.pack(len(blocks)))
+        self.file.write(array.array(LENGTH_TYPECODE, [max(frequencies[start:end]) for start, end in blocks]).tobytes())
+        self.file.write(array.array(LENGTH_TYPECODE, [min(lengths[start:end]) for start, end in blocks]).tobytes())
+
+    def close(self, doc_ids, lengths, postings_size):
+        lengths_offset = self.file.tell()
+        self.file.write(array.array(LENGTH_TYPECODE, doc_ids).tobytes())
+        self.file.write(array.array(LENGTH_TYPECODE, lengths).tobytes())
+        table = array.array(TABLE_TYPECODE, [0] * (max(self.offsets, default=0) + 1))
+        for term_id, offset in self.offsets.items():
+            table[term_id] = offset
+        table_offset = self.file.tell()
+        self.file.write(table.tobytes())
+        self.file.write(FOOTER.pack(table_offset, len(table), lengths_offset, len(doc_ids), postings_size))
+        self.file.close()
+
+
+class WeightsReader:
+    """
+    Memory-maps the file and hands out zero-copy views of the term frequencies of a term.
+    """
+    def __init__(self, weights_file):
+        self.file = open(weights_file, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            # e.g. written in an older format: rebuild the index
+            self.mmap.close()
+            self.file.close()
+            raise ValueError(f'{weights_file} is not a term frequencies file written by index.py')
+        self.buffer = memoryview(self.mmap)
+        table_offset, number_of_entries, self.lengths_offset, self.number_of_documents, self.postings_size = \
+            FOOTER.unpack_from(self.buffer, len(self.buffer) - FOOTER.size)
+        self.table = self.buffer[table_offset:table_offset + number_of_entries * 8].cast(TABLE_TYPECODE)
+
+    def frequencies(self, term_id):
+        """
+        Term frequency of the term in every document of its posting list, in the same order.
+        """
+        offset = self.table[term_id] if term_id < len(self.table) else 0
+        if offset == 0:
+            return array.array(FREQUENCY_TYPECODE)
+        number_of_documents, = COUNT.unpack_from(self.buffer, offset)
+        start = offset + COUNT.size
+        return self.buffer[start:start + number_of_documents * 2].cast(FREQUENCY_TYPECODE)
+
+    def blocks(self, term_id):
+        """
+        The highest term frequency and the shortest document of every block of the posting list of the term.
+        """
+        offset = self.table[term_id] if term_id < len(self.table) else 0
+        if offset == 0:
+            return array.array(LENGTH_TYPECODE), array.array(LENGTH_TYPECODE)
+        number_of_documents, = COUNT.unpack_from(self.buffer, offset)
+        offset += COUNT.size + (number_of_documents + number_of_documents % 2) * 2
+        number_of_blocks, = COUNT.unpack_from(self.buffer, offset)
+        offset += COUNT.size
+        max_frequencies = self.buffer[offset:offset + number_of_blocks * 4].cast(LENGTH_TYPECODE)
+        offset += number_of_blocks * 4
+        return max_frequencies, self.buffer[offset:offset + number_of_blocks * 4].cast(LENGTH_TYPECODE)
+
+    def document_lengths(self):
+        """
+        doc id -> length of the document in tokens, for every document of the segment.
+        """
+        doc_ids_end = self.lengths_offset + self.number_of_documents * 4
+        doc_ids = self.buffer[self.lengths_offset:doc_ids_end].cast(LENGTH_TYPECODE)
+        lengths = self.buffer[doc_ids_end:doc_ids_end + self.number_of_documents * 4].cast(LENGTH_TYPECODE)
+        return dict(zip(doc_ids.tolist(), lengths.tolist()))
+
+    def close(self):
+        self.table.release()
+        self.buffer.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+        self.file.close()
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+Wildcard queries (trad*, *ation, c*t*n). The terms of the index are stemmed, so a pattern is matched against the
+words as they occur in the documents (case folded, not stemmed) and every matching word is replaced by its term.
+
+index.py writes a k-gram index over these words next to the dictionary (dictionary.txt.kgrams): for every k-gram
+of $word$ the ids of the words that contain it, where a word id is the rank of the word in sorted order. A pattern
+is answered by intersecting the lists of the k-grams it contains, and its prefix (the part before the first *)
+narrows that down to a range of word ids found by binary search. The k-grams do not say where in the word they
+occur, so the candidates are checked against the pattern itself at the end.
+
+The file is laid out as:
+    [header][words, their terms and the k-grams, one per line][offset of every k-gram's list][word ids]
+"""
+import array
+import bisect
+import mmap
+import os
+import re
+import struct
+
+MAGIC = b'KGR1'
+KGRAMS_SUFFIX = '.kgrams'
+HEADER = struct.Struct('=4sIIQ')  # magic, number of words, number of k-grams, bytes of text
+GRAM_LENGTH = 3
+BOUNDARY = '$'  # marks the start and the end of a word, so prefixes and suffixes have k-grams of their own
+WILDCARD = '*'
+WORD_ID_TYPECODE = 'I'
+assert array.array(WORD_ID_TYPECODE).itemsize == 4
+
+
+def kgrams_path(dict_file):
+    return dict_file + KGRAMS_SUFFIX
+
+
+def is_wildcard(token):
+    return WILDCARD in token
+
+
+def kgrams(text):
+    return {text[i:i + GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1)}
+
+
+def write_kgram_index(kgrams_file, vocabulary):
+    """
+    vocabulary maps every (case folded) word of the documents to its term. The file is written next to the old one
+    and moved over it, so a searcher never reads half of it.
+    """
+    words = sorted(word for word in vocabulary if word and '\n' not in word)
+    word_lists = {}  # k-gram -> ids of the words that contain it, ascending
+    for word_id, word in enumerate(words):
+        for gram in kgrams(BOUNDARY + word + BOUNDARY):
+            word_lists.setdefault(gram, []).append(word_id)
+    grams = sorted(word_lists)
+
+    text = '\n'.join(words + [vocabulary[word] for word in words] + grams).encode('utf-8')
+    offsets = array.array(WORD_ID_TYPECODE, [0])
+    word_ids = array.array(WORD_ID_TYPECODE)
+    for gram in grams:
+        word_ids.extend(word_lists[gram])
+        offsets.append(len(word_ids))
+
+    with open(kgrams_file + '.tmp', 'wb') as write_kgrams:
+        write_kgrams.write(HEADER.pack(MAGIC, len(words), len(grams), len(text)))
+        write_kgrams.write(text + b'\0' * (-len(text) % 4))
+        write_kgrams.write(offsets.tobytes())
+        write_kgrams.write(word_ids.tobytes())
+    os.replace(kgrams_file + '.tmp', kgrams_file)
+
+
+def read_vocabulary(kgrams_file):
+    """
+    word -> term of an existing k-gram index (empty if there is none), so an incremental build can extend it.
+    """
+    if not os.path.exists(kgrams_file):
+        return {}
+    kgram_index = KGramIndex(kgrams_file)
+    vocabulary = dict(zip(kgram_index.words, kgram_index.terms))
+    kgram_index.close()
+    return vocabulary
+
+
+def pattern_regex(pattern):
+    return re.compile('.*'.join(re.escape(piece) for piece in pattern.split(WILDCARD)))
+
+
+class KGramIndex:
+    """
+    Memory-maps a k-gram index written by write_kgram_index. The words and k-grams are decoded once, the lists of
+    word ids stay in the file.
+    """
+    def __init__(self, kgrams_file):
+        self.file = open(kgrams_file, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, number_of_words, number_of_grams, text_bytes = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{kgrams_file} is not a k-gram index written by index.py')
+        view = memoryview(self.mmap)
+        text_end = HEADER.size + text_bytes + (-text_bytes % 4)
+        lines = bytes(view[HEADER.size:HEADER.size + text_bytes]).decode('utf-8').split('\n') if text_bytes else []
+        self.words = lines[:number_of_words]
+        self.terms = lines[number_of_words:2 * number_of_words]
+        self.gram_numbers = {gram: i for i, gram in enumerate(lines[2 * number_of_words:])}
+        offsets_end = text_end + (number_of_grams + 1) * 4
+        self.offsets = view[text_end:offsets_end].cast(WORD_ID_TYPECODE)
+        self.word_ids = view[offsets_end:].cast(WORD_ID_TYPECODE)
+
+    def word_list(self, gram):
+        gram_number = self.gram_numbers.get(gram)
+        if gram_number is None:
+            return self.word_ids[0:0]
+        return self.word_ids[self.offsets[gram_number]:self.offsets[gram_number + 1]]
+
+    def matching_words(self, pattern):
+        """
+        Ids of the words that match the pattern, ascending.
+        """
+        pattern = pattern.lower()
+        prefix = pattern.split(WILDCARD)[0]
+        low = bisect.bisect_left(self.words, prefix)
+        high = bisect.bisect_left(self.words, prefix + '\U0010ffff')  # past every word that starts with the prefix
+
+        # the k-grams of the pattern after its prefix (the range already covers the prefix), rarest first
+        pieces = (BOUNDARY + pattern + BOUNDARY).split(WILDCARD)[1:]
+        grams = {gram for piece in pieces for gram in kgrams(piece)}
+        word_lists = sorted((self.word_list(gram) for gram in grams), key=len)
+        if word_lists:
+            first = word_lists[0]
+            # the lists are sorted, so the range of the prefix is a slice of the rarest one
+            candidates = set(first[bisect.bisect_left(first, low):bisect.bisect_left(first, high)].tolist())
+            for word_list in word_lists[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(word_list.tolist())
+            candidates = sorted(candidates)
+        else:
+            candidates = range(low, high)
+
+        regex = pattern_regex(pattern)
+        return [word_id for word_id in candidates if regex.fullmatch(self.words[word_id])]
+
+    def expand(self, pattern):
+        """
+        The (distinct) terms of the words that match the pattern, sorted.
+        """
+        return sorted({self.terms[word_id] for word_id in self.matching_words(pattern)})
+
+    def close(self):
+        for view in (self.offsets, self.word_ids):
+            view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+        self.file.close()